@@ -0,0 +1,80 @@
+from __future__ import print_function, division, absolute_import
+
+import os
+import timeit
+import numpy as np
+
+from odin.fuel import MmapData, ChunkedData
+
+# ~ 120 MB of log-power spectrogram
+N = 240000
+X = np.concatenate([
+    np.log(np.abs(np.fft.rfft(np.random.randn(24000, 254), axis=-1)) ** 2 + 1e-8)
+    for i in range(N // 24000)], axis=0).astype('float32')
+
+
+def drop_cache(path):
+    """ Evict the file from the OS page cache, return False if not
+    possible (need python >= 3.3 or root access) """
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        return True
+    try:
+        os.system('sync')
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except (IOError, OSError):
+        return False
+
+# ====== writing ====== #
+start = timeit.default_timer()
+mmap = MmapData('tmp.mmap', dtype='float32', shape=(None, 128))
+mmap.append(X)
+mmap.flush(); mmap.close()
+print('Writing data to Memmap :', timeit.default_timer() - start, 's')
+
+for codec in ('zlib', 'lz4'):
+    start = timeit.default_timer()
+    try:
+        chunk = ChunkedData('tmp.%s' % codec, dtype='float32',
+                            shape=(None, 128), codec=codec)
+    except ValueError as e: # codec not available
+        print(e)
+        continue
+    chunk.append(X)
+    chunk.flush(); chunk.close()
+    print('Writing data to Chunked (%s):' % codec,
+          timeit.default_timer() - start, 's')
+
+# ====== disk size ====== #
+print()
+files = [i for i in ('tmp.mmap', 'tmp.zlib', 'tmp.lz4') if os.path.exists(i)]
+for f in files:
+    print('Size %-9s: %.2f MB' % (f, os.path.getsize(f) / 1024. / 1024.))
+
+# ====== read throughput ====== #
+print()
+cold = True
+for f in files:
+    cold &= drop_cache(f)
+    data = MmapData(f) if f == 'tmp.mmap' else ChunkedData(f, read_only=True)
+    start = timeit.default_timer()
+    for x in data.set_batch(256, seed=None):
+        x.sum() # make sure the batch is actually read
+    duration = timeit.default_timer() - start
+    print('Iterate %-9s (%s cache): %.4f s, %.2f MB/s' %
+          (f, 'cold' if cold else 'warm', duration,
+           X.nbytes / 1024. / 1024. / duration))
+    data.close()
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+for f in files:
+    os.remove(f)
@@ -69,6 +69,42 @@ for epoch in range(0, 3):
         x = mmap[i:i + 256]
 print('Iterate Memmap data  :', timeit.default_timer() - start, 's')
 
+# ====== cold-cache reading ====== #
+def drop_cache(path):
+    """ Evict the file from the OS page cache, return False if not
+    possible (need python >= 3.3 or root access) """
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        return True
+    try:
+        os.system('sync')
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except (IOError, OSError):
+        return False
+
+hdf5.close()
+mmap.close()
+print()
+cold = drop_cache('tmp.mmap')
+if not cold:
+    print('Cannot drop the page cache, reporting warm-cache reads')
+for prefetch in (0, 4):
+    drop_cache('tmp.mmap')
+    mmap = MmapData('tmp.mmap').set_prefetch(prefetch)
+    start = timeit.default_timer()
+    for x in mmap.set_batch(256, seed=None):
+        x = np.tanh(x).sum() # simulate some processing on each batch
+    print('Iterate Memmap %s (prefetch=%d):' % ('cold' if cold else 'warm', prefetch),
+          timeit.default_timer() - start, 's')
+    mmap.close()
+
 # ===========================================================================
 # Clean-up
 # ===========================================================================
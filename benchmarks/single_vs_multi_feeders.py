@@ -119,3 +119,12 @@ with UnitTimer():
     for _, (i, j) in enumerate(data):
         f_train(i, j)
 print(_)
+
+# ====== ordered (reproducible) vs unordered multi-processes ====== #
+for ordered in (False, True):
+    data.set_multiprocessing(ncpu=4, ordered=ordered)
+    print('ncpu=4, ordered=%s' % ordered)
+    with UnitTimer():
+        for _, (i, j) in enumerate(data.set_batch(batch_size=128, seed=12)):
+            f_train(i, j)
+    print(_)
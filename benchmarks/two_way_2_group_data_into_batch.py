@@ -124,3 +124,17 @@ def test():
                 # print(i.shape, j.shape)
                 pass
 test()
+
+
+# ====== vectorized CreateBatch (single copy into the batches) ====== #
+create_batch = F.recipes.CreateBatch()
+create_batch.prepare(batch_size=64, seed=1208, shuffle_level=2)
+
+
+@profile
+def test3():
+    with UnitTimer(12):
+        for _ in range(12):
+            for i, j in create_batch.group((x0, x1, x2)):
+                pass
+test3()
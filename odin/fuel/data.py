@@ -5,7 +5,13 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import re
+import bz2
+import zlib
+import mmap
 import marshal
+import weakref
+import threading
+import itertools
 from math import ceil
 from abc import ABCMeta, abstractmethod
 from six import add_metaclass
@@ -13,7 +19,7 @@ from six.moves import range, zip, zip_longest
 
 import numpy as np
 
-from odin.utils.decorators import autoattr, cache
+from odin.utils.decorators import autoattr, cache, _LRUCache
 from odin.utils import queue, struct, as_tuple
 
 __all__ = [
@@ -25,7 +31,9 @@ __all__ = [
     'Data',
     'ArrayData',
     'MmapData',
+    'QuantizedData',
     'Hdf5Data',
+    'ChunkedData',
     'DataIterator',
     'DataMerge'
 ]
@@ -99,21 +107,398 @@ def _get_chunk_size(shape, size):
     return True
 
 
-def _validate_operate_axis(axis):
-    ''' as we iterate over first dimension, it is prerequisite to
-    have 0 in the axis of operator
-    '''
+# x can be percantage or number of samples
+_apply_approx = lambda n, x: int(round(n * x)) if x < 1. + 1e-12 else int(x)
+
+
+# ====== streaming statistics ====== #
+def _normalize_stats_axis(axis, ndim):
+    ''' return a sorted tuple of non-negative axes, `None` means all axes '''
+    if axis is None:
+        return tuple(range(ndim))
     if not isinstance(axis, (tuple, list)):
-        axis = [axis]
-    axis = tuple(int(i) for i in axis)
-    if 0 not in axis:
-        raise ValueError('Expect 0 in the operating axis because we always'
-                         ' iterate data over the first dimension.')
-    return axis
+        axis = (axis,)
+    return tuple(sorted(set(int(i) % ndim for i in axis)))
 
 
-# x can be percantage or number of samples
-_apply_approx = lambda n, x: int(round(n * x)) if x < 1. + 1e-12 else int(x)
+def _chunk_moments(x, axis):
+    ''' Moments of one chunk reduced over `axis`:
+    [count, sum, mean, M2, min, max], all accumulators are float64, min and
+    max keep the original dtype.
+    '''
+    n = int(np.prod([x.shape[i] for i in axis]))
+    # min and max are taken on the original values
+    x_min = np.min(x, axis=axis)
+    x_max = np.max(x, axis=axis)
+    # only one float64 temporary for the whole chunk, updated in-place
+    x = np.array(x, dtype='float64')
+    x_sum = np.sum(x, axis=axis)
+    mean = np.sum(x, axis=axis, keepdims=True) / n
+    x -= mean
+    x *= x
+    m2 = np.sum(x, axis=axis)
+    return [n, x_sum, mean.reshape(x_sum.shape), m2, x_min, x_max]
+
+
+def _merge_moments(a, b):
+    ''' Chan et al. pairwise update for two partial moments '''
+    na, nb = a[0], b[0]
+    n = na + nb
+    delta = b[2] - a[2]
+    mean = a[2] + delta * (nb / n)
+    m2 = a[3] + b[3] + delta**2 * (na * nb / n)
+    return [n, a[1] + b[1], mean, m2,
+            np.minimum(a[4], b[4]), np.maximum(a[5], b[5])]
+
+
+def _concat_moments(a, b):
+    ''' rows are independent when axis 0 is not reduced '''
+    return [a[0]] + [np.concatenate((i, j), axis=0)
+                     for i, j in zip(a[1:], b[1:])]
+
+
+def _arg_moments(mode, axis, ndim):
+    ''' Return (reduce_func, merge_func) of argmin (mode='min') or argmax
+    (mode='max'), a partial is [value, index] and the indices are global,
+    the merge keeps the first occurrence, hence, partials must be merged in
+    order of rows.
+    '''
+    arg_func = np.argmin if mode == 'min' else np.argmax
+    better = np.less if mode == 'min' else np.greater
+    axis = None if axis is None else int(axis) % ndim
+
+    def reduce_func(x, start):
+        if axis is None:
+            i = arg_func(x)
+            return [x.flat[i], i + start * int(np.prod(x.shape[1:]))]
+        i = arg_func(x, axis=axis)
+        if axis == 0:
+            return [np.take_along_axis(x, np.expand_dims(i, 0), 0)[0],
+                    i + start]
+        return [None, i]
+
+    def merge_func(a, b):
+        # rows are independent when axis 0 is not reduced
+        if axis is not None and axis != 0:
+            return [None, np.concatenate((a[1], b[1]), axis=0)]
+        mask = better(b[0], a[0])
+        return [np.where(mask, b[0], a[0]), np.where(mask, b[1], a[1])]
+    return reduce_func, merge_func
+
+
+def _block_rows(shape, itemsize, block_size, nb_blocks=1):
+    ''' Number of rows of one block (at most `block_size` bytes of float64,
+    and at least `nb_blocks` blocks), rounded down, so each block spans a
+    whole number of memory pages if the block is large enough.
+    '''
+    row_size = int(np.prod(shape[1:]))
+    rows = max(1, int(block_size) // max(1, row_size * 8))
+    rows = max(1, min(rows, int(ceil(shape[0] / nb_blocks))))
+    row_bytes = row_size * itemsize
+    align = mmap.PAGESIZE // int(np.gcd(row_bytes, mmap.PAGESIZE)) \
+        if row_bytes > 0 else 1
+    return rows // align * align if rows >= align else rows
+
+
+def _scan_rows(data, start, end, rows, transformer, reduce_func, merge_func):
+    ''' Reduce rows [start, end) of `data` block-by-block '''
+    partial = None
+    for i in range(start, end, rows):
+        p = reduce_func(transformer(data[i:min(i + rows, end)]), i)
+        partial = p if partial is None else merge_func(partial, p)
+    return partial
+
+
+def _parallel_scan(tasks, ncpu):
+    ''' Scan many arrays using a pool of processes.
+
+    Parameters
+    ----------
+    tasks : list
+        list of (key, opener, nb_rows, rows, transformer, reduce_func,
+        merge_func), `opener` is called in the worker process to open the
+        array (e.g. the memmap in read-only mode), `rows` is the number of
+        rows of one block.
+    ncpu : int
+        number of processes
+
+    Return
+    ------
+    dict: key -> reduced result of the whole array
+
+    Note
+    ----
+    The rows of each array are split into contiguous segments (a multiple
+    of `rows`), each process reduces its segments locally, and the main
+    process only merges one partial per segment, in order of rows.
+    '''
+    from odin.utils.mpi import MPI
+    tasks = {t[0]: t[1:] for t in tasks}
+    jobs = []
+    for key, (opener, n, rows, _, _, _) in tasks.iteritems():
+        seg = int(ceil(ceil(n / rows) / ncpu)) * rows
+        jobs += [(key, i, min(i + seg, n)) for i in range(0, n, seg)]
+
+    def map_func(jobs):
+        opened = {}
+        for key, start, end in jobs:
+            opener, n, rows, transformer, reduce_func, merge_func = tasks[key]
+            if key not in opened:
+                opened[key] = opener()
+            yield (key, start, _scan_rows(opened[key], start, end, rows,
+                transformer, reduce_func, merge_func))
+    partials = sorted(MPI(jobs, map_func, ncpu=ncpu, buffer_size=1),
+                      key=lambda x: (x[0], x[1]))
+    results = {}
+    for key, start, p in partials:
+        results[key] = p if key not in results else tasks[key][-1](results[key], p)
+    return results
+
+
+_INPLACE_OPS = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+    'div': np.true_divide,
+    'floordiv': np.floor_divide,
+    'pow': np.power,
+}
+
+
+def _lazy_operator(data, ufunc, y=None):
+    ''' Lazy element-wise operator, the result is a `DataMerge` which
+    evaluates `ufunc` per batch (during iteration or slicing), row-aligned
+    operands are sliced together with `data`, the others are broadcasted.
+    '''
+    n = data.shape[0]
+    if isinstance(y, np.ndarray) and y.ndim == len(data.shape) and \
+    y.shape[0] == n:
+        y = ArrayData(y)
+    elif isinstance(y, Data) and y.shape[0] != n:
+        y = y[:]
+    if y is None:
+        return DataMerge([data], lambda x: ufunc(x[0]))
+    if isinstance(y, Data):
+        return DataMerge([data, y], lambda x: ufunc(x[0], x[1]))
+    return DataMerge([data], lambda x: ufunc(x[0], y))
+
+
+def _stats_moments(data, axis, transformer):
+    ''' Return (reduce_func, merge_func) for the fused statistics '''
+    axis = _normalize_stats_axis(axis, transformer(data[:1]).ndim)
+    return ((lambda x, start: _chunk_moments(x, axis)),
+            _merge_moments if 0 in axis else _concat_moments)
+
+
+def _finalize_moments(moments):
+    n, x_sum, mean, m2, x_min, x_max = moments
+    var = m2 / n
+    return {'n': n, 'sum': x_sum, 'sum2': m2 + mean**2 * n,
+            'min': x_min, 'max': x_max,
+            'mean': mean, 'var': var, 'std': np.sqrt(var)}
+
+
+# ====== random-access reads ====== #
+def _madvise(x, runs, advice='MADV_WILLNEED'):
+    ''' Give the kernel an `advice` (name of the mmap constant) about the
+    rows of each run (start, end) of a numpy.memmap, return False if
+    `madvise` is not available (python < 3.8).
+
+    Note
+    ----
+    MADV_WILLNEED covers all the pages touched by the rows, MADV_DONTNEED
+    only the pages fully inside the rows.
+    '''
+    m = getattr(x, '_mmap', None)
+    if m is None or not hasattr(m, 'madvise') or not hasattr(mmap, advice):
+        return False
+    advice = getattr(mmap, advice)
+    inward = advice == getattr(mmap, 'MADV_DONTNEED', None)
+    row_bytes = x.itemsize * int(np.prod(x.shape[1:]))
+    # position of the array inside the mmap object
+    base = x.offset % mmap.ALLOCATIONGRANULARITY
+    for start, end in runs:
+        start = base + int(start) * row_bytes
+        end = base + int(end) * row_bytes
+        start = start + (-start % mmap.PAGESIZE if inward else
+                         -(start % mmap.PAGESIZE))
+        if inward:
+            end -= end % mmap.PAGESIZE
+        if end <= start:
+            continue
+        try:
+            m.madvise(advice, start, end - start)
+        except (ValueError, OSError):
+            return False
+    return True
+
+
+def _touch_pages(x, start, end):
+    ''' Read one byte of each page of the rows [start, end) of a memmap,
+    so the pages are loaded into the page cache '''
+    raw = np.asarray(x[start:end]).reshape(-1).view(np.uint8)
+    if raw.shape[0] > 0:
+        np.add.reduce(raw[::mmap.PAGESIZE], dtype='uint64')
+
+
+class _Prefetcher(object):
+    ''' Read ahead the pages of the next `nb_batches` batches of a memmap
+    during iteration.
+
+    `madvise(MADV_WILLNEED)` is used if available (python >= 3.8),
+    otherwise, a background thread touches the pages of the upcoming
+    batches. If `release`, the pages of the consumed batches are dropped
+    with `MADV_DONTNEED` (only with madvise).
+
+    Parameters
+    ----------
+    data : numpy.memmap
+    batches : list
+        list of (start, end) or array of row indices, in order of reading
+    '''
+
+    def __init__(self, data, batches, nb_batches, release=False,
+                 sequential=False):
+        self.data = data
+        self.batches = batches
+        self.nb_batches = int(nb_batches)
+        self.release = release
+        self._next = 0
+        self._thread = None
+        self._use_madvise = _madvise(data, [], 'MADV_WILLNEED')
+        if self._use_madvise:
+            if sequential:
+                _madvise(data, [(0, data.shape[0])], 'MADV_SEQUENTIAL')
+        else:
+            from six.moves import queue as Queue
+            self._queue = Queue.Queue()
+            self._thread = threading.Thread(target=self._touch_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _runs(self, batch):
+        if isinstance(batch, np.ndarray):
+            return [(start, end) for _, _, start, end in
+                    _coalesce_indices(batch, self.data.shape[0])[-1]]
+        return [batch]
+
+    def _touch_loop(self):
+        while True:
+            runs = self._queue.get()
+            if runs is None:
+                break
+            for start, end in runs:
+                _touch_pages(self.data, start, end)
+
+    def advance(self, i):
+        ''' Called before reading the `i`-th batch '''
+        target = min(i + 1 + self.nb_batches, len(self.batches))
+        while self._next < target:
+            runs = self._runs(self.batches[self._next])
+            if self._use_madvise:
+                _madvise(self.data, runs, 'MADV_WILLNEED')
+            else:
+                self._queue.put(runs)
+            self._next += 1
+        if self.release and self._use_madvise and i > 0:
+            _madvise(self.data, self._runs(self.batches[i - 1]),
+                     'MADV_DONTNEED')
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread = None
+
+
+def _coalesce_indices(indices, n, max_gap=0):
+    ''' Return (unique_indices, inverse, runs), `runs` is the list of
+    (first, last, start, end): unique_indices[first:last] are read by the
+    slice [start:end] '''
+    indices = np.asarray(indices, dtype='int64')
+    if indices.ndim != 1:
+        raise ValueError('Only support 1-D list of indices.')
+    indices = np.where(indices < 0, indices + n, indices)
+    if indices.shape[0] > 0 and (indices.min() < 0 or indices.max() >= n):
+        raise IndexError('Indices out of range for data with %d rows.' % n)
+    uniq, inverse = np.unique(indices, return_inverse=True)
+    breaks = np.nonzero(np.diff(uniq) > max_gap + 1)[0] + 1
+    first = np.concatenate(([0], breaks)).astype('int64')
+    last = np.concatenate((breaks, [uniq.shape[0]])).astype('int64')
+    runs = [(i, j, uniq[i], uniq[j - 1] + 1) for i, j in zip(first, last)
+            if j > i]
+    return uniq, inverse, runs
+
+
+def _gather(data, indices, max_gap=0):
+    ''' Read rows of `data` at `indices` using the minimum number of
+    contiguous reads, the rows are returned in the order of `indices` '''
+    n = data.shape[0]
+    uniq, inverse, runs = _coalesce_indices(indices, n, max_gap)
+    _madvise(data, [(start, end) for _, _, start, end in runs])
+    out = np.empty((uniq.shape[0],) + tuple(data.shape[1:]), dtype=data.dtype)
+    for first, last, start, end in runs:
+        block = data[start:end]
+        out[first:last] = block if end - start == last - first \
+            else block[uniq[first:last] - start]
+    # already sorted and unique
+    if uniq.shape[0] == inverse.shape[0] and \
+    np.all(inverse == np.arange(inverse.shape[0])):
+        return out
+    return out[inverse]
+
+
+# ===========================================================================
+# Transform chain
+# ===========================================================================
+class _TransformChain(object):
+    ''' Callable chain of transforms applied on each batch of Data.
+
+    Each step is (func, shape, dtype), `shape` and `dtype` are either None,
+    a constant or a callable mapping the input shape (or dtype) to the
+    output one. If None, they are estimated by calling `func` on dummy data.
+    The chain is immutable, appending a step returns a new chain.
+    '''
+
+    def __init__(self, steps=()):
+        self.steps = tuple(steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __call__(self, x):
+        for func, _, _ in self.steps:
+            x = func(x)
+        return x
+
+    def append(self, func, shape=None, dtype=None):
+        return _TransformChain(self.steps + ((func, shape, dtype),))
+
+    def shape(self, shape):
+        shape = tuple(shape)
+        for func, out_shape, _ in self.steps:
+            if callable(out_shape):
+                shape = tuple(out_shape(shape))
+            elif out_shape is not None:
+                shape = tuple(out_shape)
+            else:
+                shape = _estimate_shape(shape, func)
+        return shape
+
+    def dtype(self, shape, dtype):
+        shape = tuple(shape)
+        for func, out_shape, out_dtype in self.steps:
+            if callable(out_dtype):
+                dtype = out_dtype(dtype)
+            elif out_dtype is not None:
+                dtype = out_dtype
+            else:
+                try:
+                    with np.errstate(all='ignore'):
+                        dtype = func(np.zeros((1,) + shape[1:], dtype=dtype)).dtype
+                except Exception:
+                    pass
+            shape = self.__class__([(func, out_shape, out_dtype)]).shape(shape)
+        return np.dtype(dtype)
 
 
 # ===========================================================================
@@ -130,92 +515,210 @@ class Data(object):
         self._seed = None
         self._shuffle_level = 0
         self._status = 0 # flag show that array valued changed
+        # number of processes for the reductions
+        self._ncpu = 1
+        # size in bytes of the block processed at once
+        self._block_size = BLOCK_SIZE
+        # number of batches read ahead while iterating a memmap
+        self._prefetch = 0
+        self._prefetch_release = False
         # main data object that have shape, dtype ...
         self._data = None
 
-        self._transformer = lambda x: x
+        self._transformer = _TransformChain()
+        # (MmapData, _status, transformer) of the evaluated transforms
+        self._transform_cache = None
 
     # ====== transformer ====== #
-    def transform(self, transformer):
-        if callable(transformer):
-            self._transformer = transformer
+    def transform(self, transformer, shape=None, dtype=None):
+        """ Append a transform to the chain of transforms, which are
+        applied lazily on each batch (or slice) of this Data.
+
+        Parameters
+        ----------
+        transformer : callable, None
+            function applied on an array of rows of this Data, if None,
+            remove all the transforms.
+        shape : None, tuple, callable
+            output shape of the transform, or a function mapping the input
+            shape to the output shape, if None, the shape is estimated by
+            calling `transformer` on dummy data.
+        dtype : None, str, numpy.dtype, callable
+            output dtype, or a function mapping the input dtype to the output
+            dtype, if None, the dtype is estimated by calling `transformer`
+            on one dummy row.
+
+        Example
+        -------
+        >>> x = MmapData('/tmp/x', dtype='float32', shape=(1000, 40))
+        >>> x.transform(lambda x: x[:, :13], shape=lambda s: s[:-1] + (13,))
+        >>> x.transform(lambda x: np.diff(x, axis=-1),
+        >>>             shape=lambda s: s[:-1] + (s[-1] - 1,))
+        >>> x.shape # (1000, 12)
+        """
+        if transformer is None:
+            self._transformer = _TransformChain()
+        elif callable(transformer):
+            self._transformer = self._transformer.append(transformer,
+                                                         shape, dtype)
         return self
 
-    # ==================== internal utilities ==================== #
-    ''' BigData instance store large dataset that need to be iterate over to
-    perform any operators.
-    '''
-    @cache('_status')
-    def _iterating_operator(self, ops, axis, merge_func=sum, init_val=0.):
-        '''Execute a list of ops on X given the axis or axes'''
-        # ====== validate arguments ====== #
-        if axis is not None:
-            axis = _validate_operate_axis(axis)
-        if not isinstance(ops, (tuple, list)):
-            ops = [ops]
-        # ====== trick to process list of Data ====== #
-        old_data = self._data
-        data = old_data if isinstance(old_data, (tuple, list)) else (old_data,)
-        # ====== Processing ====== #
+    def cache_transform(self, path, block_size=None):
+        """ Evaluate the transforms once, block-by-block, and store the
+        result to a sidecar MmapData at given `path`, the following
+        slicing and iteration read the sidecar instead of applying the
+        transforms. The sidecar is ignored if the data or the transforms
+        change.
+
+        Note
+        ----
+        Only transforms that process each row independently can be cached.
+        """
+        if isinstance(self._data, (tuple, list)):
+            raise ValueError('cache_transform only support Data of one array.')
+        if self._transform_cache is not None:
+            self._transform_cache[0].close()
+            self._transform_cache = None
+        if len(self._transformer) == 0:
+            return self
+        if os.path.exists(path):
+            os.remove(path)
+        cache = self.to_mmap(path, block_size=block_size)
+        self._transform_cache = (cache, self._status, self._transformer)
+        return self
+
+    def _source(self):
+        """ Return (array, transformer) to read the transformed data """
+        c = self._transform_cache
+        if c is not None:
+            if c[1] == self._status and c[2] is self._transformer:
+                return c[0].data, _TransformChain()
+            c[0].close()
+            self._transform_cache = None
+        return self._data, self._transformer
+
+    # ==================== statistics ==================== #
+    @cache('_status', '_transformer')
+    def stats(self, axis=0, block_size=None):
+        """ Compute all the summary statistics in one chunked pass over
+        the data.
+
+        Parameters
+        ----------
+        axis : None, int or list(int)
+            axes to reduce, if None, reduce over all axes
+        block_size : None, int
+            maximum size in bytes of the float64 block read at each step,
+            by default, the size given by `set_block_size`
+
+        Return
+        ------
+        dict: {'n', 'sum', 'sum2', 'min', 'max', 'mean', 'var', 'std'}
+        (list of dict if this Data contains multiple arrays)
+
+        Note
+        ----
+        Accumulators are float64 and blocks are merged using Chan's
+        pairwise update of (count, mean, M2), hence, the variance does not
+        suffer from the cancellation of `sum2 - sum**2 / n`. The result
+        is cached until the data is modified.
+        """
+        results = self._scan(
+            lambda dat: _stats_moments(dat, axis, self._transformer),
+            block_size)
+        if isinstance(self._data, (tuple, list)):
+            return [_finalize_moments(i) for i in results]
+        return _finalize_moments(results)
+
+    def _arg_reduce(self, mode, axis, block_size=None):
+        ndim = lambda dat: self._transformer(dat[:1]).ndim
+        results = self._scan(
+            lambda dat: _arg_moments(mode, axis, ndim(dat)), block_size)
+        if axis is None:
+            get = lambda r: int(r[1])
+        else:
+            get = lambda r: r[1]
+        if isinstance(self._data, (tuple, list)):
+            return [get(r) for r in results]
+        return get(results)
+
+    def _scan_task(self, key, moments, block_size=None, ncpu=None):
+        """ Return the task for `_parallel_scan`, or None if this Data
+        cannot be opened by the worker processes. """
+        opener = self._opener()
+        if opener is None:
+            return None
+        self.flush()
+        block_size = self._block_size if block_size is None else block_size
+        shape = self._data.shape
+        if shape[0] == 0:
+            raise ValueError('Cannot reduce empty Data.')
+        rows = _block_rows(shape, np.dtype(self._data.dtype).itemsize,
+                           block_size, self._ncpu if ncpu is None else ncpu)
+        return (key, opener, shape[0], rows, self._transformer) + \
+            moments(self._data)
+
+    def _scan(self, moments, block_size=None):
+        """ Reduce the data block-by-block, `moments(data)` returns the
+        (reduce_func, merge_func), the blocks are reduced by a pool of
+        `ncpu` processes if possible. """
+        if self._ncpu > 1 and not isinstance(self._data, (tuple, list)):
+            task = self._scan_task(0, moments, block_size)
+            if task is not None:
+                return _parallel_scan([task], self._ncpu)[0]
+        # ====== single process ====== #
+        block_size = self._block_size if block_size is None else block_size
+        data = self._data if isinstance(self._data, (tuple, list)) \
+            else (self._data,)
         results = []
         for dat in data:
-            self._data = dat
-            # init values all zeros
-            s = None
-            old_seed = self._seed
-            old_start = self._start
-            old_end = self._end
-            # less than million data points, not a big deal
-            it = self.set_batch(start=0., end=1., seed=None)._iter(); it.next()
-            for X in it:
-                if s is None:
-                    # list of results for each ops
-                    s = [o(X, axis) for o in ops]
-                else:
-                    # merge all results from last ops to new ops
-                    s = [merge_func((i, o(X, axis))) for i, o in zip(s, ops)]
-            self.set_batch(start=old_start, end=old_end, seed=old_seed)
-            results.append(s)
-        # ====== reset and return ====== #
-        self._data = old_data
-        return results if isinstance(old_data, (tuple, list)) else results[0]
-
-    def _iterate_update(self, y, ops):
-        """Support ops:
+            if dat.shape[0] == 0:
+                raise ValueError('Cannot reduce empty Data.')
+            rows = _block_rows(dat.shape, np.dtype(dat.dtype).itemsize,
+                               block_size)
+            results.append(_scan_rows(dat, 0, dat.shape[0], rows,
+                self._transformer, *moments(dat)))
+        return results if isinstance(self._data, (tuple, list)) else results[0]
+
+    def _opener(self):
+        """ Return a function that opens this data (read-only) inside a
+        worker process, None if not supported. """
+        return None
+
+    def _get_stats(self, name, axis):
+        s = self.stats(axis)
+        if isinstance(s, (tuple, list)):
+            return [i[name] for i in s]
+        return s[name]
+
+    def _iterate_update(self, updates, block_size=None):
+        """ Apply a list of in-place updates: [(ops, y), ...], fused in one
+        pass over blocks of rows (`block_size` bytes), so each block is
+        read and written only once.
+
+        Support ops:
         add; mul; div; sub; floordiv; pow
         """
+        block_size = self._block_size if block_size is None else block_size
         # ====== trick to process list of Data ====== #
-        old_data = self._data
-        data = old_data if isinstance(old_data, (tuple, list)) else (old_data,)
+        data = self._data if isinstance(self._data, (tuple, list)) \
+            else (self._data,)
         # ====== processing ====== #
         for dat in data:
-            self._data = dat
-
-            shape = self._data.shape
-            # custom batch_size
-            idx = list(range(0, shape[0], 1024))
-            if idx[-1] < shape[0]:
-                idx.append(shape[0])
-            idx = list(zip(idx, idx[1:]))
-            Y = lambda start, end: (y[start:end] if hasattr(y, 'shape') and
-                                    y.shape[0] == shape[0]
-                                    else y)
-            for i in idx:
-                start, end = i
-                if 'add' == ops:
-                    self._data[start:end] += Y
-                elif 'mul' == ops:
-                    self._data[start:end] *= Y
-                elif 'div' == ops:
-                    self._data[start:end] /= Y
-                elif 'sub' == ops:
-                    self._data[start:end] -= Y
-                elif 'floordiv' == ops:
-                    self._data[start:end] //= Y
-                elif 'pow' == ops:
-                    self._data[start:end] **= Y
-        # ====== reset ====== #
-        self._data = old_data
+            shape = dat.shape
+            # row-aligned operands are sliced, the others are broadcasted
+            Y = [(_INPLACE_OPS[ops], y, np.ndim(y) == len(shape) and
+                  y.shape[0] == shape[0])
+                 for ops, y in updates]
+            rows = _block_rows(shape, np.dtype(dat.dtype).itemsize, block_size)
+            for start in range(0, shape[0], rows):
+                end = min(start + rows, shape[0])
+                # view on memmap, or a copy for hdf5
+                x = dat[start:end]
+                for ufunc, y, sliced in Y:
+                    ufunc(x, y[start:end] if sliced else y, out=x)
+                if not isinstance(dat, np.ndarray):
+                    dat[start:end] = x
 
     # ==================== properties ==================== #
     @property
@@ -228,9 +731,8 @@ class Data(object):
     def shape(self):
         # auto infer new shape
         if isinstance(self._data, (tuple, list)):
-            return [_estimate_shape(dat.shape, self._transformer)
-                   for dat in self._data]
-        return _estimate_shape(self._data.shape, self._transformer)
+            return [self._transformer.shape(dat.shape) for dat in self._data]
+        return self._transformer.shape(self._data.shape)
 
     def __len__(self):
         """ len always return 1 number """
@@ -249,14 +751,16 @@ class Data(object):
     @property
     def dtype(self):
         if isinstance(self._data, (tuple, list)):
-            return [dat.dtype for dat in self._data]
-        return self._data.dtype
+            return [self._transformer.dtype(dat.shape, dat.dtype)
+                    for dat in self._data]
+        return self._transformer.dtype(self._data.shape, self._data.dtype)
 
     @property
     def array(self):
         if isinstance(self._data, (tuple, list)):
             return [self._transformer(dat[:]) for dat in self._data]
-        return self._transformer(self._data[:])
+        data, transformer = self._source()
+        return transformer(data[:])
 
     def tolist(self):
         array = self.array
@@ -266,6 +770,36 @@ class Data(object):
             array = array.tolist()
         return array
 
+    def to_mmap(self, path, dtype=None, block_size=None):
+        """ Evaluate this Data block-by-block and write the result to a new
+        MmapData at given `path` (e.g. to store a lazy expression like
+        `(x - mean) / std` without creating the whole array in memory).
+
+        Parameters
+        ----------
+        path : str
+            path to the new MmapData file
+        dtype : None, str or numpy.dtype
+            dtype of the output, by default, the dtype of this Data
+        block_size : None, int
+            size in bytes of each block, by default, the size given by
+            `set_block_size`
+        """
+        if isinstance(self._data, (tuple, list)) and \
+        not isinstance(self, DataMerge):
+            raise ValueError('to_mmap only support Data of one array.')
+        if os.path.exists(path):
+            raise ValueError('File at path: %s already exists.' % path)
+        shape = self.shape
+        dtype = self.dtype if dtype is None else dtype
+        block_size = self._block_size if block_size is None else block_size
+        out = MmapData(path, dtype=dtype, shape=shape)
+        rows = _block_rows(shape, np.dtype(dtype).itemsize, block_size)
+        for start in range(0, shape[0], rows):
+            out[start:start + rows] = self[start:start + rows]
+        out.flush()
+        return out
+
     @property
     def batch_size(self):
         return self._batch_size
@@ -293,7 +827,9 @@ class Data(object):
         shuffle_level: int
             0: only shuffle the order of each batch
             1: shuffle the order of batches and inside each batch as well.
-            2: includes level 0 and 1, and custom shuffling (strongest form)
+            2: includes level 0 and 1, and custom shuffling
+            3: sample-level shuffling, each batch contains random rows of
+            the whole data (read using `gather`), strongest form.
         """
         if isinstance(batch_size, int) and batch_size > 0:
             self._batch_size = batch_size
@@ -304,7 +840,52 @@ class Data(object):
         if end is not None and end > 0. - 1e-12:
             self._end = end
         if shuffle_level is not None:
-            self._shuffle_level = min(max(int(shuffle_level), 0), 2)
+            self._shuffle_level = min(max(int(shuffle_level), 0), 3)
+        return self
+
+    def set_ncpu(self, ncpu):
+        """ Number of processes for the reductions (sum, sum2, min, max,
+        argmin, argmax, mean, var, std, stats).
+
+        Note
+        ----
+        Only MmapData and Hdf5Data support parallel reductions, each
+        process opens the file by path in read-only mode and reduces its
+        own contiguous range of rows, so only the partial results are
+        sent back to the main process.
+        """
+        self._ncpu = max(int(ncpu), 1)
+        return self
+
+    def set_block_size(self, block_size):
+        """ Size in bytes of the block of rows processed at once by the
+        reductions, the in-place operators and `normalize`
+        (default: `BLOCK_SIZE`). """
+        self._block_size = max(int(block_size), 1)
+        return self
+
+    def set_prefetch(self, nb_batches, release=False):
+        """ Read ahead the next `nb_batches` batches while iterating, so
+        the disk reads overlap the processing of the current batch.
+
+        Parameters
+        ----------
+        nb_batches : int
+            number of batches read ahead, 0 turns off the prefetching
+        release : bool
+            if True, the pages of the consumed batches are dropped from
+            memory, so the resident set stays bounded when streaming a
+            dataset larger than RAM
+
+        Note
+        ----
+        Only applied when the data is a numpy.memmap (MmapData), using
+        `madvise` (python >= 3.8) or a background thread which touches
+        the pages of the upcoming batches otherwise (`release` is
+        ignored in this case).
+        """
+        self._prefetch = max(int(nb_batches), 0)
+        self._prefetch_release = bool(release)
         return self
 
     # ==================== Slicing methods ==================== #
@@ -312,7 +893,8 @@ class Data(object):
         if isinstance(self._data, (tuple, list)):
             return [self._transformer(dat.__getitem__(y))
                     for dat in self._data]
-        return self._transformer(self._data.__getitem__(y))
+        data, transformer = self._source()
+        return transformer(data.__getitem__(y))
 
     @autoattr(_status=lambda x: x + 1)
     def __setitem__(self, x, y):
@@ -322,6 +904,26 @@ class Data(object):
             return
         return self._data.__setitem__(x, y)
 
+    def gather(self, indices, max_gap=0):
+        """ Random-access read of the rows at given `indices`, the indices
+        are sorted and coalesced into contiguous runs, so the minimum
+        number of (sequential) reads is issued, the rows are returned in
+        the requested order (duplicated indices are allowed).
+
+        Parameters
+        ----------
+        indices : list, numpy.ndarray
+            1-D list of row indices (negative indices are supported)
+        max_gap : int
+            two runs separated by less than `max_gap` rows are merged into
+            one read (the rows in between are read and discarded)
+        """
+        if isinstance(self._data, (tuple, list)):
+            return [self._transformer(_gather(dat, indices, max_gap))
+                    for dat in self._data]
+        data, transformer = self._source()
+        return transformer(_gather(data, indices, max_gap))
+
     # ==================== iteration ==================== #
     def _iter(self):
         # TODO: iter support _data is a list of Data
@@ -342,15 +944,35 @@ class Data(object):
         idx = list(zip(idx, idx[1:]))
 
         rand = None if seed is None else np.random.RandomState(seed=seed)
-        if rand is not None:
+        if rand is not None and self._shuffle_level >= 3:
+            # sample-level shuffling, each batch is gathered from random rows
+            perm = start + rand.permutation(end - start)
+            idx = [perm[i:i + batch_size]
+                   for i in range(0, perm.shape[0], batch_size)]
+        elif rand is not None:
             rand.shuffle(idx)
 
+        data, transformer = self._source()
         yield None # this dummy return to make everything initialized
-        for start, end in idx:
-            x = self._transformer(self._data[start:end])
-            if rand is not None and self._shuffle_level > 0:
-                x = x[rand.permutation(x.shape[0])]
-            yield x
+        prefetcher = None
+        if self._prefetch > 0 and isinstance(data, np.memmap):
+            prefetcher = _Prefetcher(data, idx, self._prefetch,
+                                     release=self._prefetch_release,
+                                     sequential=rand is None)
+        try:
+            for n, i in enumerate(idx):
+                if prefetcher is not None:
+                    prefetcher.advance(n)
+                if isinstance(i, np.ndarray):
+                    yield transformer(_gather(data, i))
+                    continue
+                x = transformer(data[i[0]:i[1]])
+                if rand is not None and self._shuffle_level > 0:
+                    x = x[rand.permutation(x.shape[0])]
+                yield x
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
 
     def __iter__(self):
         it = self._iter()
@@ -489,11 +1111,7 @@ class MutableData(Data):
 
     # ==================== high-level operators ==================== #
     def sum(self, axis=0):
-        ops = lambda x, axis: np.sum(x, axis=axis)
-        results = self._iterating_operator(ops, axis)
-        if isinstance(self._data, (tuple, list)):
-            return [i[0] for i in results]
-        return results[0]
+        return self._get_stats('sum', axis)
 
     def cumsum(self, axis=None):
         if isinstance(self._data, (tuple, list)):
@@ -501,11 +1119,7 @@ class MutableData(Data):
         return self.array.cumsum(axis)
 
     def sum2(self, axis=0):
-        ops = lambda x, axis: np.sum(np.power(x, 2), axis=axis)
-        results = self._iterating_operator(ops, axis)
-        if isinstance(self._data, (tuple, list)):
-            return [i[0] for i in results]
-        return results[0]
+        return self._get_stats('sum2', axis)
 
     def pow(self, y):
         if isinstance(self._data, (tuple, list)):
@@ -513,14 +1127,7 @@ class MutableData(Data):
         return self.array.__pow__(y)
 
     def min(self, axis=None):
-        ops = lambda x, axis: np.min(x, axis=axis)
-        results = self._iterating_operator(ops, axis,
-            merge_func=lambda x: np.where(x[0] < x[1], x[0], x[1]),
-            init_val=float('inf'))
-
-        if isinstance(self._data, (tuple, list)):
-            return [i[0] for i in results]
-        return results[0]
+        return self._get_stats('min', axis)
 
     def argmin(self, axis=None):
         if isinstance(self._data, (tuple, list)):
@@ -528,14 +1135,7 @@ class MutableData(Data):
         return self.array.argmin(axis)
 
     def max(self, axis=None):
-        ops = lambda x, axis: np.max(x, axis=axis)
-        results = self._iterating_operator(ops, axis,
-            merge_func=lambda x: np.where(x[0] > x[1], x[0], x[1]),
-            init_val=float('-inf'))[0]
-
-        if isinstance(self._data, (tuple, list)):
-            return [i[0] for i in results]
-        return results[0]
+        return self._get_stats('max', axis)
 
     def argmax(self, axis=None):
         if isinstance(self._data, (tuple, list)):
@@ -543,41 +1143,13 @@ class MutableData(Data):
         return self.array.argmax(axis)
 
     def mean(self, axis=0):
-        sum1 = self.sum(axis)
-
-        axis = _validate_operate_axis(axis)
-
-        if isinstance(sum1, (tuple, list)):
-            results = []
-            for s, shape in zip(sum1, self.shape):
-                n = np.prod([shape[i] for i in axis])
-                results.append(s / n)
-            return results
-        else:
-            n = np.prod([self.shape[i] for i in axis])
-            return sum1 / n
+        return self._get_stats('mean', axis)
 
     def var(self, axis=0):
-        sum1 = self.sum(axis)
-        sum2 = self.sum2(axis)
-
-        axis = _validate_operate_axis(axis)
-
-        if isinstance(sum1, (tuple, list)):
-            results = []
-            for s1, s2, shape in zip(sum1, sum2, self.shape):
-                n = np.prod([shape[i] for i in axis])
-                results.append((s2 - np.power(s1, 2) / n) / n)
-            return results
-        else:
-            n = np.prod([self.shape[i] for i in axis])
-            return (sum2 - np.power(sum1, 2) / n) / n
+        return self._get_stats('var', axis)
 
     def std(self, axis=0):
-        variances = self.var(axis)
-        if isinstance(variances, (tuple, list)):
-            return [np.sqrt(v) for v in variances]
-        return np.sqrt(variances)
+        return self._get_stats('std', axis)
 
     def normalize(self, axis, mean=None, std=None):
         raise NotImplementedError
@@ -734,9 +1306,39 @@ class ArrayData(Data):
 # ===========================================================================
 # Memmap Data object
 # ===========================================================================
+# maximum number of MmapData mapped at the same time
 MAX_OPEN_MMAP = 120
 
 
+class _MmapPool(object):
+    """ Keep at most `MAX_OPEN_MMAP` MmapData mapped, the least recently
+    used one is unmapped when the limit is exceeded, and mapped again
+    when it is accessed (see `MmapData._unmap`). """
+
+    def __init__(self):
+        # id -> MmapData, garbage collected MmapData are removed
+        self._opened = weakref.WeakValueDictionary()
+        self._clock = itertools.count()
+
+    def touch(self, data):
+        data._last_access = next(self._clock)
+
+    def add(self, data):
+        self._opened[id(data)] = data
+        self.touch(data)
+        while len(self._opened) > MAX_OPEN_MMAP:
+            lru = min((d for d in self._opened.values() if d is not data),
+                      key=lambda d: d._last_access)
+            lru._unmap()
+        MmapData.COUNT = len(self._opened)
+
+    def remove(self, data):
+        self._opened.pop(id(data), None)
+        MmapData.COUNT = len(self._opened)
+
+_MMAP_POOL = _MmapPool()
+
+
 def _aligned_memmap_offset(dtype):
     header_size = len(MmapData.HEADER) + 8 + MmapData.MAXIMUM_HEADER_SIZE
     type_size = np.dtype(dtype).itemsize
@@ -781,37 +1383,75 @@ class MmapData(Data):
     Note
     ----
     This class always read MmapData with mode=r+
+    Any number of MmapData can be opened, only `MAX_OPEN_MMAP` of them
+    are mapped at the same time, the least recently used one is flushed
+    and unmapped, then mapped again on its next access.
+    `append` over-allocates the file geometrically (by `GROWTH_FACTOR`),
+    so appending many small arrays only remaps the file a logarithmic
+    number of times, the file is truncated to its actual size on `flush`
+    and `close`.
     """
 
     # name.float32.(8,12)
     HEADER = 'mmapdata'
     MAXIMUM_HEADER_SIZE = 486
+    # number of mapped MmapData
     COUNT = 0
+    GROWTH_FACTOR = 1.5
+    # mapped rows, all allocated rows, and (dtype, shape) of unmapped file
+    _array = None
+    _buffer = None
+    _unmapped = None
 
     @staticmethod
-    def read_header(path):
-        """ return: dtype, shape
-        Necessary information to create numpy.memmap
-        """
+    def _read_header(path):
+        """ return: dtype, shape, capacity (number of allocated rows), extra
+        (dictionary of information for subclasses) """
         f = open(path, 'r')
         if f.read(len(MmapData.HEADER)) != MmapData.HEADER:
             raise Exception('Invalid header for MmapData.')
         # 8 bytes for size of info
         try:
             size = int(f.read(8))
-            dtype, shape = marshal.loads(f.read(size))
+            info = marshal.loads(f.read(size))
         except Exception as e:
             raise Exception('Error reading memmap data file: %s' % str(e))
         f.close()
-        return dtype, shape
+        dtype, shape = info[:2]
+        # capacity is only stored when the file is over-allocated
+        capacity = info[2] if len(info) > 2 else shape[0]
+        extra = info[3] if len(info) > 3 else {}
+        return dtype, tuple(shape), capacity, extra
+
+    @staticmethod
+    def _write_header(path, dtype, shape, capacity=None, extra=None):
+        info = [str(dtype), tuple(shape)]
+        capacity = shape[0] if capacity is None else capacity
+        if capacity > shape[0] or extra:
+            info.append(int(capacity))
+        if extra:
+            info.append(extra)
+        _ = marshal.dumps(info)
+        size = len(_)
+        if size > MmapData.MAXIMUM_HEADER_SIZE:
+            raise Exception('The size of header excess maximum allowed size '
+                            '(%d bytes).' % MmapData.MAXIMUM_HEADER_SIZE)
+        f = open(path, 'r+' if os.path.exists(path) else 'w')
+        f.write(MmapData.HEADER)
+        f.write('%8d' % size)
+        f.write(_)
+        f.flush(); f.close()
+
+    @staticmethod
+    def read_header(path):
+        """ return: dtype, shape
+        Necessary information to create numpy.memmap
+        """
+        return MmapData._read_header(path)[:2]
 
     def __init__(self, path, dtype=None, shape=None, read_only=False):
         super(MmapData, self).__init__()
         self.read_only = read_only
-        # ====== increase memmap count ====== #
-        if MmapData.COUNT > MAX_OPEN_MMAP:
-            raise ValueError('Only allowed to open maximum of {} memmap file'.format(MAX_OPEN_MMAP))
-        MmapData.COUNT += 1
         # ====== check shape info ====== #
         if shape is not None:
             if not isinstance(shape, (tuple, list, np.ndarray)):
@@ -822,42 +1462,97 @@ class MmapData(Data):
         mode = 'r' if read_only else 'r+'
         # read exist file
         if os.path.exists(path):
-            dtype, shape = MmapData.read_header(path)
+            dtype, shape, capacity, self._extra = MmapData._read_header(path)
+            if self._extra.get('quantized', False) and \
+            not isinstance(self, QuantizedData):
+                raise ValueError('MmapData at path: %s is quantized, open it '
+                                 'with QuantizedData.' % path)
         # create new file
         else:
             if dtype is None or shape is None:
                 raise Exception('dtype and shape must not be None.')
-            f = open(path, 'w')
-            f.write(MmapData.HEADER)
             dtype = str(np.dtype(dtype))
             if isinstance(shape, np.ndarray):
                 shape = shape.tolist()
             if not isinstance(shape, (tuple, list)):
                 shape = (shape,)
-            _ = marshal.dumps([dtype, shape])
-            size = len(_)
-            if size > MmapData.MAXIMUM_HEADER_SIZE:
-                raise Exception('The size of header excess maximum allowed size '
-                                '(%d bytes).' % MmapData.MAXIMUM_HEADER_SIZE)
-            f.write('%8d' % size)
-            f.write(_)
-            f.close()
+            shape = tuple(shape)
+            capacity = shape[0]
+            self._extra = self._new_header_extra(dtype, shape)
+            MmapData._write_header(path, dtype, shape, extra=self._extra)
         # store variables
-        # print(_aligned_memmap_offset(dtype), shape, dtype)
-        self._data = np.memmap(path, dtype=dtype, shape=shape, mode=mode,
-                               offset=_aligned_memmap_offset(dtype))
         self._path = path
+        self._offset = self._data_offset(dtype, shape)
+        # read-only file is never extended, only map the actual rows
+        self._map(dtype, shape, shape[0] if read_only else capacity, mode)
+
+    def _new_header_extra(self, dtype, shape):
+        """ Extra information stored in the header of a new file """
+        return {}
+
+    def _data_offset(self, dtype, shape):
+        """ Position in bytes of the first row in the file """
+        return _aligned_memmap_offset(dtype)
+
+    def _map(self, dtype, shape, capacity, mode='r+'):
+        """ (Re)map the file with `capacity` rows, `_data` is the view of
+        the first `shape[0]` rows """
+        self._buffer = np.memmap(self._path, dtype=dtype, mode=mode,
+                                 shape=(capacity,) + tuple(shape[1:]),
+                                 offset=self._offset)
+        self._data = self._buffer[:shape[0]]
+        _MMAP_POOL.add(self)
+
+    def _unmap(self):
+        """ Flush and release the memmap, the file is mapped again on the
+        next access of `_data` (the mapping is freed when all the views
+        returned before are deleted) """
+        if self._array is None:
+            return
+        array, buffer = self._array, self._buffer
+        self._unmapped = (array.dtype, array.shape)
+        self._array = None
+        self._buffer = None
+        _MMAP_POOL.remove(self)
+        if not self.read_only:
+            buffer.flush()
+            self._truncate(array.dtype, array.shape, buffer.shape[0])
+
+    @property
+    def _data(self):
+        if self._array is None and self._unmapped is not None:
+            dtype, shape = self._unmapped
+            self._unmapped = None
+            self._map(dtype, shape, shape[0], 'r' if self.read_only else 'r+')
+        else:
+            _MMAP_POOL.touch(self)
+        return self._array
+
+    @_data.setter
+    def _data(self, array):
+        self._array = array
+
+    @property
+    def capacity(self):
+        """ Number of rows allocated in the file """
+        self._data # map the file if it was unmapped
+        return self._buffer.shape[0]
 
     def close(self):
-        MmapData.COUNT -= 1
-        if hasattr(self, '_data') and self._data is not None:
-            self._data._mmap.close()
-            del self._data
+        self._unmapped = None
+        if self._array is not None:
+            if not self.read_only:
+                self.flush()
+            # empty view of the memmap is a ndarray, close the buffer
+            self._buffer._mmap.close()
+            self._array = None
+            self._buffer = None
+        _MMAP_POOL.remove(self)
 
     # ==================== properties ==================== #
     @property
     def path(self):
-        return self._data.filename
+        return self._path
 
     @property
     def name(self):
@@ -867,123 +1562,116 @@ class MmapData(Data):
         return '<MMAP dataset "%s": shape %s, type "<%s">' % \
         (self.name, self.shape, self.dtype)
 
+    def _opener(self):
+        path, dtype, shape = self._path, self._data.dtype, self._data.shape
+        offset = self._offset
+        return lambda: np.memmap(path, dtype=dtype, shape=shape, mode='r',
+                                 offset=offset)
+
     # ==================== High-level operator ==================== #
-    @cache('_status')
     def sum(self, axis=0):
-        return self._data.sum(axis)
+        return self._get_stats('sum', axis)
 
     @cache('_status')
     def cumsum(self, axis=None):
         return self._data.cumsum(axis)
 
-    @cache('_status')
     def sum2(self, axis=0):
-        return self._data.__pow__(2).sum(axis)
+        return self._get_stats('sum2', axis)
 
-    @cache('_status')
     def pow(self, y):
-        return self._data.__pow__(y)
+        return self.__pow__(y)
 
-    @cache('_status')
     def min(self, axis=None):
-        return self._data.min(axis)
+        return self._get_stats('min', axis)
 
-    @cache('_status')
+    @cache('_status', '_transformer')
     def argmin(self, axis=None):
-        return self._data.argmin(axis)
+        return self._arg_reduce('min', axis)
 
-    @cache('_status')
     def max(self, axis=None):
-        return self._data.max(axis)
+        return self._get_stats('max', axis)
 
-    @cache('_status')
+    @cache('_status', '_transformer')
     def argmax(self, axis=None):
-        return self._data.argmax(axis)
+        return self._arg_reduce('max', axis)
 
-    @cache('_status')
     def mean(self, axis=0):
-        sum1 = self.sum(axis)
-        if not isinstance(axis, (tuple, list)):
-            axis = (axis,)
-        n = np.prod([self._data.shape[i] for i in axis])
-        return sum1 / n
+        return self._get_stats('mean', axis)
 
-    @cache('_status')
     def var(self, axis=0):
-        sum1 = self.sum(axis)
-        sum2 = self.sum2(axis)
-        if not isinstance(axis, (tuple, list)):
-            axis = (axis,)
-        n = np.prod([self._data.shape[i] for i in axis])
-        return (sum2 - np.power(sum1, 2) / n) / n
+        return self._get_stats('var', axis)
 
-    @cache('_status')
     def std(self, axis=0):
-        return np.sqrt(self.var(axis))
+        return self._get_stats('std', axis)
 
     @autoattr(_status=lambda x: x + 1)
     def normalize(self, axis, mean=None, std=None):
         mean = mean if mean is not None else self.mean(axis)
         std = std if std is not None else self.std(axis)
-        self._data -= mean
-        self._data /= std
+        # subtract and divide fused in one pass over the data
+        self._iterate_update([('sub', mean), ('div', std)])
         return self
 
     # ==================== Special operators ==================== #
     def __add__(self, y):
-        return self._data.__add__(y)
+        return _lazy_operator(self, np.add, y)
 
     def __sub__(self, y):
-        return self._data.__sub__(y)
+        return _lazy_operator(self, np.subtract, y)
 
     def __mul__(self, y):
-        return self._data.__mul__(y)
+        return _lazy_operator(self, np.multiply, y)
 
     def __div__(self, y):
-        return self._data.__div__(y)
+        return _lazy_operator(self, np.divide, y)
+
+    def __truediv__(self, y):
+        return _lazy_operator(self, np.true_divide, y)
 
     def __floordiv__(self, y):
-        return self._data.__floordiv__(y)
+        return _lazy_operator(self, np.floor_divide, y)
 
     def __pow__(self, y):
-        return self._data.__pow__(y)
+        return _lazy_operator(self, np.power, y)
 
     @autoattr(_status=lambda x: x + 1)
     def __iadd__(self, y):
-        self._data.__iadd__(y)
+        self._iterate_update([('add', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __isub__(self, y):
-        self._data.__isub__(y)
+        self._iterate_update([('sub', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __imul__(self, y):
-        self._data.__imul__(y)
+        self._iterate_update([('mul', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __idiv__(self, y):
-        self._data.__idiv__(y)
+        self._iterate_update([('div', y)])
         return self
 
+    __itruediv__ = __idiv__
+
     @autoattr(_status=lambda x: x + 1)
     def __ifloordiv__(self, y):
-        self._data.__ifloordiv__(y)
+        self._iterate_update([('floordiv', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __ipow__(self, y):
-        return self._data.__ipow__(y)
+        self._iterate_update([('pow', y)])
+        return self
 
     def __neg__(self):
-        self._data.__neg__()
-        return self
+        return _lazy_operator(self, np.negative)
 
     def __pos__(self):
-        self._data.__pos__()
-        return self
+        return _lazy_operator(self, np.positive)
 
     # ==================== Save ==================== #
     def resize(self, shape):
@@ -1001,25 +1689,258 @@ class MmapData(Data):
             raise ValueError('Only support extend memmap, and do not shrink the memory')
         elif shape[0] == self._data.shape[0]: # nothing to resize
             return self
-        mmap.flush()
-        # resize by create new memmap and also rename old file
         shape = (shape[0],) + tuple(mmap.shape[1:])
         dtype = str(mmap.dtype)
-        # rewrite the header
-        f = open(self._path, 'r+')
-        f.seek(len(MmapData.HEADER))
-        _ = marshal.dumps([dtype, shape])
-        size = len(_)
-        f.write('%8d' % size)
-        f.write(_)
-        f.flush(); f.close()
-        # extend the memmap
-        self._data = np.memmap(self._path, dtype=dtype, mode='r+', shape=shape,
-                               offset=_aligned_memmap_offset(dtype))
+        # enough rows were reserved, only extend the view, the header still
+        # keeps the logical shape up to date for other readers
+        if shape[0] <= self.capacity:
+            MmapData._write_header(self._path, dtype, shape, self.capacity,
+                                   self._extra)
+            self._data = self._buffer[:shape[0]]
+            return self
+        # over-allocate geometrically, then remap once
+        capacity = max(shape[0], int(ceil(self.capacity * MmapData.GROWTH_FACTOR)))
+        self._buffer.flush()
+        MmapData._write_header(self._path, dtype, shape, capacity, self._extra)
+        self._map(dtype, shape, capacity)
         return self
 
+    def _truncate(self, dtype, shape, capacity):
+        """ Truncate the reserved rows and save the actual shape, return
+        True if the file was truncated """
+        if capacity <= shape[0]:
+            return False
+        MmapData._write_header(self._path, dtype, shape, extra=self._extra)
+        with open(self._path, 'r+') as f:
+            f.truncate(self._offset +
+                       shape[0] * dtype.itemsize * int(np.prod(shape[1:])))
+        return True
+
     def flush(self):
-        self._data.flush()
+        shape, dtype = self._data.shape, self._data.dtype
+        self._buffer.flush()
+        if self.read_only:
+            return
+        if self._truncate(dtype, shape, self.capacity):
+            self._map(dtype, shape, shape[0])
+
+
+# ===========================================================================
+# Quantized Memmap Data
+# ===========================================================================
+class QuantizedData(MmapData):
+
+    """ MmapData stored in low precision (float16 or int8), each column
+    (i.e. each index of the dimensions after the first one) is stored as
+    `(x - offset) / scale`, the rows are dequantized to float32 lazily on
+    reading (slicing, iteration, gather and reductions).
+
+    Parameters
+    ----------
+    path : str
+        path to the file
+    dtype : str
+        storage type, 'float16' or 'int8'
+    shape : tuple
+        only for creating new file
+    scale : None, numpy.ndarray
+        scale of each column (broadcastable to `shape[1:]`), by default 1.
+    offset : None, numpy.ndarray
+        offset of each column (broadcastable to `shape[1:]`), by default 0.
+    read_only : bool
+        open the file in read-only mode
+
+    Note
+    ----
+    Use `QuantizedData.fit` to compute the scale and offset from an array.
+    For int8, the range [offset - 127 * scale, offset + 127 * scale] is
+    extended when new values fall outside of it, the stored rows are then
+    requantized to the new scale and offset (i.e. the values are never
+    clipped, but each refit rewrites the whole file).
+    Adding, subtracting, multiplying or dividing by a scalar or a
+    column-wise value (e.g. `normalize`) only updates the scale and
+    offset, the stored values are not rewritten.
+
+    Example
+    -------
+    >>> scale, offset = QuantizedData.fit(X, 'int8')
+    >>> x = QuantizedData('/tmp/x', dtype='int8', shape=(None,) + X.shape[1:],
+    >>>                   scale=scale, offset=offset)
+    >>> x.append(X)
+    >>> x[:8].dtype # float32
+    """
+
+    SUPPORT_DTYPES = ('float16', 'int8')
+
+    @staticmethod
+    def fit(x, dtype):
+        """ Return the (scale, offset) of each column to quantize `x` to
+        given `dtype` ('float16': standardized by mean and std, 'int8':
+        the range [min, max] mapped to [-127, 127]). """
+        x = np.asarray(x, dtype='float64')
+        if str(np.dtype(dtype)) == 'float16':
+            offset, scale = x.mean(axis=0), x.std(axis=0)
+        else:
+            lo, hi = x.min(axis=0), x.max(axis=0)
+            offset, scale = (hi + lo) / 2., (hi - lo) / 254.
+        scale[scale == 0.] = 1.
+        return scale.astype('float32'), offset.astype('float32')
+
+    def __init__(self, path, dtype='float16', shape=None, scale=None,
+                 offset=None, read_only=False):
+        if str(np.dtype(dtype)) not in QuantizedData.SUPPORT_DTYPES:
+            raise ValueError('QuantizedData only support dtype: %s, but '
+                             'given: %s' % (QuantizedData.SUPPORT_DTYPES, dtype))
+        is_new = not os.path.exists(os.path.abspath(path))
+        super(QuantizedData, self).__init__(path, dtype=dtype, shape=shape,
+                                            read_only=read_only)
+        # scale and offset are kept in memory (no extra mapping), and
+        # written to the file when they are modified
+        shape = (2,) + tuple(self._data.shape[1:])
+        if is_new:
+            self._params = np.empty(shape, dtype='float32')
+            self._params[0] = 1. if scale is None else scale
+            self._params[1] = 0. if offset is None else offset
+            self._write_params()
+        elif scale is not None or offset is not None:
+            raise ValueError('scale and offset can only be given when '
+                             'creating new QuantizedData.')
+        else:
+            with open(self._path, 'rb') as f:
+                f.seek(_aligned_memmap_offset('float32'))
+                self._params = np.fromfile(f, dtype='float32',
+                    count=int(np.prod(shape))).reshape(shape)
+        self._transformer = self._dequantizer()
+
+    def _new_header_extra(self, dtype, shape):
+        return {'quantized': True}
+
+    def _data_offset(self, dtype, shape):
+        # scale and offset (float32) are stored before the rows
+        return _aligned_memmap_offset('float32') + \
+            2 * 4 * int(np.prod(shape[1:]))
+
+    def _write_params(self):
+        with open(self._path, 'r+b') as f:
+            f.seek(_aligned_memmap_offset('float32'))
+            f.write(self._params.tostring())
+
+    # ==================== quantization ==================== #
+    @property
+    def scale(self):
+        return np.array(self._params[0])
+
+    @property
+    def offset(self):
+        return np.array(self._params[1])
+
+    def _dequantizer(self):
+        scale, offset = self._params[0], self._params[1]
+
+        def dequantize(x):
+            x = x.astype('float32')
+            x *= scale
+            x += offset
+            return x
+        return _TransformChain([(dequantize, lambda s: s, 'float32')])
+
+    def _refit(self, arrays):
+        """ int8 only: extend the range of the columns to cover the given
+        arrays, and requantize the stored rows to the new scale and offset """
+        if self._data.dtype != np.int8:
+            return
+        arrays = [np.asarray(a, dtype='float32') for a in arrays]
+        arrays = [a for a in arrays if a.shape[0] > 0]
+        if len(arrays) == 0:
+            return
+        scale, offset = self._params[0], self._params[1]
+        width = 127. * np.abs(scale.astype('float64'))
+        lo = offset - width
+        hi = offset + width
+        new_lo = np.minimum(lo, np.min([a.min(axis=0) for a in arrays], axis=0))
+        new_hi = np.maximum(hi, np.max([a.max(axis=0) for a in arrays], axis=0))
+        if np.all(new_lo >= lo) and np.all(new_hi <= hi):
+            return
+        new_offset = ((new_hi + new_lo) / 2.).astype('float32')
+        new_scale = ((new_hi - new_lo) / 254.).astype('float32')
+        new_scale[new_scale == 0.] = 1.
+        # requantize the stored rows block by block
+        data = self._data
+        block = _block_rows(data.shape, data.dtype.itemsize, self._block_size)
+        for start in range(0, data.shape[0], block):
+            x = data[start:start + block].astype('float32') * scale + offset
+            data[start:start + block] = np.clip(
+                np.rint((x - new_offset) / new_scale), -127, 127)
+        self._params[0] = new_scale
+        self._params[1] = new_offset
+        self._write_params()
+
+    def _quantize(self, x):
+        x = (np.asarray(x, dtype='float32') - self._params[1]) / self._params[0]
+        if self._data.dtype == np.int8:
+            x = np.clip(np.rint(x), -127, 127)
+        return x.astype(self._data.dtype)
+
+    def transform(self, transformer, shape=None, dtype=None):
+        super(QuantizedData, self).transform(transformer, shape, dtype)
+        # the dequantization is always the first transform
+        if transformer is None:
+            self._transformer = self._dequantizer()
+        return self
+
+    def _iterate_update(self, updates, block_size=None):
+        # x = q * scale + offset, a column-wise affine update of x only
+        # changes the scale and offset
+        ndim = self._data.ndim
+        scale, offset = self._params[0], self._params[1]
+        for ops, y in updates:
+            if ops not in ('add', 'sub', 'mul', 'div') or \
+            (isinstance(y, np.ndarray) and y.ndim >= ndim) or \
+            isinstance(y, Data):
+                raise ValueError('QuantizedData only support add, sub, mul '
+                                 'and div with scalar or column-wise value.')
+            y = np.asarray(y, dtype='float32')
+            if ops == 'add':
+                offset += y
+            elif ops == 'sub':
+                offset -= y
+            elif ops == 'mul':
+                scale *= y; offset *= y
+            else:
+                scale /= y; offset /= y
+        self._write_params()
+
+    @cache('_status', '_transformer')
+    def cumsum(self, axis=None):
+        return self.array.cumsum(axis)
+
+    # ==================== writing ==================== #
+    def __setitem__(self, x, y):
+        if isinstance(x, tuple):
+            raise ValueError('QuantizedData only support assigning whole rows.')
+        y = np.asarray(y, dtype='float32')
+        if y.ndim < self._data.ndim:
+            self._refit([np.broadcast_to(y, (1,) + self._data.shape[1:])])
+        else:
+            self._refit([y])
+        return super(QuantizedData, self).__setitem__(x, self._quantize(y))
+
+    def append(self, *arrays):
+        arrays = [a for a in arrays if hasattr(a, 'shape')]
+        self._refit(arrays)
+        return super(QuantizedData, self).append(
+            *[self._quantize(a) for a in arrays])
+
+    def prepend(self, *arrays):
+        arrays = [a for a in arrays if hasattr(a, 'shape')]
+        self._refit(arrays)
+        return super(QuantizedData, self).prepend(
+            *[self._quantize(a) for a in arrays])
+
+    def close(self):
+        super(QuantizedData, self).close()
+        if hasattr(self, '_params'):
+            del self._params
 
 
 # ===========================================================================
@@ -1150,132 +2071,114 @@ class Hdf5Data(Data):
     def hdf5(self):
         return self._hdf
 
+    def _opener(self):
+        path, name = self.path, self._data.name
+        return lambda: h5py.File(path, mode='r')[name]
+
     # ==================== High-level operator ==================== #
-    @cache('_status')
     def sum(self, axis=0):
-        ops = lambda x, axis: np.sum(x, axis=axis)
-        return self._iterating_operator(ops, axis)[0]
+        return self._get_stats('sum', axis)
 
     @cache('_status')
     def cumsum(self, axis=None):
         return self._data[:].cumsum(axis)
 
-    @cache('_status')
     def sum2(self, axis=0):
-        ops = lambda x, axis: np.sum(np.power(x, 2), axis=axis)
-        return self._iterating_operator(ops, axis)[0]
+        return self._get_stats('sum2', axis)
 
-    @cache('_status')
     def pow(self, y):
-        return self._data[:].__pow__(y)
+        return self.__pow__(y)
 
-    @cache('_status')
     def min(self, axis=None):
-        ops = lambda x, axis: np.min(x, axis=axis)
-        return self._iterating_operator(ops, axis,
-            merge_func=lambda x: np.where(x[0] < x[1], x[0], x[1]),
-            init_val=float('inf'))[0]
+        return self._get_stats('min', axis)
 
-    @cache('_status')
+    @cache('_status', '_transformer')
     def argmin(self, axis=None):
-        return self._data[:].argmin(axis)
+        return self._arg_reduce('min', axis)
 
-    @cache('_status')
     def max(self, axis=None):
-        ops = lambda x, axis: np.max(x, axis=axis)
-        return self._iterating_operator(ops, axis,
-            merge_func=lambda x: np.where(x[0] > x[1], x[0], x[1]),
-            init_val=float('-inf'))[0]
+        return self._get_stats('max', axis)
 
-    @cache('_status')
+    @cache('_status', '_transformer')
     def argmax(self, axis=None):
-        return self._data[:].argmax(axis)
+        return self._arg_reduce('max', axis)
 
-    @cache('_status')
     def mean(self, axis=0):
-        sum1 = self.sum(axis)
+        return self._get_stats('mean', axis)
 
-        axis = _validate_operate_axis(axis)
-        n = np.prod([self._data.shape[i] for i in axis])
-        return sum1 / n
-
-    @cache('_status')
     def var(self, axis=0):
-        sum1 = self.sum(axis)
-        sum2 = self.sum2(axis)
-
-        axis = _validate_operate_axis(axis)
-        n = np.prod([self._data.shape[i] for i in axis])
-        return (sum2 - np.power(sum1, 2) / n) / n
+        return self._get_stats('var', axis)
 
-    @cache('_status')
     def std(self, axis=0):
-        return np.sqrt(self.var(axis))
+        return self._get_stats('std', axis)
 
     @autoattr(_status=lambda x: x + 1)
     def normalize(self, axis, mean=None, std=None):
         mean = mean if mean is not None else self.mean(axis)
         std = std if std is not None else self.std(axis)
-        self._iterate_update(mean, 'sub')
-        self._iterate_update(std, 'div')
+        # subtract and divide fused in one pass over the data
+        self._iterate_update([('sub', mean), ('div', std)])
         return self
 
     # ==================== low-level operator ==================== #
     def __add__(self, y):
-        return self._data.__add__(y)
+        return _lazy_operator(self, np.add, y)
 
     def __sub__(self, y):
-        return self._data.__sub__(y)
+        return _lazy_operator(self, np.subtract, y)
 
     def __mul__(self, y):
-        return self._data.__mul__(y)
+        return _lazy_operator(self, np.multiply, y)
 
     def __div__(self, y):
-        return self._data.__div__(y)
+        return _lazy_operator(self, np.divide, y)
+
+    def __truediv__(self, y):
+        return _lazy_operator(self, np.true_divide, y)
 
     def __floordiv__(self, y):
-        return self._data.__floordiv__(y)
+        return _lazy_operator(self, np.floor_divide, y)
 
     def __pow__(self, y):
-        return self._data.__pow__(y)
+        return _lazy_operator(self, np.power, y)
 
     @autoattr(_status=lambda x: x + 1)
     def __iadd__(self, y):
-        self._iterate_update(y, 'add')
+        self._iterate_update([('add', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __isub__(self, y):
-        self._iterate_update(y, 'sub')
+        self._iterate_update([('sub', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __imul__(self, y):
-        self._iterate_update(y, 'mul')
+        self._iterate_update([('mul', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __idiv__(self, y):
-        self._iterate_update(y, 'div')
+        self._iterate_update([('div', y)])
         return self
 
+    __itruediv__ = __idiv__
+
     @autoattr(_status=lambda x: x + 1)
     def __ifloordiv__(self, y):
-        self._iterate_update(y, 'floordiv')
+        self._iterate_update([('floordiv', y)])
         return self
 
     @autoattr(_status=lambda x: x + 1)
     def __ipow__(self, y):
-        self._iterate_update(y, 'pow')
+        self._iterate_update([('pow', y)])
         return self
 
     def __neg__(self):
-        self._data.__neg__()
-        return self
+        return _lazy_operator(self, np.negative)
 
     def __pos__(self):
-        self._data.__pos__()
-        return self
+        return _lazy_operator(self, np.positive)
 
     # ==================== Save ==================== #
     def resize(self, shape):
@@ -1310,6 +2213,384 @@ class Hdf5Data(Data):
             pass
 
 
+# ===========================================================================
+# Compressed chunked Data
+# ===========================================================================
+# name -> (compress(raw, level), decompress(raw))
+_CODECS = {
+    'zlib': (lambda x, level: zlib.compress(x, level), zlib.decompress),
+    'bz2': (lambda x, level: bz2.compress(x, max(level, 1)), bz2.decompress),
+}
+try:
+    import lz4.block as _lz4
+    _CODECS['lz4'] = (lambda x, level: _lz4.compress(x, compression=level),
+                      _lz4.decompress)
+except ImportError:
+    pass
+
+
+class _ChunkedArray(object):
+    ''' Read-only array-like view of a ChunkedData file, the rows are
+    stored in compressed chunks of `chunk_rows` rows, the decompressed
+    chunks are kept in a LRU cache of `cache_size` chunks.
+
+    File layout: magic | chunk_0 | ... | chunk_n | index | index offset,
+    index is marshal of [dtype, shape, chunk_rows, codec, level, shuffle,
+    [(offset, nbytes), ...]].
+    '''
+    MAGIC = b'chunkdat'
+    FOOTER_SIZE = 16
+
+    def __init__(self, path, mode='rb', cache_size=8):
+        self.path = path
+        self._file = open(path, mode)
+        self._pid = os.getpid()
+        self._cache = _LRUCache(maxsize=max(int(cache_size), 1), maxbytes=None)
+        self._version = 0
+        self._dirty = False
+        f = self._file
+        if f.read(len(self.MAGIC)) != self.MAGIC:
+            f.close()
+            raise ValueError('Invalid header for ChunkedData.')
+        f.seek(-self.FOOTER_SIZE, 2)
+        self._end = int(f.read(self.FOOTER_SIZE))
+        f.seek(self._end)
+        (dtype, shape, self.chunk_rows, self.codec, self.level, self.shuffle,
+         offsets) = marshal.loads(f.read()[:-self.FOOTER_SIZE])
+        if self.codec not in _CODECS:
+            f.close()
+            raise ValueError('Codec "%s" of ChunkedData at path: %s is not '
+                             'available.' % (self.codec, path))
+        self.dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+        self._offsets = [tuple(i) for i in offsets]
+
+    @staticmethod
+    def create(path, dtype, shape, chunk_rows, codec, level, shuffle):
+        with open(path, 'wb') as f:
+            f.write(_ChunkedArray.MAGIC)
+            _ChunkedArray._write_index(f, f.tell(), [str(np.dtype(dtype)),
+                (0,) + tuple(shape[1:]), chunk_rows, codec, level, shuffle, []])
+
+    @staticmethod
+    def _write_index(f, end, info):
+        f.seek(end)
+        f.write(marshal.dumps(info))
+        f.write(('%' + str(_ChunkedArray.FOOTER_SIZE) + 'd') % end)
+        f.truncate()
+        f.flush()
+
+    # ==================== properties ==================== #
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def nbytes(self):
+        """ Size in bytes of the compressed chunks """
+        return sum(i[1] for i in self._offsets)
+
+    def __len__(self):
+        return self._shape[0]
+
+    # ==================== chunks ==================== #
+    def _encode(self, x):
+        x = np.ascontiguousarray(x, dtype=self.dtype)
+        raw = x.view(np.uint8).reshape(-1, self.dtype.itemsize)
+        # byte-shuffling: group the bytes of the same significance, which
+        # are much more redundant (e.g. exponent of float)
+        if self.shuffle and self.dtype.itemsize > 1:
+            raw = raw.T
+        return _CODECS[self.codec][0](np.ascontiguousarray(raw).tostring(),
+                                      self.level)
+
+    def _decode(self, raw, nb_rows):
+        raw = np.frombuffer(_CODECS[self.codec][1](raw), dtype=np.uint8)
+        if self.shuffle and self.dtype.itemsize > 1:
+            raw = raw.reshape(self.dtype.itemsize, -1).T
+        return np.ascontiguousarray(raw).view(self.dtype).reshape(
+            (nb_rows,) + self._shape[1:])
+
+    def _chunk(self, i):
+        try:
+            return self._cache.get(i, self._version)
+        except KeyError:
+            pass
+        offset, nbytes = self._offsets[i]
+        x = self._decode(self._pread(offset, nbytes),
+                         min(self.chunk_rows, self._shape[0] - i * self.chunk_rows))
+        self._cache.put(i, x)
+        return x
+
+    def _pread(self, offset, nbytes):
+        """ Read without sharing the file position, the file object is
+        inherited by forked workers (e.g. Feeder), so seek + read from
+        different processes would interleave """
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), nbytes, offset)
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._file = open(self.path, 'rb')
+        self._file.seek(offset)
+        return self._file.read(nbytes)
+
+    def _read(self, start, end):
+        out = np.empty((end - start,) + self._shape[1:], dtype=self.dtype)
+        cr = self.chunk_rows
+        for i in range(start // cr, (end - 1) // cr + 1 if end > start else 0):
+            s, e = max(start, i * cr), min(end, (i + 1) * cr)
+            out[s - start:e - start] = self._chunk(i)[s - i * cr:e - i * cr]
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if len(key) == 0:
+                return self[:]
+            x = self[key[0]]
+            if isinstance(key[0], (int, np.integer)):
+                return x[key[1:]]
+            return x[(slice(None),) + key[1:]]
+        n = self._shape[0]
+        if key is Ellipsis:
+            key = slice(None)
+        if isinstance(key, slice):
+            start, end, step = key.indices(n)
+            if step == 1:
+                return self._read(start, max(start, end))
+            key = np.arange(start, end, step)
+        elif isinstance(key, (int, np.integer)):
+            i = int(key) + n if key < 0 else int(key)
+            if i < 0 or i >= n:
+                raise IndexError('index %d is out of bounds for axis 0 with '
+                                 'size %d' % (key, n))
+            return self._read(i, i + 1)[0]
+        key = np.asarray(key)
+        if key.dtype == np.bool:
+            key = np.nonzero(key)[0]
+        if key.shape[0] == 0:
+            return np.empty((0,) + self._shape[1:], dtype=self.dtype)
+        return _gather(self, key)
+
+    # ==================== writing ==================== #
+    def append(self, *arrays):
+        cr = self.chunk_rows
+        n = self._shape[0]
+        # rewrite the last incomplete chunk
+        pending = None
+        if n % cr != 0:
+            pending = self._chunk(len(self._offsets) - 1)
+            self._end = self._offsets.pop()[0]
+        self._file.seek(self._end)
+        for a in arrays:
+            a = np.asarray(a, dtype=self.dtype)
+            if a.shape[1:] != self._shape[1:]:
+                raise ValueError('Cannot append array with shape: %s to '
+                                 'ChunkedData with shape: %s' %
+                                 (a.shape, self._shape))
+            n += a.shape[0]
+            if pending is not None:
+                need = cr - pending.shape[0]
+                pending = np.concatenate([pending, a[:need]], axis=0)
+                a = a[need:]
+                if pending.shape[0] < cr:
+                    continue
+                self._write_chunk(pending)
+                pending = None
+            nb_full = a.shape[0] // cr * cr
+            for i in range(0, nb_full, cr):
+                self._write_chunk(a[i:i + cr])
+            if nb_full < a.shape[0]:
+                pending = a[nb_full:]
+        if pending is not None:
+            self._write_chunk(pending)
+        # make the new chunks visible to _pread
+        self._file.flush()
+        self._shape = (n,) + self._shape[1:]
+        self._version += 1
+        self._dirty = True
+        return self
+
+    def _write_chunk(self, x):
+        raw = self._encode(x)
+        self._offsets.append((self._end, len(raw)))
+        self._file.write(raw)
+        self._end += len(raw)
+
+    def flush(self):
+        if self._dirty:
+            _ChunkedArray._write_index(self._file, self._end,
+                [str(self.dtype), self._shape, self.chunk_rows, self.codec,
+                 self.level, self.shuffle, self._offsets])
+            self._dirty = False
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+        self._cache.clear()
+
+
+class ChunkedData(MutableData):
+
+    """ Data stored in chunks of rows compressed by a fast codec, suitable
+    for redundant features (e.g. spectrogram) when the disk bandwidth is
+    the bottleneck rather than the CPU.
+
+    Parameters
+    ----------
+    path : str
+        path to the file
+    dtype : str, numpy.dtype
+        only for creating new file
+    shape : tuple
+        only for creating new file, the first dimension is ignored, the
+        rows are added by `append`
+    chunk_rows : None, int
+        number of rows of each chunk, by default, the number of rows of
+        `CHUNK_SIZE` bytes
+    codec : str
+        'zlib', 'bz2' or 'lz4' (if the package `lz4` is installed)
+    level : int
+        compression level of the codec
+    shuffle : bool
+        if True, the bytes of the same significance are grouped before
+        compression, which gives better ratio for numerical data
+    cache_size : int
+        number of decompressed chunks kept in memory (LRU)
+    read_only : bool
+        open the file in read-only mode
+
+    Note
+    ----
+    Only `append` is supported for writing, the stored values cannot be
+    modified in-place.
+    """
+
+    # bytes of uncompressed data of each chunk
+    CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def read_header(path):
+        """ return: dtype, shape """
+        x = _ChunkedArray(path)
+        x.close()
+        return str(x.dtype), x.shape
+
+    def __init__(self, path, dtype=None, shape=None, chunk_rows=None,
+                 codec='zlib', level=1, shuffle=True, cache_size=8,
+                 read_only=False):
+        super(ChunkedData, self).__init__()
+        self.read_only = read_only
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            if dtype is None or shape is None:
+                raise ValueError('dtype and shape must not be None.')
+            if codec not in _CODECS:
+                raise ValueError('Only support codec: %s, but given: %s' %
+                                 (', '.join(sorted(_CODECS.keys())), codec))
+            if not isinstance(shape, (tuple, list)):
+                shape = (shape,)
+            shape = tuple(shape)
+            if chunk_rows is None:
+                row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+                chunk_rows = ChunkedData.CHUNK_SIZE // row_bytes
+            _ChunkedArray.create(path, dtype, shape, max(int(chunk_rows), 1),
+                                 codec, int(level), bool(shuffle))
+        self._data = _ChunkedArray(path, 'rb' if read_only else 'r+b',
+                                   cache_size=cache_size)
+
+    # ==================== properties ==================== #
+    @property
+    def path(self):
+        return self._data.path
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def chunk_rows(self):
+        return self._data.chunk_rows
+
+    @property
+    def compression_ratio(self):
+        """ Size of the raw data over the size of the compressed chunks """
+        nbytes = self._data.nbytes
+        size = int(np.prod(self._data.shape)) * self._data.dtype.itemsize
+        return size / nbytes if nbytes > 0 else 1.
+
+    def __str__(self):
+        return '<Chunked dataset "%s": shape %s, type "<%s">' % \
+        (self.name, self.shape, self.dtype)
+
+    def _opener(self):
+        path = self.path
+        return lambda: _ChunkedArray(path)
+
+    # ==================== High-level operator ==================== #
+    @cache('_status')
+    def cumsum(self, axis=None):
+        return self._data[:].cumsum(axis)
+
+    def pow(self, y):
+        return self.__pow__(y)
+
+    @cache('_status', '_transformer')
+    def argmin(self, axis=None):
+        return self._arg_reduce('min', axis)
+
+    @cache('_status', '_transformer')
+    def argmax(self, axis=None):
+        return self._arg_reduce('max', axis)
+
+    # ==================== low-level operator ==================== #
+    def __add__(self, y):
+        return _lazy_operator(self, np.add, y)
+
+    def __sub__(self, y):
+        return _lazy_operator(self, np.subtract, y)
+
+    def __mul__(self, y):
+        return _lazy_operator(self, np.multiply, y)
+
+    def __div__(self, y):
+        return _lazy_operator(self, np.divide, y)
+
+    def __truediv__(self, y):
+        return _lazy_operator(self, np.true_divide, y)
+
+    def __floordiv__(self, y):
+        return _lazy_operator(self, np.floor_divide, y)
+
+    def __pow__(self, y):
+        return _lazy_operator(self, np.power, y)
+
+    def __neg__(self):
+        return _lazy_operator(self, np.negative)
+
+    def __pos__(self):
+        return _lazy_operator(self, np.positive)
+
+    # ==================== Save ==================== #
+    @autoattr(_status=lambda x: x + 1)
+    def append(self, *arrays):
+        if self.read_only:
+            raise Exception('Cannot append to ChunkedData at path: %s in '
+                            'read-only mode.' % self.path)
+        self._data.append(*[a for a in arrays if hasattr(a, 'shape')])
+        return self
+
+    def flush(self):
+        self._data.flush()
+
+    def close(self):
+        self._data.close()
+
+
 # ===========================================================================
 # data iterator
 # ===========================================================================
@@ -1355,7 +2636,7 @@ class DataIterator(MutableData):
     @property
     def shape(self):
         orig_shape = (len(self),) + self._data[0].shape[1:]
-        return _estimate_shape(orig_shape, self._transformer)
+        return self._transformer.shape(orig_shape)
 
     @property
     def array(self):
@@ -1551,6 +2832,32 @@ class DataIterator(MutableData):
                 for i, j in idx[:int(ceil(x.shape[0] / self._batch_size))]:
                     yield self._transformer(x[i:j])
 
+    # ==================== Slicing methods ==================== #
+    def gather(self, indices, max_gap=0):
+        """ Random-access read of the rows at given `indices` of all the
+        Data stacked vertically, each Data reads its rows using coalesced
+        contiguous runs (see `Data.gather`). """
+        offsets = np.cumsum([0] + [d.shape[0] for d in self._data])
+        indices = np.asarray(indices, dtype='int64')
+        indices = np.where(indices < 0, indices + offsets[-1], indices)
+        if indices.shape[0] > 0 and \
+        (indices.min() < 0 or indices.max() >= offsets[-1]):
+            raise IndexError('Indices out of range for data with %d rows.'
+                             % offsets[-1])
+        owner = np.searchsorted(offsets, indices, side='right') - 1
+        out = None
+        for i, dat in enumerate(self._data):
+            mask = owner == i
+            if not np.any(mask):
+                continue
+            x = dat.gather(indices[mask] - offsets[i], max_gap)
+            if out is None:
+                out = np.empty((indices.shape[0],) + x.shape[1:], dtype=x.dtype)
+            out[mask] = x
+        if out is None:
+            out = self._data[0][0:0]
+        return self._transformer(out)
+
     # ==================== Slicing methods ==================== #
     def __getitem__(self, y):
         start = self._start
@@ -1613,19 +2920,47 @@ class DataMerge(MutableData):
     @property
     def shape(self):
         shape = [i.shape for i in self._data]
-        return _estimate_shape(shape,
-                               lambda x: self._transformer(self._merge_func(x)))
+        return self._transformer.shape(_estimate_shape(shape, self._merge_func))
 
     @property
     def dtype(self):
         n = (12 + 8) // 10 # lucky number :D
         tmp = [np.ones((n,) + i.shape[1:]).astype(i.dtype) for i in self._data]
-        return self._merge_func(tmp).dtype
+        shape = _estimate_shape([i.shape for i in self._data], self._merge_func)
+        return self._transformer.dtype(shape, self._merge_func(tmp).dtype)
 
     @property
     def array(self):
         return self._transformer(self._merge_func([i[:] for i in self._data]))
 
+    # ==================== lazy operators ==================== #
+    def __add__(self, y):
+        return _lazy_operator(self, np.add, y)
+
+    def __sub__(self, y):
+        return _lazy_operator(self, np.subtract, y)
+
+    def __mul__(self, y):
+        return _lazy_operator(self, np.multiply, y)
+
+    def __div__(self, y):
+        return _lazy_operator(self, np.divide, y)
+
+    def __truediv__(self, y):
+        return _lazy_operator(self, np.true_divide, y)
+
+    def __floordiv__(self, y):
+        return _lazy_operator(self, np.floor_divide, y)
+
+    def __pow__(self, y):
+        return _lazy_operator(self, np.power, y)
+
+    def __neg__(self):
+        return _lazy_operator(self, np.negative)
+
+    def __pos__(self):
+        return _lazy_operator(self, np.positive)
+
     # ==================== Slicing methods ==================== #
     def __getitem__(self, y):
         n = self._data[0].shape[0]
@@ -1634,6 +2969,15 @@ class DataMerge(MutableData):
         x = self._merge_func(data)
         return self._transformer(x)
 
+    def gather(self, indices, max_gap=0):
+        """ Random-access read of the rows at given `indices` of every
+        Data (see `Data.gather`), then merge them """
+        n = self._data[0].shape[0]
+        data = [i.gather(indices, max_gap)
+                if len(i.shape) > 0 and i.shape[0] == n else i
+                for i in self._data]
+        return self._transformer(self._merge_func(data))
+
     # ==================== iteration ==================== #
     def _iter(self):
         batch_size = self._batch_size
@@ -1656,6 +3000,11 @@ class DataMerge(MutableData):
             rng = np.random.RandomState(seed)
             rng.shuffle(idx)
         idx = [slice(i[0], i[1]) for i in idx]
+        if rng is not None and self._shuffle_level >= 3:
+            # sample-level shuffling, the rows are read using `gather`
+            perm = start + rng.permutation(end - start)
+            idx = [perm[i:i + batch_size]
+                   for i in range(0, perm.shape[0], batch_size)]
         none_idx = [slice(None, None)] * len(idx)
         # ====== check other data ====== #
         batches = [idx]
@@ -1667,7 +3016,8 @@ class DataMerge(MutableData):
 
         yield None # dummy return for initialize everything
         for b in zip(*batches):
-            data = self._merge_func([i[j] for i, j in zip(self._data, b)])
-            if self._shuffle_level > 0 and rng is not None:
+            data = self._merge_func([i.gather(j) if isinstance(j, np.ndarray)
+                                     else i[j] for i, j in zip(self._data, b)])
+            if self._shuffle_level in (1, 2) and rng is not None:
                 data = data[rng.permutation(data.shape[0])]
             yield self._transformer(data)
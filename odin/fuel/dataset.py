@@ -7,10 +7,12 @@ from six.moves import zip, range, cPickle
 
 import numpy as np
 
-from .data import MmapData, Hdf5Data, open_hdf5, get_all_hdf_dataset, MAX_OPEN_MMAP, Data
+from .data import (MmapData, QuantizedData, Hdf5Data, ChunkedData, open_hdf5,
+                   get_all_hdf_dataset, Data)
+from .data import _parallel_scan, _stats_moments, _finalize_moments
 from .utils import MmapDict
 
-from odin.utils import get_file, Progbar, is_string
+from odin.utils import get_file, Progbar, is_string, as_tuple
 from odin.utils.decorators import singleton
 
 
@@ -30,7 +32,8 @@ __all__ = [
 # dataset
 # ===========================================================================
 def _parse_data_descriptor(path, read_only):
-    """ Return mapping: name -> (dtype, shape, Data, path) """
+    """ Return list of (name, kind, (dtype, shape, Data, path)), `kind` is
+    used to open the Data again (see `_load_data`) """
     if not os.path.isfile(path):
         return None
 
@@ -38,13 +41,20 @@ def _parse_data_descriptor(path, read_only):
     try:
         dtype, shape = MmapData.read_header(path)
         # shape[1:], because first dimension can be resize afterward
-        return [(os.path.basename(path), (dtype, shape, None, path))]
-    except: # cannot read the header of MmapData, maybe Hdf5
+        return [(os.path.basename(path), 'memmap', (dtype, shape, None, path))]
+    except: # cannot read the header of MmapData, maybe ChunkedData
+        pass
+    try:
+        data = ChunkedData(path, read_only=read_only)
+        return [(os.path.basename(path), 'chunked',
+                 (data.dtype, data.shape, data, path))]
+    except: # maybe Hdf5
         try:
             f = open_hdf5(path, read_only=read_only)
             ds = get_all_hdf_dataset(f)
             data = [Hdf5Data(dataset=i, hdf=f) for i in ds]
-            return [(str(i.name), (str(i.dtype), i.shape, i, i.path)) for i in data]
+            return [(str(i.name), 'hdf5', (str(i.dtype), i.shape, i, i.path))
+                    for i in data]
         except:
             pass
     # ====== try to load pickle file if possible ====== #
@@ -52,17 +62,36 @@ def _parse_data_descriptor(path, read_only):
     try:
         with open(path, 'rb') as f:
             data = cPickle.load(f)
-            return [(name,
+            return [(name, 'pickle',
             (type(data).__name__, len(data) if hasattr(data, '__len__') else 0, data, path))]
     except:
         pass
     # ====== load memmap dict ====== #
     try:
         data = MmapDict(path)
-        return [(name, ('memdict', len(data), data, path))]
+        return [(name, 'memdict', ('memdict', len(data), data, path))]
     except:
         pass
-    return [(name, ('unknown', 'unknown', None, path))]
+    return [(name, 'unknown', ('unknown', 'unknown', None, path))]
+
+
+def _load_data(name, kind, path, read_only):
+    """ Open the Data `name` of given `kind` (returned by
+    `_parse_data_descriptor`) stored at `path` """
+    if kind == 'memmap':
+        extra = MmapData._read_header(path)[-1]
+        return (QuantizedData if extra.get('quantized', False)
+                else MmapData)(path, read_only=read_only)
+    elif kind == 'chunked':
+        return ChunkedData(path, read_only=read_only)
+    elif kind == 'hdf5':
+        return Hdf5Data(dataset=name, hdf=open_hdf5(path, read_only=read_only))
+    elif kind == 'pickle':
+        with open(path, 'rb') as f:
+            return cPickle.load(f)
+    elif kind == 'memdict':
+        return MmapDict(path)
+    return None
 
 
 @singleton
@@ -73,11 +102,19 @@ class Dataset(object):
     Any file name with "readme" prefix will be parsed as text and showed as
     readme.
 
+    The name, type, dtype and shape of all files are cached in the
+    manifest (written on `flush`), opening the Dataset only lists the
+    folder and the files are opened when they are accessed, only the
+    files modified after the manifest was written are parsed again.
+
     Note
     ----
     for developer: _data_map contains: name -> (dtype, shape, Data or pathtoData)
+    _data_kind contains: name -> kind of the Data (see `_load_data`)
     readme included with the dataset should contain license information
     """
+    MANIFEST = '.manifest'
+    MANIFEST_VERSION = 1
 
     def __init__(self, path, read_only=False, override=False):
         path = os.path.abspath(path)
@@ -100,6 +137,7 @@ class Dataset(object):
     def _set_path(self, path):
         # all files are opened with default_mode=r+
         self._data_map = OrderedDict()
+        self._data_kind = {}
         self._path = os.path.abspath(path)
         self._default_hdf5 = os.path.basename(self._path) + '_default.h5'
 
@@ -110,8 +148,12 @@ class Dataset(object):
             raise ValueError('Dataset path must be a folder.')
 
         # ====== load all Data ====== #
+        manifest = self._read_manifest()
+        parsed = False
         files = os.listdir(path)
         for fname in files:
+            if fname.startswith(Dataset.MANIFEST):
+                continue
             # found README
             if 'readme' == fname[:6].lower():
                 readme_path = os.path.join(path, fname)
@@ -121,15 +163,80 @@ class Dataset(object):
                     readme.append(' For more information: ' + readme_path)
                     self._readme_info = ['README:', '------'] + readme
                     self._readme_path = readme_path
-            # parse data
-            data = _parse_data_descriptor(os.path.join(path, fname), self.read_only)
-            if data is None: continue
-            for key, d in data:
+            # parse data, only if the file changed after the manifest
+            fpath = os.path.join(path, fname)
+            if not os.path.isfile(fpath): continue
+            stat = os.stat(fpath)
+            cached = manifest.get(fname, None)
+            if cached is not None and \
+            cached[:2] == (stat.st_mtime, stat.st_size):
+                data = [(key, kind, (dtype, shape, None, fpath))
+                        for key, kind, dtype, shape in cached[-1]]
+            else:
+                data = _parse_data_descriptor(fpath, self.read_only)
+                parsed = True
+            for key, kind, d in data:
                 if key in self._data_map:
                     raise ValueError('Found duplicated data with follow info: '
                                      '{}'.format(key))
                 else:
                     self._data_map[key] = d
+                    self._data_kind[key] = kind
+        if parsed and not self.read_only:
+            self._write_manifest()
+
+    # ==================== manifest ==================== #
+    def _read_manifest(self):
+        """ Return mapping: file name -> (mtime, size, list of
+        (name, kind, dtype, shape)) """
+        try:
+            with open(os.path.join(self._path, Dataset.MANIFEST), 'rb') as f:
+                version, files = cPickle.load(f)
+            if version == Dataset.MANIFEST_VERSION:
+                return files
+        except: # no manifest or corrupted
+            pass
+        return {}
+
+    def _describe(self):
+        """ Return list of (name, kind, dtype, shape, path) of all Data """
+        desc = []
+        for name, (dtype, shape, data, path) in self._data_map.iteritems():
+            if isinstance(data, Data):
+                dtype, shape = data.dtype, data.shape
+            elif isinstance(data, dict):
+                shape = len(data)
+            desc.append((name, self._data_kind.get(name, 'unknown'),
+                         dtype, shape, path))
+        return desc
+
+    def _write_manifest(self, desc=None):
+        """ `desc` is returned by `_describe`, the files are stat after
+        all Data are flushed or closed """
+        files = {}
+        for name, kind, dtype, shape, path in \
+        (self._describe() if desc is None else desc):
+            if not os.path.isfile(path):
+                continue
+            fname = os.path.basename(path)
+            if fname not in files:
+                stat = os.stat(path)
+                files[fname] = (stat.st_mtime, stat.st_size, [])
+            files[fname][-1].append((name, kind, dtype, shape))
+        # write to temporary file then rename, so the manifest read by other
+        # processes is always complete
+        path = os.path.join(self._path, Dataset.MANIFEST)
+        tmp_path = path + '.%d' % os.getpid()
+        try:
+            with open(tmp_path, 'wb') as f:
+                cPickle.dump((Dataset.MANIFEST_VERSION, files), f,
+                             protocol=cPickle.HIGHEST_PROTOCOL)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError): # read-only file system
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     # ==================== archive loading ==================== #
     def _load_archive(self, path, extract_path):
@@ -227,14 +334,21 @@ class Dataset(object):
             elif data is not None:
                 with open(path, 'wb') as f:
                     cPickle.dump(data, f, protocol=cPickle.HIGHEST_PROTOCOL)
+        if not self.read_only:
+            self._write_manifest()
 
     def close(self, name=None):
         if name is None: # close all files
+            desc = self._describe()
             for name, (dtype, shape, data, path) in self._data_map.items():
                 if hasattr(data, 'close'):
                     data.close()
                 del data
-                del self._data_map[name]
+            # closing some files (e.g. hdf5) modifies them
+            if not self.read_only:
+                self._write_manifest(desc)
+            self._data_map.clear()
+            self._data_kind.clear()
             self.dispose() # Singleton class to dispose an instance
         elif name in self._data_map: # close a particular file
             (dtype, shape, data, path) = self._data_map[name]
@@ -242,17 +356,52 @@ class Dataset(object):
                 data.close()
             del data
             del self._data_map[name]
+            self._data_kind.pop(name, None)
 
-    # ==================== Some info ==================== #
-    def _validate_memmap_max_open(self, name):
-        # ====== check if MmapData excess limit, close 1 files ====== #
-        if MmapData.COUNT > MAX_OPEN_MMAP:
-            for i, (_dtype, _shape, _data, _path) in self._data_map.iteritems():
-                if isinstance(_data, MmapData) and i != name:
-                    self.close(name=i)
-                    self._data_map[i] = (_dtype, _shape, _path)
-                    break
+    # ==================== Statistics ==================== #
+    def stats(self, axis=0, ncpu=1, block_size=None, names=None):
+        """ Compute the statistics (see `Data.stats`) of all the Data in
+        this Dataset in one pass over each file.
 
+        Parameters
+        ----------
+        axis : None, int or list(int)
+            axes to reduce, if None, reduce over all axes
+        ncpu : int
+            if > 1, the rows of all MmapData and Hdf5Data are split into
+            contiguous segments, which are reduced by the same pool of
+            `ncpu` processes.
+        block_size : None, int
+            maximum size in bytes of the float64 block read at each step
+        names : None, str or list(str)
+            name of Data to compute the statistics, by default, all Data
+
+        Return
+        ------
+        OrderedDict: name -> {'n', 'sum', 'sum2', 'min', 'max', 'mean',
+        'var', 'std'}
+        """
+        names = self.keys() if names is None else as_tuple(names)
+        data = OrderedDict()
+        for name in names:
+            d = self[name]
+            if isinstance(d, Data):
+                data[name] = d
+        # ====== parallel scan all files at once ====== #
+        tasks = []
+        if ncpu > 1:
+            for name, d in data.iteritems():
+                moments = lambda dat: _stats_moments(dat, axis, d._transformer)
+                t = d._scan_task(name, moments, block_size, ncpu)
+                if t is not None:
+                    tasks.append(t)
+        results = _parallel_scan(tasks, ncpu) if len(tasks) > 0 else {}
+        # ====== single process for the rest ====== #
+        return OrderedDict([(name, _finalize_moments(results[name])
+                             if name in results else d.stats(axis, block_size))
+                            for name, d in data.iteritems()])
+
+    # ==================== Some info ==================== #
     def __contains__(self, key):
         return key in self._data_map
 
@@ -261,12 +410,15 @@ class Dataset(object):
             if key not in self._data_map:
                 raise KeyError('%s not found in this dataset' % key)
             dtype, shape, data, path = self._data_map[key]
-            # return type is just a descriptor, create MmapData for it
-            if data is None and \
-            dtype is not 'unknown' and shape is not 'unknown':
-                data = MmapData(path, read_only=self.read_only)
-                self._data_map[key] = (data.dtype, data.shape, data, path)
-                self._validate_memmap_max_open(key)
+            # return type is just a descriptor, open the Data for it
+            if data is None:
+                data = _load_data(key, self._data_kind.get(key, 'unknown'),
+                                  path, self.read_only)
+                if isinstance(data, Data):
+                    dtype, shape = data.dtype, data.shape
+                # the number of mapped MmapData is bounded by MAX_OPEN_MMAP
+                if data is not None:
+                    self._data_map[key] = (dtype, shape, data, path)
             return path if data is None else data
         raise ValueError('Only accept key type is string.')
 
@@ -276,20 +428,24 @@ class Dataset(object):
         ----------
         key : str or tuple
             if tuple is specified, it contain the key and the datatype
-            which must be "memmap", "hdf5"
+            which must be "memmap", "hdf5", "chunked" (compressed chunks,
+            see `ChunkedData`), "float16" or "int8" (quantized memmap, see
+            `QuantizedData`)
             for example: ds[('X', 'hdf5')] = numpy.ones((8, 12))
         """
         if not is_string(key) and not isinstance(key, (tuple, list)):
             raise ValueError('"key" is the name for Data and must be String or '
-                             'tuple specified the name and datatype (memmap, hdf5).')
+                             'tuple specified the name and datatype (memmap, hdf5, '
+                             'chunked, float16, int8).')
         # ====== check datatype ====== #
         datatype = 'memmap' # default datatype
         if isinstance(key, (tuple, list)):
             key, datatype = key
             datatype = datatype.lower()
-            if datatype not in ('memmap', 'hdf5'):
-                raise ValueError('datatype can only be "memmap" or "hdf5", but '
-                                 'the given data type is "%s"' % datatype)
+            if datatype not in ('memmap', 'hdf5', 'chunked', 'float16', 'int8'):
+                raise ValueError('datatype can only be "memmap", "hdf5", '
+                                 '"chunked", "float16" or "int8", but the '
+                                 'given data type is "%s"' % datatype)
         # ====== do nothing ====== #
         if key in self._data_map:
             return
@@ -304,20 +460,31 @@ class Dataset(object):
             d.flush()
             # store new dict
             self._data_map[key] = (type(d).__name__, len(d), d, path)
+            self._data_kind[key] = 'memdict'
         # ====== ndarray ====== #
         elif isinstance(value, np.ndarray):
             dtype, shape = value.dtype, value.shape
             if datatype == 'memmap':
                 data = MmapData(path, dtype=dtype, shape=shape)
+            elif datatype == 'chunked':
+                data = ChunkedData(path, dtype=dtype, shape=shape)
+            elif datatype in ('float16', 'int8'):
+                scale, offset = QuantizedData.fit(value, datatype)
+                data = QuantizedData(path, dtype=datatype, shape=shape,
+                                     scale=scale, offset=offset)
             else:
                 path = os.path.join(self.path, self._default_hdf5)
                 f = open_hdf5(path)
                 data = Hdf5Data(key, hdf=f, dtype=dtype, shape=shape)
+            # ChunkedData cannot be modified in-place, only appended
+            if datatype == 'chunked':
+                data.append(value)
+            else:
+                data.prepend(value)
             # store new key
             self._data_map[key] = (data.dtype, data.shape, data, path)
-            data.prepend(value)
-            # check maximum opened memmap
-            self._validate_memmap_max_open(key)
+            self._data_kind[key] = datatype if datatype in ('chunked', 'hdf5') \
+                else 'memmap'
         # ====== other types ====== #
         else:
             if os.path.exists(path):
@@ -328,9 +495,10 @@ class Dataset(object):
             self._data_map[key] = (type(value).__name__,
                                    len(value) if hasattr(value, '__len__') else 0,
                                    value, path)
+            self._data_kind[key] = 'pickle'
 
     def __iter__(self):
-        for name, (dtype, shape, data) in self._data_map.iteritems():
+        for name, (dtype, shape, data, path) in self._data_map.iteritems():
             if isinstance(data, (Data, dict, MmapDict)):
                 yield data
             else:
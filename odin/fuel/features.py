@@ -75,8 +75,9 @@ class FeatureProcessor(object):
                  save_stats=True, substitute_nan=None,
                  ncache=0.12, ncpu=1):
         super(FeatureProcessor, self).__init__()
-        if datatype not in ('memmap', 'hdf5'):
-            raise ValueError('datatype must be "memmap", or "hdf5"')
+        if datatype not in ('memmap', 'hdf5', 'float16', 'int8'):
+            raise ValueError('datatype must be "memmap", "hdf5", or quantized '
+                             'memmap "float16", "int8"')
         self.datatype = datatype
         if os.path.exists(output_path):
             warnings.warn('Remove exist dataset at path: "%s"' % output_path)
@@ -155,6 +156,9 @@ class FeatureProcessor(object):
                 # flush data
                 if name in dataset:
                     dataset[name].append(cache_data)
+                elif datatype in ('float16', 'int8') and \
+                not np.issubdtype(cache_data.dtype, np.floating):
+                    dataset[(name, 'memmap')] = cache_data
                 else:
                     dataset[(name, datatype)] = cache_data
 
@@ -170,7 +174,7 @@ class FeatureProcessor(object):
                 n, t, s = prop # data-type-name, dtype, stats
                 # mmapdict type:
                 if 'dict' in str(t).lower():
-                    dicts[n][name] = d.tolist() if isinstance(d, np.ndarray) else d
+                    dicts[n][name] = d
                     del d; continue
                 # auto-create new indices
                 if len(d) not in length:
@@ -334,8 +338,10 @@ class SpeechProcessor(FeatureProcessor):
         value
     dtype: 'float16', 'float32', 'float64'
         the dtype of saved features
-    datatype: 'memmap', 'hdf5'
-        store processed features in memmap or hdf5
+    datatype: 'memmap', 'hdf5', 'float16', 'int8'
+        store processed features in memmap or hdf5, or quantized memmap
+        (see `QuantizedData`, only for floating point features, the scale
+        and offset are fitted on the first flushed cache)
     ncache: float or int
         number of samples are kept until flush to the disk.
     ncpu: int
@@ -36,7 +36,7 @@ import numpy as np
 from odin.utils import (segment_list, one_hot,
                         Progbar, UnitTimer, get_system_status,
                         get_process_status, SharedCounter, as_tuple)
-from odin.utils.mpi import MPI
+from odin.utils.mpi import MPI, WorkerPool
 
 from .data import Data, MutableData, as_data
 from .dataset import Dataset
@@ -47,6 +47,7 @@ from .recipes import FeederList, CreateBatch
 # Multiprocessing Feeders
 # ===========================================================================
 _apply_approx = lambda n, x: int(round(n * x)) if x < 1. + 1e-12 else int(x)
+_indices_length = lambda x: int(x[2]) - int(x[1])
 
 
 def split_feeder(data, indices_path, transcription,
@@ -109,6 +110,31 @@ class Feeder(MutableData):
         maximum number of batch will be cached in Queue before main process
         get it and feed to the GPU (if there are too many results in Queue, a
         deadlock will happen)
+    maximum_queue_bytes: int, None
+        maximum total size in bytes of the batches cached in Queue, this
+        is more reliable than `maximum_queue_size` when the size of batches
+        are very different (e.g. CreateFile). None for no limit in bytes.
+    shm_slot_size: int, None
+        if not None, the size in bytes of each shared-memory slot used to
+        transfer returned batches from the processes to the main process
+        (no pickling, only slot descriptors go through the Queue), it must
+        be big enough to hold all arrays of 1 batch.
+    persistent: bool
+        if True, the processes are forked only once and kept alive for all
+        the iterations (i.e. epochs) of this Feeder, so the recipes and the
+        opened Data stay warm. Call `stop_all()` to shut them down.
+    ordered: bool
+        if True, the batches are returned in a deterministic order which is
+        independent of `ncpu` (i.e. the same as `ncpu=1`), the random state
+        of the recipes is re-seeded for each group of `buffer_size` indices.
+    dynamic: bool
+        if True, the processes pull groups of `buffer_size` indices from a
+        shared job queue instead of a static split of the indices, so a
+        process which draws many long utterances does not become the
+        straggler at the end of every epoch.
+    longest_first: bool
+        (dynamic mode) process the groups with the longest total length
+        (i.e. `end - start`) first. Not supported with `ordered=True`.
 
     Example
     -------
@@ -125,19 +151,26 @@ class Feeder(MutableData):
 
     Note
     ----
-    set(ncpu=1) if you want a reproducible results
-     - Memory transferring in Queue is always the bottleneck of multiprocessing
+    set(ncpu=1) or `ordered=True` if you want a reproducible results
+     - Memory transferring in Queue is always the bottleneck of multiprocessing,
+     set `shm_slot_size` to transfer the batches via shared memory instead.
     3 supporting mode for shuffling:
      - shuffle_level=0: only shuffling the indices
      - shuffle_level=1: shuffle the buffered batch (e.g. 12 files in the indices)
      - shuffle_level=2: shuffle each returned batch
-    * you must balance 2 number: buffer_size and maximum_queue_size, so the
-    amount of data cached by all processed does not excess the RAM
+     - shuffle_level=3: the same as 2 (sample-level shuffling is only
+     supported by `Data`)
+    * you must balance 2 number: buffer_size and maximum_queue_size (or
+    maximum_queue_bytes), so the amount of data cached by all processed does
+    not excess the RAM
 
     """
 
     def __init__(self, data, indices, dtype=None,
-                 ncpu=1, buffer_size=8, maximum_queue_size=66):
+                 ncpu=1, buffer_size=8, maximum_queue_size=66,
+                 maximum_queue_bytes=None, shm_slot_size=None,
+                 persistent=False, ordered=False, dynamic=False,
+                 longest_first=False):
         super(Feeder, self).__init__()
         # ====== load indices ====== #
         # indices always sorted in [(name, start, end), ...]
@@ -168,27 +201,72 @@ class Feeder(MutableData):
         # ====== desire dtype ====== #
         self._outtype = None if dtype is None else as_tuple(dtype, N=len(self._data))
         # ====== Set default recipes ====== #
-        self.__recipes = FeederList(CreateBatch())
+        self.__recipes = FeederList(CreateBatch()).set_inplace(True)
         # never use all available CPU
-        self.set_multiprocessing(ncpu, buffer_size, maximum_queue_size)
+        self.maximum_queue_bytes = None
+        self.shm_slot_size = None
+        self.persistent = False
+        self.ordered = False
+        self.dynamic = False
+        self.longest_first = False
+        self.set_multiprocessing(ncpu, buffer_size, maximum_queue_size,
+                                 maximum_queue_bytes, shm_slot_size,
+                                 persistent, ordered, dynamic, longest_first)
         self.__running_iter = []
+        self.__pool = None
+        self.__pool_config = None
 
-    def set_multiprocessing(self, ncpu=None, buffer_size=None, maximum_queue_size=None):
+    def set_multiprocessing(self, ncpu=None, buffer_size=None, maximum_queue_size=None,
+                            maximum_queue_bytes=None, shm_slot_size=None,
+                            persistent=None, ordered=None, dynamic=None,
+                            longest_first=None):
         if ncpu is not None:
             self.ncpu = ncpu
         if buffer_size is not None:
             self.buffer_size = buffer_size
         if maximum_queue_size is not None:
             self.maximum_queue_size = maximum_queue_size
+        if maximum_queue_bytes is not None:
+            self.maximum_queue_bytes = maximum_queue_bytes
+        if shm_slot_size is not None:
+            self.shm_slot_size = shm_slot_size
+        if persistent is not None:
+            self.persistent = bool(persistent)
+        if ordered is not None:
+            self.ordered = bool(ordered)
+        if dynamic is not None:
+            self.dynamic = bool(dynamic)
+        if longest_first is not None:
+            self.longest_first = bool(longest_first)
         return self
 
-    def set_recipes(self, recipes):
+    def set_recipes(self, recipes, profile=False):
+        """
+        Parameters
+        ----------
+        recipes: FeederRecipe, list of FeederRecipe
+            the recipes are applied in given order
+        profile: bool
+            if True, record the wall-time and bytes allocated by each recipe
+            (see `recipes_stats`)
+        """
         # filter out None value
         recipes = [i for i in as_tuple(recipes) if i is not None]
         if len(recipes) > 0:
+            # the loaded data are copies owned by the Feeder, hence, the
+            # recipes can process them in-place
             self.__recipes = FeederList(*recipes)
+            self.__recipes.set_inplace(True)
+            self.__recipes.set_profile(profile)
         return self
 
+    @property
+    def recipes_stats(self):
+        """ list of statistics of each recipe (collected from all processes)
+        if `set_recipes(..., profile=True)`, otherwise, None.
+        See `FeederList.stats` """
+        return self.__recipes.stats
+
     def stop_all(self):
         """ Call this method to stop all processes in case you
         spamming to many iteration
@@ -196,6 +274,93 @@ class Feeder(MutableData):
         for i in self.__running_iter:
             i.stop()
         self.__running_iter = []
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool = None
+            self.__pool_config = None
+
+    def _create_map_func(self):
+        """ Return (map_func, prepare_func), `prepare_func(context)` must be
+        called (in the process) before `map_func` """
+        recipes = self.__recipes
+        data = self._data
+        outtype = self._outtype
+        ordered = self.ordered
+        states = {'context': {}}
+
+        def prepare_func(context):
+            states['context'] = context
+            recipes.prepare(**context)
+
+        def map_func(jobs):
+            batch = []
+            for name, start, end in jobs:
+                start = int(start)
+                end = int(end)
+                # data can be list of Data, or just 1 Data
+                if outtype is not None:
+                    x = [np.array(d[start:end], dtype=t) for d, t in zip(data, outtype)]
+                else:
+                    x = [np.array(d[start:end]) for d in data]
+                x = recipes.process(name, x)
+                if x is not None:
+                    batch.append(x)
+            return recipes.group(batch)
+
+        def ordered_map_func(jobs):
+            # jobs: [(chunk_id, indices), ...], re-seed the recipes for each
+            # chunk, so the results do not depend on which process run it.
+            for chunk_id, indices in jobs:
+                context = states['context']
+                seed = context.get('seed', None)
+                if seed is not None:
+                    recipes.prepare(**dict(context, seed=seed + chunk_id))
+                for r in map_func(indices):
+                    yield r
+        return (ordered_map_func if ordered else map_func), prepare_func
+
+    def _get_worker_pool(self):
+        """ Return the persistent WorkerPool, a new pool is created if
+        the recipes or the multiprocessing configuration changed """
+        config = (id(self.__recipes), self.ncpu, self.buffer_size,
+                  self.maximum_queue_size, self.maximum_queue_bytes,
+                  self.shm_slot_size, self.ordered, self.dynamic,
+                  self.longest_first, self._reuse_buffer())
+        if self.__pool is None or self.__pool_config != config:
+            if self.__pool is not None:
+                self.__pool.close()
+            map_func, prepare_func = self._create_map_func()
+            self.__pool = WorkerPool(map_func,
+                prepare_func=prepare_func,
+                ncpu=self.ncpu,
+                buffer_size=1 if self.ordered else self.buffer_size,
+                maximum_queue_size=self.maximum_queue_size,
+                maximum_queue_bytes=self.maximum_queue_bytes,
+                shm_slot_size=self.shm_slot_size,
+                ordered=self.ordered,
+                dynamic=self.dynamic,
+                job_cost=self._get_job_cost(),
+                copy_results=self._reuse_buffer())
+            self.__pool_config = config
+        return self.__pool
+
+    def _reuse_buffer(self):
+        """ True if a recipe reuses its output buffers, the batches which
+        do not fit into a shared-memory slot must then be copied before
+        being put into the Queue """
+        return any(getattr(r, 'reuse_buffer', False)
+                   for r in self.__recipes.recipes)
+
+    def _get_job_cost(self):
+        return _indices_length if self.dynamic and self.longest_first else None
+
+    @property
+    def workers_time(self):
+        """ list of (busy, idle) time in seconds of each process of the
+        last iteration, None if the Feeder hasn't been iterated """
+        if len(self.__running_iter) == 0:
+            return None
+        return self.__running_iter[-1].workers_time
 
     # ==================== override from Data ==================== #
     @property
@@ -234,12 +399,15 @@ class Feeder(MutableData):
         # ====== check ====== #
         if self.__recipes is None:
             raise ValueError('You must "set_recipes" first')
+        if self.shm_slot_size is None and self._reuse_buffer():
+            raise ValueError('Recipe with "reuse_buffer=True" requires the '
+                             'shared-memory transport, set "shm_slot_size" '
+                             'in set_multiprocessing.')
         # ====== get start and end for indices ====== #
         n = self._indices.shape[0]
         start = _apply_approx(n, self._start)
         end = _apply_approx(n, self._end)
         indices = self._indices[start:end]
-        outtype = self._outtype
         # ====== shuffle the indices ====== #
         rng = None
         if self._seed is not None:
@@ -248,30 +416,19 @@ class Feeder(MutableData):
             # reset the seed
             self._seed = None
         # ====== create iter and its identity ====== #
-        process_func = self.__recipes.process
-        group_func = self.__recipes.group
-        self.__recipes.prepare(
+        context = dict(
             batch_size=self._batch_size,
             seed=rng.randint(10e6) if rng is not None else None,
             shuffle_level=self._shuffle_level,
         )
+        # ordered mode: each job is a chunk of `buffer_size` indices
+        buffer_size = self.buffer_size
+        if self.ordered:
+            indices = [(k, indices[i:i + buffer_size]) for k, i in
+                       enumerate(range(0, len(indices), buffer_size))]
+            buffer_size = 1
 
         # ====== create wrapped functions ====== #
-        def map_func(jobs):
-            batch = []
-            for name, start, end in jobs:
-                start = int(start)
-                end = int(end)
-                # data can be list of Data, or just 1 Data
-                if outtype is not None:
-                    x = [np.array(d[start:end], dtype=t) for d, t in zip(self._data, outtype)]
-                else:
-                    x = [np.array(d[start:end]) for d in self._data]
-                x = process_func(name, x)
-                if x is not None:
-                    batch.append(x)
-            return group_func(batch)
-
         def reduce_func(results):
             # perform batch level permutation
             if rng is not None and self._shuffle_level > 1:
@@ -285,10 +442,25 @@ class Feeder(MutableData):
                 results = tuple(results)
             return results
         # ====== track and return ====== #
-        it = MPI(indices, map_func, reduce_func,
-                 ncpu=self.ncpu,
-                 buffer_size=self.buffer_size,
-                 maximum_queue_size=self.maximum_queue_size)
+        if self.persistent:
+            # only 1 run at a time, the old iterators are cancelled
+            self.__running_iter = []
+            self.__recipes.prepare(**context)
+            it = self._get_worker_pool().run(
+                indices, context=context, reduce_func=reduce_func)
+        else:
+            map_func, prepare_func = self._create_map_func()
+            prepare_func(context)
+            it = MPI(indices, map_func, reduce_func,
+                     ncpu=self.ncpu,
+                     buffer_size=buffer_size,
+                     maximum_queue_size=self.maximum_queue_size,
+                     maximum_queue_bytes=self.maximum_queue_bytes,
+                     shm_slot_size=self.shm_slot_size,
+                     ordered=self.ordered,
+                     dynamic=self.dynamic,
+                     job_cost=self._get_job_cost(),
+                     copy_results=self._reuse_buffer())
         self.__running_iter.append(it)
         return it
 
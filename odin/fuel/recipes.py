@@ -3,23 +3,55 @@ import os
 import math
 import types
 import inspect
+import timeit
 import warnings
 from abc import ABCMeta
 from collections import Counter
+from multiprocessing import Array
 from six import add_metaclass
 from six.moves import zip, zip_longest, range
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 from odin.utils import (segment_list, segment_axis, one_hot, is_string,
                         is_number, Progbar, UnitTimer, get_system_status,
                         get_process_status, SharedCounter, as_tuple)
-from odin.utils.decorators import functionable
+from odin.utils.decorators import functionable, _LRUCache
 
 from .data import Data, MutableData
 from .utils import MmapDict
 
 
+# ===========================================================================
+# Helpers
+# ===========================================================================
+def _iter_arrays(args):
+    """ Iterate over all ndarray in the arguments of a recipe (i.e.
+    (name, [X1, X2, ...], y1, y2, ...)) """
+    for a in args:
+        if isinstance(a, np.ndarray):
+            yield a
+        elif isinstance(a, (tuple, list)):
+            for i in a:
+                if isinstance(i, np.ndarray):
+                    yield i
+
+
+def _data_arrays(args):
+    """ list of data X in the arguments of a recipe, empty if unknown """
+    if len(args) > 1 and isinstance(args[1], (tuple, list)):
+        return list(args[1])
+    return []
+
+
+def _root_id(x):
+    """ id of the ndarray which owns the memory of `x` """
+    while isinstance(x.base, np.ndarray):
+        x = x.base
+    return id(x)
+
+
 # ===========================================================================
 # Recipes
 # ===========================================================================
@@ -39,8 +71,14 @@ class FeederRecipe(object):
     ----
     This class should not store big amount of data, or the data
     will be replicated to all processes
+    Recipes with `inplace=True` implement `process_inplace`, which is allowed
+    to modify the data in-place, it is called by `FeederList` (in-place mode)
+    when the data are buffers produced by the previous stages.
     """
 
+    # the recipe can process the data in-place (see `process_inplace`)
+    inplace = False
+
     def prepare(self, **kwargs):
         pass
 
@@ -58,17 +96,40 @@ class FeederRecipe(object):
     def process(self, *args):
         return args
 
+    def process_inplace(self, writable, *args):
+        """ The same as `process`, but the data `X[i]` can be modified
+        in-place if `writable[i]` is True """
+        return self.process(*args)
+
     def group(self, x):
         return x
 
 
 class FeederList(FeederRecipe):
+    """ Chain of recipes
+
+    Parameters
+    ----------
+    *recipes: FeederRecipe
+        the recipes are applied in given order
+
+    Note
+    ----
+    `set_inplace(True)`: the data given to `process` are buffers owned by
+    the caller (e.g. the `Feeder`), so the in-place capable recipes modify
+    them (and the buffers produced by the in-place recipes) directly.
+    `set_profile(True)`: record the wall-time and the bytes allocated by each
+    recipe, the statistics are shared between all processes, hence, must be
+    enabled before the processes are started.
+    """
 
     def __init__(self, *recipes):
         super(FeederList, self).__init__()
         self.recipes = recipes
         if len(recipes) == 0:
             raise Exception('FeederList must contains >= 1 recipe(s).')
+        self._inplace = False
+        self._stats = None
 
     def __len__(self):
         return len(self.recipes)
@@ -79,23 +140,137 @@ class FeederList(FeederRecipe):
             s.append(i.__class__.__name__)
         return '<FeederList: ' + ', '.join(s) + '>'
 
+    def set_inplace(self, inplace):
+        self._inplace = bool(inplace)
+        return self
+
+    def set_profile(self, profile):
+        if profile and self._stats is None:
+            # [process_time, process_bytes, nb_process, group_time] of
+            # each recipe, then, the number of returned batches
+            self._stats = Array('d', 4 * len(self.recipes) + 1)
+        elif not profile:
+            self._stats = None
+        return self
+
+    @property
+    def stats(self):
+        """ list of statistics for each recipe:
+        process_time: total wall-time (second) of `process`
+        process_bytes: total bytes of the new arrays returned by `process`
+        nb_process: number of calls of `process`
+        group_time: total wall-time (second) of `group` (excluding the
+            previous recipes)
+        nb_batches: number of batches returned by the last recipe, i.e.
+            divide by `nb_batches` to get the statistics per batch.
+        """
+        if self._stats is None:
+            return None
+        with self._stats.get_lock():
+            stats = self._stats[:]
+        return [dict(recipe=r.__class__.__name__,
+                     process_time=stats[4 * i],
+                     process_bytes=int(stats[4 * i + 1]),
+                     nb_process=int(stats[4 * i + 2]),
+                     group_time=stats[4 * i + 3],
+                     nb_batches=int(stats[-1]))
+                for i, r in enumerate(self.recipes)]
+
+    def reset_stats(self):
+        if self._stats is not None:
+            with self._stats.get_lock():
+                for i in range(len(self._stats)):
+                    self._stats[i] = 0.
+
+    def _record(self, *values):
+        """ values: list of (index, value) """
+        with self._stats.get_lock():
+            for i, v in values:
+                self._stats[i] += v
+
     def prepare(self, **kwargs):
         for i in self.recipes:
             i.prepare(**kwargs)
 
     def process(self, *args):
+        stats = self._stats
+        inplace = self._inplace
+        # buffers which can be modified in-place
+        owned = set(_root_id(x) for x in _data_arrays(args)
+                    if isinstance(x, np.ndarray)) if inplace else set()
         for i, f in enumerate(self.recipes):
+            if stats is not None:
+                inputs = set(_root_id(x) for x in _iter_arrays(args))
+                start = timeit.default_timer()
             # return iterator (iterate over all of them)
-            args = f.process(*as_tuple(args))
+            if inplace and f.inplace:
+                X = [x if isinstance(x, np.ndarray) else None
+                     for x in _data_arrays(args)]
+                roots = [None if x is None else _root_id(x) for x in X]
+                # only contiguous (i.e. not self-overlapped), writeable
+                # buffers, which are not shared between data.
+                writable = [r is not None and r in owned and roots.count(r) == 1 and
+                            x.flags['WRITEABLE'] and
+                            (x.flags['C_CONTIGUOUS'] or x.flags['F_CONTIGUOUS'])
+                            for x, r in zip(X, roots)]
+                args = f.process_inplace(writable, *as_tuple(args))
+            else:
+                args = f.process(*as_tuple(args))
+            if stats is not None:
+                duration = timeit.default_timer() - start
+                nbytes = 0 if args is None else \
+                    sum(x.nbytes for x in _iter_arrays(args)
+                        if _root_id(x) not in inputs)
+                self._record((4 * i, duration), (4 * i + 1, nbytes),
+                             (4 * i + 2, 1))
             # break the chain if one of the recipes get error,
             # and return None
             if args is None:
                 return None
+            # the buffers returned by in-place recipes are owned
+            if inplace and f.inplace:
+                owned.update(_root_id(x) for x in _data_arrays(args)
+                             if isinstance(x, np.ndarray))
         return args
 
+    def _timed_group(self, i, x, clock):
+        """ Iterate over the generator `x` returned by the group of
+        recipe `i`, the time spent in the previous recipes (recorded in
+        `clock`) is excluded """
+        while True:
+            start = timeit.default_timer()
+            upstream = clock[0]
+            try:
+                r = next(x)
+            except StopIteration:
+                r = StopIteration
+            duration = timeit.default_timer() - start
+            self._record((4 * i + 3, duration - (clock[0] - upstream)))
+            clock[0] = upstream + duration
+            if r is StopIteration:
+                break
+            yield r
+
+    def _count_batches(self, x):
+        for r in x:
+            if r is not None:
+                self._record((len(self._stats) - 1, 1))
+            yield r
+
     def group(self, x):
-        for f in self.recipes:
+        if self._stats is None:
+            for f in self.recipes:
+                x = f.group(x)
+            return x
+        clock = [0.]
+        for i, f in enumerate(self.recipes):
+            start = timeit.default_timer()
             x = f.group(x)
+            self._record((4 * i + 3, timeit.default_timer() - start))
+            if isinstance(x, types.GeneratorType):
+                x = self._timed_group(i, x, clock)
+        if isinstance(x, types.GeneratorType):
+            return self._count_batches(x)
         return x
 
     def shape_transform(self, shapes, indices):
@@ -137,7 +312,7 @@ class TransLoader(FeederRecipe):
     ----------
     transcription: dict
         if path to a file is specified, the file must specified
-        <name> -> [frame1, frame2, ...]
+        <name> -> [frame1, frame2, ...] (list or numpy.ndarray)
         if list is given, the list must contain the same information
         if dictionary is given, the dict must repesent the same mapping
         above
@@ -165,7 +340,7 @@ class TransLoader(FeederRecipe):
         self.delimiter = delimiter
         # ====== label dict if available ====== #
         if label_dict is None:
-            label_func = lambda x: x
+            label_func = None
         elif isinstance(label_dict, dict):
             label_func = lambda x: label_dict[x]
         elif callable(label_dict):
@@ -175,16 +350,20 @@ class TransLoader(FeederRecipe):
         self.label_dict = label_func
 
     def process(self, name, X):
-        if name not in self._transcription and self.ignore_not_found:
-            return None
-        trans = self._transcription[name]
+        trans = self._transcription.get(name, None)
+        if trans is None:
+            if self.ignore_not_found:
+                return None
+            raise KeyError('Cannot find transcription for: %s' % name)
+        label_func = (lambda x: x) if self.label_dict is None else self.label_dict
         # ====== parse string using delimiter ====== #
         if isinstance(trans, str):
-            trans = [self.label_dict(i)
+            trans = [label_func(i)
                      for i in trans.split(self.delimiter)
                      if len(i) > 0]
-        else:
-            trans = [self.label_dict(i) for i in trans]
+        # ndarray (view of MmapDict) is only casted
+        elif not isinstance(trans, np.ndarray) or self.label_dict is not None:
+            trans = [label_func(i) for i in trans]
         trans = np.asarray(trans, dtype=self.dtype)
         return name, X, trans
 
@@ -226,8 +405,12 @@ class Normalization(FeederRecipe):
     ----
     All computation are performed in float32, hence, the return dtype
     is always float32
+    The normalization is performed in-place on the float32 copy of the data,
+    or directly on the data (no copy) if called in-place by `FeederList`.
     """
 
+    inplace = True
+
     def __init__(self, mean=None, std=None, local_normalize=False):
         super(Normalization, self).__init__()
         # mean
@@ -245,12 +428,19 @@ class Normalization(FeederRecipe):
         self.local_normalize = local_normalize
 
     def process(self, name, X, *args):
-        X = [x.astype('float32') for x in X]
-        if self.local_normalize:
-            X = [(x - x.mean(0)) / x.std(0) for x in X]
-        if self.mean is not None and self.std is not None:
-            X = [(x - mean) / std
-                 for x, mean, std in zip(X, self.mean, self.std)]
+        return self.process_inplace([False] * len(X), name, X, *args)
+
+    def process_inplace(self, writable, name, X, *args):
+        X = [x if w and x.dtype == np.float32 else x.astype('float32')
+             for x, w in zip(X, writable)]
+        for i, x in enumerate(X):
+            if self.local_normalize:
+                mean, std = x.mean(0), x.std(0)
+                x -= mean
+                x /= std
+            if self.mean is not None and self.std is not None:
+                x -= self.mean[i] if isinstance(self.mean, list) else self.mean
+                x /= self.std[i] if isinstance(self.std, list) else self.std
         return (name, X) + args
 
 
@@ -259,16 +449,23 @@ class FeatureScaling(FeederRecipe):
     Scaling data into range [0, 1]
     """
 
+    inplace = True
+
     def __init__(self):
         super(FeatureScaling, self).__init__()
 
     def process(self, name, X, *args):
+        return self.process_inplace([False] * len(X), name, X, *args)
+
+    def process_inplace(self, writable, name, X, *args):
         # ====== scaling features to [0, 1] ====== #
         _ = []
-        for x in X:
-            x = x.astype('float32')
+        for x, w in zip(X, writable):
+            if not w or x.dtype != np.float32:
+                x = x.astype('float32')
             min_ = x.min(); max_ = x.max()
-            x = (x - min_) / (max_ - min_)
+            x -= min_
+            x /= (max_ - min_)
             _.append(x)
         X = _
         return (name, X) + args
@@ -483,9 +680,21 @@ class VADindex(FeederRecipe):
     transcription_transform: callable
         a function transform a sequence of transcription value into
         desire value for 1 sample.
+    plan_cache_bytes: int, None
+        maximum size in bytes of the cached gather plans (in each process),
+        the least recently used plans are dropped first, None for no limit.
+
+    Note
+    ----
+    The gather plan (i.e. frames index of every returned sample) is computed
+    once per file and cached by file name, then the next epochs only pay
+    for one fancy-indexing call per array. The plans are built inside the
+    processes, hence, the cache only pays off with `Feeder(persistent=True)`,
+    otherwise, the processes (and their cache) are re-created every epoch.
     """
 
-    def __init__(self, vad, frame_length, padding=None):
+    def __init__(self, vad, frame_length, padding=None,
+                 plan_cache_bytes=64 * 1024 * 1024):
         super(VADindex, self).__init__()
         if isinstance(vad, (list, tuple)):
             if len(vad) == 2:
@@ -501,52 +710,81 @@ class VADindex(FeederRecipe):
         self.vad = vad
         self.padding = padding
         self.frame_length = frame_length
-
-    def _vad_indexing_1(self, X, indices):
-        return np.concatenate([X[start:end] for start, end in indices], axis=0)
-
-    def _vad_indexing(self, X, indices, n):
-        # ====== create placeholder array ====== #
-        shape = (n, self.frame_length,) + X.shape[1:]
-        if self.padding is None:
-            Y = np.empty(shape=shape, dtype=X.dtype)
+        # name -> cached gather plan
+        self._plans = _LRUCache(maxsize=None, maxbytes=plan_cache_bytes)
+
+    def _gather_plan(self, name, indices):
+        """ Return the cached gather plan of given file:
+        if `frame_length=1`: the flat index of all VAD frames.
+        otherwise: (row_end, row_start), output row `i` contains the frames
+        `[row_end[i] - frame_length, row_end[i])`, the frames before
+        `row_start[i]` are padded (`row_start` is None if no padding).
+        """
+        try: # the plans are dropped if frame_length or padding changed
+            return self._plans.get(name, (self.frame_length, self.padding))
+        except KeyError:
+            pass
+        indices = np.asarray(indices, dtype='int64').reshape(-1, 2)
+        start, end = indices[:, 0], indices[:, 1]
+        fl = self.frame_length
+        if fl == 1:
+            n = end - start
+            plan = np.arange(n.sum()) + np.repeat(start - (np.cumsum(n) - n), n)
         else:
-            Y = np.full(shape=shape, fill_value=self.padding, dtype=X.dtype)
-        # ====== start processing ====== #
-        p = 0
-        for start, end in indices:
             n = end - start
-            # not enough frames
-            if n <= self.frame_length:
-                diff = self.frame_length - (end - start)
-                if self.padding is None:
-                    x = X[end - self.frame_length:end] if diff <= start else None
-                else:
-                    x = X[start:end]
-                if x is not None:
-                    Y[p, -x.shape[0]:] = x
-                    p += 1
-            # more frames thant the length
-            elif n > self.frame_length:
-                i = n // self.frame_length
-                x = X[(end - i * self.frame_length):end]
-                # remains (now the number of remain always smaller than
-                # frame_length) do the same for `n <= self.frame_length`
-                j = n - i * self.frame_length
-                if j > 0:
-                    diff = self.frame_length - j
-                    if self.padding is None and diff <= start:
-                        Y[p] = X[start - diff:start + j]
-                        p += 1
-                    else:
-                        Y[p, -j:] = X[start:start + j]
-                        p += 1
-                # assign the main part
-                Y[p:p + i] = np.reshape(x,
-                    newshape=(i, self.frame_length,) + x.shape[1:])
-                p += i
+            padding = self.padding is not None
+            # ====== not enough frames: 1 row (or 0 if cannot pad) ====== #
+            short = n <= fl
+            if not padding:
+                # use previous frames for padding
+                short_rows = (short & (fl - n <= start)).astype('int64')
+            else:
+                short_rows = short.astype('int64')
+            # ====== more frames: remain row + main rows ====== #
+            i = np.where(short, 0, n // fl)
+            j = np.where(short, 0, n % fl)
+            remain = j > 0
+            nb_rows = short_rows + remain + i
+            seg = np.repeat(np.arange(n.shape[0]), nb_rows)
+            k = np.arange(seg.shape[0]) - np.repeat(np.cumsum(nb_rows) - nb_rows,
+                                                    nb_rows)
+            start, end, i, j, remain = start[seg], end[seg], i[seg], j[seg], remain[seg]
+            is_remain = remain & (k == 0)
+            row_end = np.where(short[seg], end,
+                      np.where(is_remain, start + j,
+                               end - (i - (k - remain) - 1) * fl))
+            # remain rows are padded with previous frames if possible,
+            # otherwise, padded with `padding` (or 0)
+            if padding:
+                row_start = start
+            else:
+                row_start = np.where(is_remain & (fl - j > start), start, 0)
+            if not np.any(row_end - fl < row_start):
+                row_start = None
+            plan = (row_end, row_start)
+        self._plans.put(name, plan)
+        return plan
+
+    def _vad_indexing(self, X, plan):
+        if self.frame_length == 1:
+            return X[plan]
+        row_end, row_start = plan
+        idx = row_end[:, None] + np.arange(-self.frame_length, 0)[None, :]
+        if row_start is None:
+            return X[idx]
+        pad = idx < row_start[:, None]
+        Y = X[np.where(pad, 0, idx)]
+        if np.any(pad):
+            Y[pad] = 0 if self.padding is None else self.padding
         return Y
 
+    def _vad_labels(self, a, plan):
+        # only the label of the last frame of each row is kept
+        if self.frame_length == 1 or a.ndim > 1:
+            y = self._vad_indexing(a, plan)
+            return y if self.frame_length == 1 else self._slice_last_axis(y)
+        return a[plan[0] - 1]
+
     def _estimate_number_of_sample(self, start, end):
         if end - start < self.frame_length:
             diff = self.frame_length - (end - start)
@@ -558,26 +796,20 @@ class VADindex(FeederRecipe):
 
     def _slice_last_axis(self, x):
         s = [slice(None) for i in range(x.ndim - 1)] + [-1]
-        return x[s]
+        return x[tuple(s)]
 
     def process(self, name, X, *args):
         # ====== return None, ignore the file ====== #
-        if name not in self.vad:
+        # one lookup (MmapDict is read by every worker)
+        segments = self.vad.get(name, None)
+        if segments is None:
             return None
         # ====== found the VAD, process it ====== #
-        indices = self.vad[name]
-        if self.frame_length == 1:
-            X = [self._vad_indexing_1(x, indices) for x in X]
-            args = [self._vad_indexing_1(a, indices) for a in args]
-        else:
-            n = sum(self._estimate_number_of_sample(start, end)
-                    for start, end in indices)
-            if n > 0:
-                X = [self._vad_indexing(x, indices, n) for x in X]
-                args = [self._slice_last_axis(self._vad_indexing(a, indices, n))
-                        for a in args]
-            else:
-                return None
+        plan = self._gather_plan(name, segments)
+        if self.frame_length != 1 and plan[0].shape[0] == 0:
+            return None
+        X = [self._vad_indexing(x, plan) for x in X]
+        args = [self._vad_labels(np.asarray(a), plan) for a in args]
         return (name, tuple(X)) + tuple(args)
 
     def shape_transform(self, shapes, indices):
@@ -618,6 +850,12 @@ class Stacking(FeederRecipe):
     shift: int, None
         if None, shift = right_context
         else amount of frames will be shifted
+
+    Note
+    ----
+    The stacked frames are returned as read-only strided views on the
+    input (no copy), the data are only copied once when the batch is
+    created (e.g. by `CreateBatch`).
     """
 
     def __init__(self, left_context=10, right_context=10, shift=None):
@@ -627,21 +865,26 @@ class Stacking(FeederRecipe):
         self.n = int(left_context) + 1 + int(right_context)
         self.shift = self.n if shift is None else int(shift)
 
+    def _nb_frames(self, length):
+        return max(1 + (length - self.n) // self.shift, 0)
+
     def _stacking(self, x):
-        # x is ndarray
-        idx = list(range(0, x.shape[0], self.shift))
-        _ = [x[i:i + self.n].reshape(1, -1) for i in idx
-             if (i + self.n) <= x.shape[0]]
-        x = np.concatenate(_, axis=0) if len(_) > 1 else _[0]
-        return x
+        # x is ndarray, the row i of the stacked array is the flattened
+        # x[i * shift:i * shift + n] which is contiguous in memory, hence,
+        # return a read-only strided view (no copy) on x.
+        x = np.ascontiguousarray(x)
+        n_features = int(np.prod(x.shape[1:]))
+        itemsize = x.dtype.itemsize
+        return as_strided(x, shape=(self._nb_frames(x.shape[0]), self.n * n_features),
+                          strides=(self.shift * n_features * itemsize, itemsize),
+                          writeable=False)
 
     def _middle_label(self, trans):
-        idx = list(range(0, len(trans), self.shift))
         # only take the middle labelobject
-        trans = np.asarray(
-            [trans[i + self.left_context + 1]
-             for i in idx if (i + self.n) <= len(trans)])
-        return trans
+        trans = np.asarray(trans)
+        idx = np.arange(self._nb_frames(len(trans))) * self.shift + \
+            self.left_context + 1
+        return trans[idx]
 
     def process(self, name, X, *args):
         if X[0].shape[0] < self.n: # not enough data points for stacking
@@ -701,9 +944,17 @@ class Sequencing(FeederRecipe):
             - 'pad'   Pad with a constant value
     endvalue: Number
         the value to use for end='pad'
-    transcription_transform: callable
+    transcription_transform: str, callable
         a function transform a sequence of transcription value into
-        desire value for 1 sample.
+        desire value for 1 sample. Built-in vectorized reducers (operate on
+        all the windows at once, the padded values are ignored):
+            - 'last': the last label of the window
+            - 'first': the first label of the window
+            - 'majority': the most common label (the smallest label if ties)
+            - 'mean': the average of the labels (float64)
+        `Sequencing.last_seen` and `Sequencing.most_common` are mapped to
+        'last' and 'majority'. Other callable are called on each window
+        (slow, only as a fallback).
 
     Return
     ------
@@ -721,9 +972,11 @@ class Sequencing(FeederRecipe):
     def last_seen(x):
         return x[-1]
 
+    REDUCERS = ('last', 'first', 'majority', 'mean')
+
     def __init__(self, frame_length=256, hop_length=128,
                  end='cut', endvalue=0., endmode='post',
-                 transcription_transform=lambda x: x[-1]):
+                 transcription_transform='last'):
         super(Sequencing, self).__init__()
         if hop_length > frame_length:
             raise ValueError("hop_length=%d must be smaller than frame_length=%d"
@@ -733,7 +986,42 @@ class Sequencing(FeederRecipe):
         self.end = end
         self.endvalue = endvalue
         self.endmode = endmode
-        self.__transcription_transform = functionable(transcription_transform)
+        if transcription_transform is Sequencing.last_seen:
+            transcription_transform = 'last'
+        elif transcription_transform is Sequencing.most_common:
+            transcription_transform = 'majority'
+        if is_string(transcription_transform):
+            if transcription_transform not in Sequencing.REDUCERS:
+                raise ValueError('Unsupported transcription_transform="%s", the '
+                                 'built-in reducers are: %s' %
+                                 (transcription_transform, Sequencing.REDUCERS))
+        elif transcription_transform is not None:
+            transcription_transform = functionable(transcription_transform)
+        self.__transcription_transform = transcription_transform
+
+    def _reduce(self, a, reducer):
+        """ Vectorized reduction of the windows of labels `a` """
+        # windows of the labels' indices, -1 for padded values
+        idx = segment_axis(np.arange(a.shape[0]), self.frame_length,
+                           self.hop_length, axis=0, end=self.end,
+                           endvalue=-1, endmode=self.endmode)
+        valid = idx >= 0
+        if reducer == 'last':
+            pos = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+            return a[idx[np.arange(idx.shape[0]), pos]]
+        elif reducer == 'first':
+            pos = np.argmax(valid, axis=1)
+            return a[idx[np.arange(idx.shape[0]), pos]]
+        elif reducer == 'majority':
+            labels, codes = np.unique(a, return_inverse=True)
+            nb_labels = labels.shape[0]
+            codes = codes[idx] + np.arange(idx.shape[0])[:, None] * nb_labels
+            counts = np.bincount(codes[valid], minlength=idx.shape[0] * nb_labels)
+            return labels[np.argmax(counts.reshape(-1, nb_labels), axis=1)]
+        # mean
+        values = a[np.where(valid, idx, 0)].astype('float64')
+        weights = valid.reshape(valid.shape + (1,) * (a.ndim - 1))
+        return (values * weights).sum(axis=1) / weights.sum(axis=1)
 
     def process(self, name, X, *args):
         # not enough data points for sequencing
@@ -748,7 +1036,10 @@ class Sequencing(FeederRecipe):
         # ====== transforming the transcription ====== #
         _ = []
         trans_transform = self.__transcription_transform
-        if trans_transform is not None:
+        if is_string(trans_transform):
+            args = tuple([self._reduce(np.asarray(a), trans_transform)
+                          for a in args])
+        elif trans_transform is not None:
             for a in args:
                 original_dtype = a.dtype
                 a = segment_axis(np.asarray(a, dtype='str'),
@@ -792,6 +1083,76 @@ class Sequencing(FeederRecipe):
 # ===========================================================================
 # Returning results
 # ===========================================================================
+def _create_batch_plan(lengths, batch_size, rng=None):
+    """ Compute the index plan of `CreateBatch` for a whole buffer
+
+    Each file is divided into segments of `batch_size`, the segments are
+    shuffled per file, then the i-th segment of every file are grouped
+    (and shuffled again) to create the batches.
+
+    Parameters
+    ----------
+    lengths: list of int
+        number of samples of each file
+    batch_size: int
+        size of 1 segment
+    rng: numpy.random.RandomState, None
+        if given, shuffle the segments of each file and the samples of each
+        group (the same calls of `rng` as grouping file-by-file)
+
+    Return
+    ------
+    groups: list of (length, segments)
+        `segments` is the list of (file, start, end, concat_start, concat_end),
+        the samples `[start:end]` of `file` are the samples
+        `[concat_start:concat_end]` of all the segments concatenated
+    position: ndarray (int64), None
+        position inside its group of every sample of the concatenated
+        segments, None if no `rng` (i.e. the segments are contiguous)
+    """
+    lengths = np.asarray(lengths, dtype='int64')
+    nb_segments = (lengths - 1) // batch_size + 1
+    segments = [list(range(n)) for n in nb_segments]
+    if rng is not None:
+        [rng.shuffle(i) for i in segments]
+    nb_groups = int(nb_segments.max()) if len(segments) > 0 else 0
+    if nb_groups <= 0:
+        return [], None
+    # ====== segments sorted by (group, file) ====== #
+    seg_file = np.repeat(np.arange(len(lengths)), nb_segments)
+    seg_group = np.arange(seg_file.shape[0]) - \
+        np.repeat(np.cumsum(nb_segments) - nb_segments, nb_segments)
+    seg_start = np.array(sum(segments, []), dtype='int64') * batch_size
+    seg_length = np.minimum(batch_size, lengths[seg_file] - seg_start)
+    order = np.lexsort((seg_file, seg_group))
+    seg_file = seg_file[order]
+    seg_group = seg_group[order]
+    seg_start = seg_start[order]
+    seg_length = seg_length[order]
+    # ====== split the segments into groups ====== #
+    group_length = np.bincount(seg_group, weights=seg_length,
+                               minlength=nb_groups).astype('int64')
+    group_nb_segments = np.bincount(seg_group, minlength=nb_groups)
+    group_start = np.cumsum(group_length) - group_length
+    concat_start = np.cumsum(seg_length) - seg_length
+    segments = list(zip(seg_file.tolist(), seg_start.tolist(),
+                        (seg_start + seg_length).tolist(),
+                        concat_start.tolist(),
+                        (concat_start + seg_length).tolist()))
+    groups = []
+    for n, i, j in zip(group_length.tolist(),
+                       np.cumsum(group_nb_segments).tolist(),
+                       group_nb_segments.tolist()):
+        groups.append((n, segments[i - j:i]))
+    # ====== shuffle inside each group ====== #
+    if rng is None:
+        return groups, None
+    position = np.empty(shape=(int(group_length.sum()),), dtype='int64')
+    for start, n in zip(group_start.tolist(), group_length.tolist()):
+        position[start + rng.permutation(n)] = np.arange(n)
+    return groups, position
+
+
 class CreateBatch(FeederRecipe):
     """ Batching
     Parameters
@@ -800,6 +1161,13 @@ class CreateBatch(FeederRecipe):
         must be a function has take a list of np.ndarray as first arguments
         ([X]) or ([X, y]), you can return None to ignore given batch, return the
         data for accepting the batch
+    reuse_buffer: bool
+        if True, the output buffers are reused for the next call of `group`
+        (each group of one call has its own buffers), hence, the returned
+        batches are overwritten by the next call, and must be copied before
+        that. Only use it with the shared-memory transport of the Feeder
+        (i.e. `shm_slot_size` big enough to hold 1 batch), the batches
+        bigger than a slot are copied before being sent via the Queue.
 
     Example
     -------
@@ -809,9 +1177,14 @@ class CreateBatch(FeederRecipe):
     >>>     F.recipes.CreateBatch(lambda x: (x[0], x[1]) if len(set(x[1])) > 1 else None)
     >>> ])
 
+    Note
+    ----
+    The index plan of the whole buffer is computed once, then every sample
+    is copied only once directly into its position in the output batches,
+    one group of segments at a time (i.e. the group stays in cache).
     """
 
-    def __init__(self, batch_filter=None):
+    def __init__(self, batch_filter=None, reuse_buffer=False):
         super(CreateBatch, self).__init__()
         self.rng = None
         self.batch_size = 256
@@ -821,6 +1194,8 @@ class CreateBatch(FeederRecipe):
             raise ValueError('batch_filter must be a function has 1 or 2 '
                              'parameters (X) or (X, y).')
         self.__batch_filter = functionable(batch_filter)
+        self.reuse_buffer = bool(reuse_buffer)
+        self._buffers = {}
 
     def prepare(self, **kwargs):
         shuffle_level = kwargs.get('shuffle_level', 0)
@@ -830,6 +1205,18 @@ class CreateBatch(FeederRecipe):
             self.rng = np.random.RandomState(seed=seed)
         self.batch_size = kwargs.get('batch_size', 64)
 
+    def _get_buffer(self, key, shape, dtype):
+        """ key: (group index, input index), so the batches returned by
+        the same call of `group` never share a buffer """
+        if not self.reuse_buffer:
+            return np.empty(shape=shape, dtype=dtype)
+        buf = self._buffers.get(key, None)
+        if buf is None or buf.dtype != dtype or buf.shape[1:] != shape[1:] or \
+        buf.shape[0] < shape[0]:
+            buf = np.empty(shape=shape, dtype=dtype)
+            self._buffers[key] = buf
+        return buf[:shape[0]]
+
     def group(self, batch):
         """ batch: contains
             [
@@ -846,40 +1233,32 @@ class CreateBatch(FeederRecipe):
         if len(batch) == 0:
             yield None
         else:
-            rng = self.rng
             batch_size = self.batch_size
             batch_filter = self.__batch_filter
-            indices = [list(range((b[1][0].shape[0] - 1) // batch_size + 1))
-                       for b in batch]
-            # shuffle if possible
-            if rng is not None:
-                [rng.shuffle(i) for i in indices]
-            # ====== create batch of data ====== #
-            for idx in zip_longest(*indices):
+            lengths = [b[1][0].shape[0] for b in batch]
+            groups, position = _create_batch_plan(lengths, batch_size, self.rng)
+            inputs = [[np.asarray(i) for i in x]
+                      for x in zip(*[list(b[1]) + list(b[2:]) for b in batch])]
+            dtypes = [np.result_type(*x) for x in inputs]
+            for g, (length, segments) in enumerate(groups):
+                # ====== gather each input directly into the group ====== #
                 ret = []
-                for i, b in zip(idx, batch):
-                    # skip if one of the data is not enough
-                    if i is None: continue
-                    # pick data from each given input
-                    name = b[0]; data = b[1]; others = b[2:]
-                    start = i * batch_size
-                    end = start + batch_size
-                    _ = [d[start:end] for d in data] + \
-                    [o[start:end] for o in others]
-                    ret.append(_)
-                ret = [np.concatenate(x, axis=0) for x in zip(*ret)]
-                # # shuffle 1 more time
-                if rng is not None:
-                    permutation = rng.permutation(ret[0].shape[0])
-                    ret = [r[permutation] for r in ret]
-                # return the batches
-                for i in range((ret[0].shape[0] - 1) // batch_size + 1):
-                    start = i * batch_size
-                    end = start + batch_size
-                    _ = batch_filter([x[start:end] for x in ret])
+                for i, (x, dtype) in enumerate(zip(inputs, dtypes)):
+                    out = self._get_buffer((g, i), (length,) + x[0].shape[1:],
+                                           dtype)
+                    for f, start, end, concat_start, concat_end in segments:
+                        if position is None: # no shuffling, contiguous copy
+                            pos = concat_start - segments[0][3]
+                            out[pos:pos + end - start] = x[f][start:end]
+                        else:
+                            out[position[concat_start:concat_end]] = x[f][start:end]
+                    ret.append(out)
+                # ====== return the batches ====== #
+                for start in range(0, length, batch_size):
+                    _ = batch_filter([x[start:start + batch_size] for x in ret])
                     # always return tuple or list
                     if _ is not None:
-                        yield _ if isinstance(_, (tuple, list)) else (ret,)
+                        yield _ if isinstance(_, (tuple, list)) else (_,)
 
 
 class CreateFile(FeederRecipe):
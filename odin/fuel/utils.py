@@ -2,7 +2,11 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import mmap
+import struct
 import marshal
+import numbers
+import hashlib
+from six import PY2, text_type
 from six.moves import cPickle
 from collections import OrderedDict
 
@@ -11,62 +15,333 @@ import numpy as np
 from odin.config import RNG_GENERATOR
 
 
+# ===========================================================================
+# MmapDict
+# ===========================================================================
+# record: kind, value codec, key size, value size
+_RECORD = struct.Struct('<BBxxIQ')
+# ndarray value: offset of the raw bytes, size of the marshaled
+# (dtype, shape), followed by the marshaled (dtype, shape), the padding
+# and the raw bytes
+_ARRAY_HEADER = struct.Struct('<HH')
+_ARRAY_ALIGN = 16
+# hash table slot: hash of the key, offset of the record
+_SLOT = struct.Struct('<QQ')
+# header: magic, nb_items, nb_slots, table offset, end of file,
+# nb_used_slots, first record
+_HASH_HEADER = struct.Struct('<8s6Q')
+_HASH_HEADER_SIZE = 64
+
+_ITEM, _DELETED, _TABLE = 1, 2, 3
+_EMPTY, _TOMBSTONE = 0, 1
+_MARSHAL, _NDARRAY = 0, 1
+
+
+def _normalize_key(key):
+    """ Equal keys must give the same marshal bytes: bool, integral float
+    and numpy scalar are converted to int (or float), and in python 2,
+    ASCII unicode is converted to str """
+    if isinstance(key, (numbers.Integral, np.bool_)):
+        return int(key)
+    if isinstance(key, (float, np.floating)):
+        key = float(key)
+        return int(key) if key.is_integer() else key
+    if PY2 and isinstance(key, text_type):
+        try:
+            return key.encode('ascii')
+        except UnicodeEncodeError:
+            return key
+    if isinstance(key, tuple):
+        return tuple(_normalize_key(i) for i in key)
+    return key
+
+
+def _dump_key(key):
+    # version 0 has no interned or referenced objects, so the same key
+    # always gives the same bytes
+    return marshal.dumps(_normalize_key(key), 0)
+
+
+def _hash_key(key):
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+
+def _encode_value(value):
+    """ Return (codec, encoded value), the encoded ndarray is a read-only
+    copy of `value`, its header is written when the record is flushed """
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise ValueError('MmapDict does not support ndarray of objects.')
+        value = np.array(value, copy=True, order='C')
+        value.flags.writeable = False
+        return _NDARRAY, value
+    return _MARSHAL, marshal.dumps(value)
+
+
+def _array_header(value, position):
+    """ Header of the ndarray `value` whose record value starts at
+    `position` of the file, the raw bytes are aligned to `_ARRAY_ALIGN` """
+    dtype = value.dtype.descr if value.dtype.names else value.dtype.str
+    meta = marshal.dumps((dtype, tuple(int(i) for i in value.shape)), 0)
+    size = _ARRAY_HEADER.size + len(meta)
+    size += -(position + size) % _ARRAY_ALIGN
+    return _ARRAY_HEADER.pack(size, len(meta)) + meta.ljust(size - _ARRAY_HEADER.size, b'\0')
+
+
+def _decode_value(codec, buf, start, size):
+    """ Decode the value stored in `buf[start:start + size]`, the ndarray
+    is a read-only view of `buf` (no copy) """
+    if codec == _MARSHAL:
+        return marshal.loads(buf[start:start + size])
+    elif codec == _NDARRAY:
+        offset, meta_size = _ARRAY_HEADER.unpack_from(buf, start)
+        dtype, shape = marshal.loads(
+            buf[start + _ARRAY_HEADER.size:start + _ARRAY_HEADER.size + meta_size])
+        dtype = np.dtype(dtype)
+        if size == offset:
+            return np.empty(shape, dtype=dtype)
+        x = np.frombuffer(buf, dtype=dtype, count=(size - offset) // dtype.itemsize,
+                          offset=start + offset).reshape(shape)
+        x.flags.writeable = False
+        return x
+    raise ValueError('Unknown value codec: %d' % codec)
+
+
 class MmapDict(dict):
     """ MmapDict
     Handle enormous dictionary (up to thousand terabytes of data) in
     memory mapped dictionary, extremely fast to load, and randomly access.
 
+    The records (key, value) are appended to the file, and indexed by an
+    open-addressing hash table stored in the same file, opening the
+    dictionary only reads the fixed size header, a lookup only touches
+    the hash slots and the record, and the memory usage does not depend
+    on the number of keys.
+
     Note
     ----
-    Only support (key, value) types = (str, primitive_type)
-
+    Only support (key, value) types = (primitive_type, primitive_type or
+    numpy.ndarray), the ndarray is stored as raw bytes with its dtype and
+    shape, and read back as a read-only view of the memory map (no copy).
+    The keys which are equal in python are the same key (e.g. 1, 1.0 and
+    True; 'x' and u'x'), and are returned by `keys` in the normalized
+    form (i.e. 1 and 'x').
+    The dictionary created by older version (pickled index) can still be
+    read, and is converted to the new format the first time it is
+    modified.
+    Only one process can write, the dictionary can be read concurrently
+    by many processes: a forked process (e.g. the workers of `Feeder` or
+    `MPI`) reopens its own read-only handle on first access, and a reader
+    remaps the file when the writer has flushed new items.
     """
     HEADER = 'mmapdict'
+    HASH_HEADER = b'mmaphash'
     SIZE_BYTES = 48
+    # number of bytes written before automatically flush
+    MAX_WRITE_SIZE = 48000
+    # maximum fraction of used slots of the hash table
+    MAX_LOAD = 0.5
+    MIN_SLOTS = 1024
 
     def __init__(self, path, read_only=False):
         super(MmapDict, self).__init__()
-        self.__init(path, read_only)
         self.read_only = read_only
+        self.__init(path, read_only)
 
     def __init(self, path, read_only):
+        self._path = path
+        self._pid = os.getpid()
+        self._legacy = None
+        # records not flushed yet: list of (key, marshaled key, hash,
+        # codec, encoded value), and key -> (codec, encoded value)
+        self._write_value = []
+        self._write_size = 0
+        self._new_dict = {}
+        # ndarray views of the mmap were returned, the mmap is released
+        # when all the views are deleted
+        self._exported = False
         # ====== already exist ====== #
         if os.path.exists(path) and os.path.getsize(path) > 0:
-            file = open(str(path), mode='r+')
-            if file.read(len(MmapDict.HEADER)) != MmapDict.HEADER:
+            file = open(str(path), mode='rb' if read_only else 'r+b')
+            header = file.read(len(MmapDict.HASH_HEADER))
+            if header == MmapDict.HEADER.encode():
+                self._open_legacy(file)
+                return
+            elif header != MmapDict.HASH_HEADER:
+                file.close()
                 raise Exception('Given file is not in the right format '
                                 'for MmapDict.')
-            # 48 bytes for the file size
-            self._max_position = int(file.read(MmapDict.SIZE_BYTES))
-            # length of pickled indices dictionary
-            dict_size = int(file.read(MmapDict.SIZE_BYTES))
-            # read dictionary
-            file.seek(self._max_position)
-            self._dict = cPickle.loads(file.read(dict_size))
         # ====== create new file from scratch ====== #
         else:
             if read_only:
                 raise Exception('File at path:"%s" does not exist '
                                 '(read-only mode).' % path)
-            self._dict = OrderedDict()
-            # max position is header, include start and length of indices dict
-            self._max_position = len(MmapDict.HEADER) + MmapDict.SIZE_BYTES * 2
-            file = open(str(path), mode='w+')
-            file.write(MmapDict.HEADER) # just write the header
-            file.write(('%' + str(MmapDict.SIZE_BYTES) + 'd') % self._max_position)
-            _ = cPickle.dumps(self._dict, protocol=cPickle.HIGHEST_PROTOCOL)
-            # write the length of Pickled indices dictionary
-            file.write(('%' + str(MmapDict.SIZE_BYTES) + 'd') % len(_))
-            file.write(_)
+            # header | empty hash table | records ...
+            file = open(str(path), mode='w+b')
+            table = _HASH_HEADER_SIZE
+            size = MmapDict.MIN_SLOTS * _SLOT.size
+            end = table + _RECORD.size + size
+            file.write(_HASH_HEADER.pack(MmapDict.HASH_HEADER, 0,
+                MmapDict.MIN_SLOTS, table, end, 0, end).ljust(table, b'\0'))
+            file.write(_RECORD.pack(_TABLE, 0, 0, size))
+            file.truncate(end)
             file.flush()
-        self._path = path
-        self._mmap = mmap.mmap(file.fileno(), length=0, offset=0,
-                               # access=mmap.ACCESS_READ,
-                               flags=mmap.MAP_SHARED)
-        # ignore the header
         self._file = file
-        self._write_value = ''
-        self._new_dict = {}# store all the (key, value) recently added
+        self._map()
+
+    def _open_legacy(self, file):
+        """ Older format: the pickled index is stored after the values """
+        file.seek(len(MmapDict.HEADER))
+        max_position = int(file.read(MmapDict.SIZE_BYTES))
+        # length of pickled indices dictionary
+        dict_size = int(file.read(MmapDict.SIZE_BYTES))
+        file.seek(max_position)
+        self._legacy = cPickle.loads(file.read(dict_size))
+        self._file = file
+        self._mmap = mmap.mmap(file.fileno(), length=0, offset=0,
+                               access=mmap.ACCESS_READ)
+
+    def _release_mmap(self):
+        if getattr(self, '_mmap', None) is not None and not self._exported:
+            self._mmap.close()
+        self._mmap = None
+        self._exported = False
+
+    def _map(self):
+        """ (Re)map the file and read the header """
+        self._release_mmap()
+        self._mmap = mmap.mmap(self._file.fileno(), length=0, offset=0,
+            access=mmap.ACCESS_READ if self.read_only else mmap.ACCESS_WRITE)
+        (_, self._nb_items, self._nb_slots, self._table, self._end,
+         self._nb_used, self._first) = _HASH_HEADER.unpack_from(self._mmap, 0)
+
+    def _map_and_write_header(self):
+        """ Remap the file after appending, and save the header """
+        header = (self._nb_items, self._nb_slots, self._table, self._end,
+                  self._nb_used, self._first)
+        self._map()
+        (self._nb_items, self._nb_slots, self._table, self._end,
+         self._nb_used, self._first) = header
+        self._write_header()
+
+    def _write_header(self):
+        struct.pack_into('<6Q', self._mmap, len(MmapDict.HASH_HEADER),
+                         self._nb_items, self._nb_slots, self._table,
+                         self._end, self._nb_used, self._first)
+
+    def _reopen(self):
+        """ The file and mmap inherited from the parent process are shared
+        with it, open new read-only handle in this process """
+        self._pid = os.getpid()
+        self.read_only = True
+        self._file = open(str(self._path), mode='rb')
+        self._mmap = None
+        if self._legacy is not None:
+            self._mmap = mmap.mmap(self._file.fileno(), length=0, offset=0,
+                                   access=mmap.ACCESS_READ)
+        else:
+            self._map()
+
+    def _refresh(self):
+        """ Remap the file if other process has flushed new items, return
+        True if the file was remapped """
+        if self._legacy is not None or not self.read_only:
+            return False
+        if _HASH_HEADER.unpack_from(self._mmap, 0)[1:] == \
+        (self._nb_items, self._nb_slots, self._table, self._end,
+         self._nb_used, self._first):
+            return False
+        self._map()
+        return True
+
+    def _check_writable(self):
+        if self.read_only:
+            raise Exception('Cannot write to path:"%s" in read-only mode' % self._path)
+        if self._legacy is not None:
+            self._upgrade()
+
+    def _upgrade(self):
+        """ Convert the older format to the hash table format """
+        path = self._path
+        items = [(key, self._read_raw(key)) for key in self._legacy]
+        self._release_mmap()
+        self._file.close()
+        tmp_path = path + '.upgrade'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        d = MmapDict(tmp_path)
+        for key, value in items:
+            d._add(key, _MARSHAL, value)
+        d.close()
+        os.rename(tmp_path, path)
+        self.__init(path, self.read_only)
+
+    # ==================== hash table ==================== #
+    def _find(self, key, h=None):
+        """ Return (slot_index, record_offset) of the flushed `key`,
+        or (None, None) """
+        h = _hash_key(key) if h is None else h
+        mm = self._mmap
+        mask = self._nb_slots - 1
+        table = self._table + _RECORD.size
+        i = h & mask
+        while True:
+            slot_hash, offset = _SLOT.unpack_from(mm, table + i * _SLOT.size)
+            if offset == _EMPTY:
+                return None, None
+            if offset != _TOMBSTONE and slot_hash == h:
+                _, _, key_size, _ = _RECORD.unpack_from(mm, offset)
+                start = offset + _RECORD.size
+                if mm[start:start + key_size] == key:
+                    return i, offset
+            i = (i + 1) & mask
+
+    def _insert_slot(self, h, offset):
+        mm = self._mmap
+        mask = self._nb_slots - 1
+        table = self._table + _RECORD.size
+        i = h & mask
+        while True:
+            position = table + i * _SLOT.size
+            slot_offset = _SLOT.unpack_from(mm, position)[1]
+            if slot_offset in (_EMPTY, _TOMBSTONE):
+                _SLOT.pack_into(mm, position, h, offset)
+                if slot_offset == _EMPTY:
+                    self._nb_used += 1
+                return
+            i = (i + 1) & mask
+
+    def _rehash(self, nb_slots, keep=True):
+        """ Append a new hash table of `nb_slots` at the end of the file,
+        the old table is skipped as dead space """
+        old = np.frombuffer(self._mmap[self._table + _RECORD.size:
+            self._table + _RECORD.size + self._nb_slots * _SLOT.size]
+            if keep else b'', dtype='<u8').reshape(-1, 2)
+        old = old[old[:, 1] > _TOMBSTONE]
+        # linear probing of the sorted home slots
+        home = old[:, 0] & np.uint64(nb_slots - 1)
+        order = np.argsort(home, kind='mergesort')
+        old, home = old[order], home[order].astype('int64')
+        index = np.arange(home.shape[0])
+        position = np.maximum.accumulate(home - index) + index \
+            if home.shape[0] > 0 else home
+        table = np.zeros((nb_slots, 2), dtype='<u8')
+        inside = position < nb_slots
+        table[position[inside]] = old[inside]
+        # wrap around the end of the table
+        i = 0
+        for h, offset in old[~inside]:
+            while table[i, 1] != _EMPTY:
+                i += 1
+            table[i] = (h, offset)
+        # write the new table
+        self._file.seek(self._end)
+        self._file.write(_RECORD.pack(_TABLE, 0, 0, table.nbytes))
+        self._file.write(table.tostring())
+        self._table = self._end
+        self._end += _RECORD.size + table.nbytes
+        self._nb_slots = nb_slots
+        self._nb_used = old.shape[0]
 
     # ==================== I/O methods ==================== #
     @property
@@ -76,99 +351,253 @@ class MmapDict(dict):
     def flush(self):
         if self.read_only:
             raise Exception('Cannot flush to path:"%s" in read-only mode' % self._path)
-        # ====== flush the data ====== #
+        if len(self._write_value) == 0:
+            return
+        # ====== grow the hash table ====== #
+        nb_used = self._nb_used + len(self._write_value)
+        nb_slots = self._nb_slots
+        while nb_used > nb_slots * MmapDict.MAX_LOAD:
+            nb_slots *= 2
+            nb_used = self._nb_items + len(self._write_value)
+        if nb_slots != self._nb_slots:
+            self._rehash(nb_slots)
+        # ====== append the records ====== #
+        self._file.seek(self._end)
+        offsets = []
+        for key, key_bytes, h, codec, value in self._write_value:
+            offsets.append(self._end)
+            start = self._end + _RECORD.size + len(key_bytes)
+            if codec == _NDARRAY:
+                header = _array_header(value, start)
+                value = header + value.tostring()
+            self._file.write(_RECORD.pack(_ITEM, codec, len(key_bytes), len(value)))
+            self._file.write(key_bytes)
+            self._file.write(value)
+            self._end = start + len(value)
+        self._file.flush()
+        self._map_and_write_header()
+        # ====== insert the hash slots ====== #
+        for (key, key_bytes, h, codec, value), offset in zip(self._write_value,
+                                                             offsets):
+            self._insert_slot(h, offset)
+        self._nb_items += len(self._write_value)
+        self._write_header()
         self._mmap.flush()
-        self._mmap.close()
-        self._file.close()
-        # ====== write new data ====== #
-        # save new data
-        file = open(self._path, mode='r+')
-        # get old position
-        file.seek(len(MmapDict.HEADER))
-        old_position = int(file.read(MmapDict.SIZE_BYTES))
-        # write new max size
-        file.seek(len(MmapDict.HEADER))
-        file.write(('%' + str(MmapDict.SIZE_BYTES) + 'd') % self._max_position)
-        # length of Pickled indices dictionary
-        _ = cPickle.dumps(self._dict, protocol=cPickle.HIGHEST_PROTOCOL)
-        file.write(('%' + str(MmapDict.SIZE_BYTES) + 'd') % len(_))
-        # write new values
-        file.seek(old_position)
-        file.write(self._write_value)
-        # write the indices dictionary
-        file.write(_)
-        file.flush()
-        # store new information
-        self._file = file
-        self._mmap = mmap.mmap(self._file.fileno(),
-                               length=0, offset=0,
-                               flags=mmap.MAP_SHARED)
         # reset some values
-        self._max_position = old_position + len(self._write_value)
-        del self._write_value
-        self._write_value = ''
-        del self._new_dict
+        self._write_value = []
+        self._write_size = 0
         self._new_dict = {}
 
     def close(self):
+        if self._pid != os.getpid():
+            self._reopen()
         if not self.read_only:
             self.flush()
-        self._mmap.close()
+        self._release_mmap()
         self._file.close()
 
     def __del__(self):
         if hasattr(self, '_mmap') and self._mmap is not None and \
         self._file is not None:
-            self._mmap.close()
+            self._release_mmap()
             self._file.close()
 
     def __str__(self):
-        return str(self.__class__) + ':' + self._path + ':' + str(len(self._dict))
+        return str(self.__class__) + ':' + self._path + ':' + str(len(self))
 
     def __repr__(self):
         return str(self)
 
     # ==================== Dictionary ==================== #
+    def _locate(self, key, key_bytes=None, h=None):
+        """ Return (codec, start, size) of the encoded value of the flushed
+        `key` in the mmap, or None """
+        if self._pid != os.getpid():
+            self._reopen()
+        if self._legacy is not None:
+            position = self._legacy.get(key, None)
+            return None if position is None else (_MARSHAL,) + tuple(position)
+        key_bytes = _dump_key(key) if key_bytes is None else key_bytes
+        h = _hash_key(key_bytes) if h is None else h
+        try:
+            _, offset = self._find(key_bytes, h)
+        except (struct.error, ValueError): # slot written after the mapping
+            offset = None
+        if offset is None:
+            if not self._refresh():
+                return None
+            _, offset = self._find(key_bytes, h)
+            if offset is None:
+                return None
+        _, codec, key_size, size = _RECORD.unpack_from(self._mmap, offset)
+        return codec, offset + _RECORD.size + key_size, size
+
+    def _decode(self, codec, start, size):
+        """ Decode the value stored at `start` of the mmap """
+        if codec == _NDARRAY:
+            self._exported = True
+        return _decode_value(codec, self._mmap, start, size)
+
+    def _read_raw(self, key):
+        """ Return the marshaled value of `key` (only for marshal codec) """
+        position = self._locate(key)
+        if position is None:
+            raise KeyError(key)
+        _, start, size = position
+        return self._mmap[start:start + size]
+
+    def _read(self, key):
+        """ Return the decoded value of `key` """
+        if key in self._new_dict:
+            codec, value = self._new_dict[key]
+            return value if codec == _NDARRAY else marshal.loads(value)
+        position = self._locate(key)
+        if position is None:
+            raise KeyError(key)
+        return self._decode(*position)
+
+    def _add(self, key, codec, value, auto_flush=True):
+        key = _normalize_key(key)
+        key_bytes = _dump_key(key)
+        self._write_value.append((key, key_bytes, _hash_key(key_bytes),
+                                  codec, value))
+        self._new_dict[key] = (codec, value)
+        self._write_size += len(key_bytes) + \
+            (value.nbytes if codec == _NDARRAY else len(value))
+        if auto_flush and self._write_size > MmapDict.MAX_WRITE_SIZE:
+            self.flush()
+
+    def _iter_records(self, decode=True):
+        """ Yield (key, value) in insertion order, the value is None
+        if not `decode` """
+        if self._pid != os.getpid():
+            self._reopen()
+        self._refresh()
+        if self._legacy is not None:
+            for key, (start, size) in self._legacy.iteritems():
+                yield key, (self._decode(_MARSHAL, start, size)
+                            if decode else None)
+            return
+        mm = self._mmap
+        offset = self._first
+        end = self._end
+        while offset < end:
+            kind, codec, key_size, size = _RECORD.unpack_from(mm, offset)
+            start = offset + _RECORD.size
+            offset = start + key_size + size
+            if kind == _ITEM:
+                yield (marshal.loads(mm[start:start + key_size]),
+                       self._decode(codec, start + key_size, size)
+                       if decode else None)
+        for key, _, _, codec, value in list(self._write_value):
+            yield key, ((value if codec == _NDARRAY else marshal.loads(value))
+                        if decode else None)
+
     def __setitem__(self, key, value):
-        if key in self._dict:
+        if key in self:
             raise Exception('This dictionary do not support update.')
-        # we using marshal so this only support primitive value
-        value = marshal.dumps(value)
-        self._dict[key] = (self._max_position, len(value))
-        self._max_position += len(value)
-        self._write_value += value
-        # store newly added value for fast query
-        self._new_dict[key] = value
-        if len(self._write_value) > 48000:
+        self._check_writable()
+        # marshal for primitive value, raw bytes for ndarray
+        self._add(key, *_encode_value(value))
+
+    def put_many(self, items):
+        """ Add many (key, value), the records are written and indexed
+        in one pass.
+
+        Parameters
+        ----------
+        items : dict, list
+            dictionary or list of (key, value)
+        """
+        items = list(items.items() if isinstance(items, dict) else items)
+        keys = set()
+        for key, _ in items:
+            if key in keys or key in self:
+                raise Exception('This dictionary do not support update.')
+            keys.add(key)
+        self._check_writable()
+        for key, value in items:
+            codec, value = _encode_value(value)
+            self._add(key, codec, value, auto_flush=False)
+        if self._write_size > MmapDict.MAX_WRITE_SIZE:
             self.flush()
 
+    def get_many(self, keys, default=None):
+        """ Return the list of values of given `keys` (`default` for the
+        missing keys), the hash slots and the records are visited in
+        order of their positions in the file. """
+        keys = list(keys)
+        values = [default] * len(keys)
+        if self._pid != os.getpid():
+            self._reopen()
+        # ====== find the records ====== #
+        lookups = []
+        for i, key in enumerate(keys):
+            if key in self._new_dict:
+                values[i] = self._read(key)
+            elif self._legacy is not None:
+                lookups.append((0, i, key, None))
+            else:
+                key_bytes = _dump_key(key)
+                h = _hash_key(key_bytes)
+                lookups.append((h & (self._nb_slots - 1), i, key, key_bytes, h))
+        positions = []
+        for lookup in sorted(lookups, key=lambda x: x[0]):
+            position = self._locate(*lookup[2:])
+            if position is not None:
+                codec, start, size = position
+                positions.append((start, size, codec, lookup[1]))
+        # ====== read and decode ====== #
+        for start, size, codec, i in sorted(positions):
+            values[i] = self._decode(codec, start, size)
+        return values
+
+    def get(self, key, default=None):
+        try:
+            return self._read(key)
+        except KeyError:
+            return default
+
     def __iter__(self):
         return self.iteritems()
 
     def __getitem__(self, key):
-        if key in self._new_dict:
-            return marshal.loads(self._new_dict[key])
-        start, size = self._dict[key]
-        self._mmap.seek(start)
-        return marshal.loads(self._mmap.read(size))
+        return self._read(key)
 
     def __contains__(self, key):
-        return key in self._dict
+        if key in self._new_dict:
+            return True
+        return self._locate(key) is not None
 
     def __len__(self):
-        return len(self._dict)
+        if self._legacy is not None:
+            return len(self._legacy)
+        if self._pid != os.getpid():
+            self._reopen()
+        self._refresh()
+        return self._nb_items + len(self._write_value)
 
     def __delitem__(self, key):
-        del self._dict[key]
+        self._check_writable()
+        if key in self._new_dict:
+            self.flush()
+        i, offset = self._find(_dump_key(key))
+        if offset is None:
+            raise KeyError(key)
+        _SLOT.pack_into(self._mmap, self._table + _RECORD.size + i * _SLOT.size,
+                        0, _TOMBSTONE)
+        struct.pack_into('<B', self._mmap, offset, _DELETED)
+        self._nb_items -= 1
+        self._write_header()
 
     def __cmp__(self, dict):
         if isinstance(dict, MmapDict):
-            return cmp(self._dict, dict._dict)
+            return cmp(OrderedDict(self.items()), OrderedDict(dict.items()))
         else:
-            return cmp(self._dict, dict)
+            return cmp(OrderedDict(self.items()), dict)
 
     def keys(self, shuffle=False):
-        k = self._dict.keys()
+        k = list(self.iterkeys())
         if shuffle:
             RNG_GENERATOR.shuffle(k)
         return k
@@ -176,14 +605,14 @@ class MmapDict(dict):
     def iterkeys(self, shuffle=False):
         if shuffle:
             return (k for k in self.keys(shuffle))
-        return self._dict.iterkeys()
+        return (k for k, _ in self._iter_records(decode=False))
 
     def values(self, shuffle=False):
         return list(self.itervalues(shuffle))
 
     def itervalues(self, shuffle=False):
-        for k in self._dict.iterkeys(shuffle):
-            yield self[k]
+        for k, v in self.iteritems(shuffle):
+            yield v
 
     def items(self, shuffle=False):
         return list(self.iteritems(shuffle))
@@ -191,37 +620,38 @@ class MmapDict(dict):
     def iteritems(self, shuffle=False):
         # ====== shuffling if required ====== #
         if shuffle:
-            it = self._dict.items()
-            RNG_GENERATOR.shuffle(it)
-        else:
-            it = self._dict.iteritems()
+            for key in self.keys(shuffle=True):
+                yield key, self[key]
+            return
         # ====== iter over items ====== #
-        for key, (start, size) in it:
-            if key in self._new_dict:
-                value = self._new_dict[key]
-            else:
-                self._mmap.seek(start)
-                value = self._mmap.read(size)
-            yield key, marshal.loads(value)
+        for key, value in self._iter_records():
+            yield key, value
 
     def clear(self):
-        self._dict.clear()
+        self._check_writable()
+        self.flush()
+        # the older records are ignored, and a new hash table is created
+        self._rehash(MmapDict.MIN_SLOTS, keep=False)
+        self._nb_items = 0
+        self._first = self._table
+        self._file.flush()
+        self._map_and_write_header()
 
     def copy(self):
         raise NotImplementedError
 
     def has_key(self, key):
-        return key in self._dict
+        return key in self
 
     def update(*args, **kwargs):
         raise NotImplementedError
 
     # ==================== pickling ==================== #
-    def __setstate__(self, states):
-        self.__init(states)
-
-    def __getstate__(self):
-        return self._path
+    def __reduce__(self):
+        # only the path is pickled, the file is reopened when unpickled
+        if not self.read_only:
+            self.flush()
+        return (self.__class__, (self._path, self.read_only))
 
 
 class MmapList(object):
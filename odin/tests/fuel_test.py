@@ -5,7 +5,8 @@ from __future__ import print_function, division
 
 import os
 import unittest
-from six.moves import zip, range
+from six.moves import zip, range, cPickle
+from collections import OrderedDict
 
 import numpy as np
 
@@ -101,6 +102,103 @@ class FuelTest(unittest.TestCase):
         X = np.concatenate([x for x in feeder], axis=0)
         self.assertEqual(feeder.shape, X.shape)
 
+    def test_create_batch(self):
+        rng = np.random.RandomState(12)
+        batch = [('name%d' % i, [np.arange(n)[:, None] + 1000 * i],
+                  np.full((n,), i)) for i, n in enumerate((25, 0, 7, 40))]
+        for reuse in (False, True):
+            recipe = F.recipes.CreateBatch(reuse_buffer=reuse)
+            results = []
+            for seed in (None, 1234, 1234):
+                recipe.prepare(batch_size=8, seed=seed, shuffle_level=2)
+                X = [(i.copy(), j.copy()) for i, j in recipe.group(batch)]
+                self.assertTrue(all(i.shape[0] <= 8 for i, j in X))
+                x = np.concatenate([i.ravel() for i, j in X])
+                y = np.concatenate([j for i, j in X])
+                # each sample is returned once with its label
+                self.assertEqual(sorted(x.tolist()), sorted(
+                    np.concatenate([b[1][0].ravel() for b in batch]).tolist()))
+                self.assertTrue(np.all(x // 1000 == y))
+                results.append(x)
+            self.assertTrue(np.array_equal(results[1], results[2]))
+            self.assertFalse(np.array_equal(results[0], results[1]))
+            # the batches of one call never share a buffer
+            recipe.prepare(batch_size=8, seed=1234, shuffle_level=2)
+            x = np.concatenate([i.ravel() for i, j in recipe.group(batch)])
+            self.assertTrue(np.array_equal(x, results[1]))
+
+    def test_sequencing_reducers(self):
+        from collections import Counter
+        X = np.random.rand(120, 3)
+        y = np.random.randint(0, 5, size=(120,))
+        callables = {'last': lambda x: x[-1], 'first': lambda x: x[0],
+                     'majority': lambda x: sorted(Counter(x).items(),
+                                                  key=lambda i: (-i[1], i[0]))[0][0]}
+        for end in ('cut', 'wrap'):
+            for name, func in callables.items():
+                vectorized = F.recipes.Sequencing(frame_length=8, hop_length=3,
+                    end=end, transcription_transform=name).process('name', [X], y)
+                fallback = F.recipes.Sequencing(frame_length=8, hop_length=3,
+                    end=end, transcription_transform=func).process('name', [X], y)
+                self.assertTrue(np.array_equal(vectorized[2], fallback[2]))
+                self.assertEqual(vectorized[2].dtype, y.dtype)
+        # padded labels are ignored
+        x = F.recipes.Sequencing(frame_length=8, hop_length=8, end='pad',
+            transcription_transform='mean').process('name', [X[:12]], np.arange(12))
+        self.assertEqual(x[2].tolist(), [1.5, 7.5])
+
+    def test_vad_index(self):
+        X = np.arange(20)[:, None]
+        y = np.arange(20)
+        vad = {'name': [(1, 3), (6, 13), (15, 17)]}
+        for padding, Y in (
+            (None, [[0, 1, 2], [4, 5, 6], [7, 8, 9], [10, 11, 12], [14, 15, 16]]),
+            (-1, [[-1, 1, 2], [-1, -1, 6], [7, 8, 9], [10, 11, 12], [-1, 15, 16]])):
+            recipe = F.recipes.VADindex(vad, frame_length=3, padding=padding)
+            for epoch in range(2): # the second epoch use the cached plan
+                name, (x,), labels = recipe.process('name', [X], y)
+                self.assertEqual(x[:, :, 0].tolist(), Y)
+                self.assertEqual(labels.tolist(), [i[-1] for i in Y])
+        # a plan bigger than plan_cache_bytes is not cached
+        for plan_cache_bytes in (None, 8):
+            recipe = F.recipes.VADindex(vad, frame_length=1,
+                                        plan_cache_bytes=plan_cache_bytes)
+            for epoch in range(2):
+                self.assertEqual(recipe.process('name', [X], y)[-1].tolist(),
+                                 [1, 2, 6, 7, 8, 9, 10, 11, 12, 15, 16])
+            self.assertEqual(len(recipe._plans), 1 if plan_cache_bytes is None else 0)
+
+    def test_recipes_inplace_and_stats(self):
+        x = np.random.rand(20, 3).astype('float32')
+        mean, std = np.random.rand(3), np.random.rand(3) + 1
+        normalized = (x - mean.astype('float32')) / std.astype('float32')
+        # not in-place, the input is not modified
+        recipes = F.recipes.FeederList(F.recipes.Normalization(mean, std))
+        name, (y,) = recipes.process('name', [x])
+        self.assertFalse(np.shares_memory(x, y))
+        self.assertTrue(np.allclose(y, normalized))
+        # in-place on the owned buffers
+        recipes.set_inplace(True)
+        name, (y,) = recipes.process('name', [x])
+        self.assertTrue(y is x)
+        self.assertTrue(np.allclose(x, normalized))
+        # statistics of each recipe
+        X = np.arange(0, 3600).reshape(-1, 3)
+        indices = [("name" + str(i), j, j + 10) for i, j in enumerate(range(0, X.shape[0], 10))]
+        feeder = F.Feeder(X, indices, dtype='float32', ncpu=2, buffer_size=4)
+        feeder.set_recipes([F.recipes.FeatureScaling(), F.recipes.CreateBatch()],
+                           profile=True)
+        nb_batches = len(list(feeder.set_batch(8, seed=12, shuffle_level=2)))
+        stats = feeder.recipes_stats
+        self.assertEqual([i['recipe'] for i in stats], ['FeatureScaling', 'CreateBatch'])
+        self.assertEqual(stats[0]['nb_process'], len(indices))
+        self.assertEqual(stats[0]['nb_batches'], nb_batches)
+        self.assertTrue(stats[0]['process_time'] > 0 and stats[1]['group_time'] > 0)
+        # FeatureScaling is in-place on the loaded float32 data
+        self.assertEqual(stats[0]['process_bytes'], 0)
+        self.assertEqual(stats[1]['process_bytes'], 0)
+        feeder.stop_all()
+
     def test_speech_processor(self):
         try:
             datapath = F.load_digit_wav()
@@ -236,6 +334,486 @@ class FuelTest(unittest.TestCase):
             X = np.sort(X).tolist()
             self.assertEqual(X, REF)
             self.assertEqual(n, ds['X'].shape[0])
+            # ====== shared memory transport ====== #
+            feeder.set_multiprocessing(shm_slot_size=12 * 5 * 8 * 4)
+            X = []
+            for i, j in feeder.set_batch(12, seed=1208251813, shuffle_level=2):
+                X += i.ravel().tolist()
+                for x, y in zip(i, j):
+                    self.assertTrue(transcription_test[str(x.tolist())] == y)
+            self.assertEqual(np.sort(X).tolist(), REF)
+            # reused buffers, the batches bigger than a slot go via the Queue
+            feeder.set_recipes([
+                F.recipes.TransLoader(ds['transcription.dict'], dtype='int32'),
+                F.recipes.CreateBatch(reuse_buffer=True)
+            ])
+            feeder.set_multiprocessing(shm_slot_size=128)
+            X = []
+            for i, j in feeder.set_batch(12, seed=1208251813, shuffle_level=2):
+                X += i.ravel().tolist()
+                for x, y in zip(i, j):
+                    self.assertTrue(transcription_test[str(x.tolist())] == y)
+            self.assertEqual(np.sort(X).tolist(), REF)
+            feeder.set_recipes([
+                F.recipes.TransLoader(ds['transcription.dict'], dtype='int32'),
+                F.recipes.CreateBatch()
+            ])
+            feeder.set_multiprocessing(shm_slot_size=12 * 5 * 8 * 4)
+            # ====== persistent processes ====== #
+            feeder.set_multiprocessing(persistent=True)
+            for epoch in range(3):
+                X = []
+                for i, j in feeder.set_batch(12, seed=1208251813, shuffle_level=2):
+                    X += i.ravel().tolist()
+                    for x, y in zip(i, j):
+                        self.assertTrue(transcription_test[str(x.tolist())] == y)
+                self.assertEqual(np.sort(X).tolist(), REF)
+            feeder.stop_all()
+            # ====== reproducible ordered mode ====== #
+            def get_batches(feeder, ncpu, persistent):
+                feeder.set_multiprocessing(ncpu=ncpu, persistent=persistent,
+                                           ordered=True)
+                return list(feeder.set_batch(12, seed=1208251813,
+                                             shuffle_level=2))
+            ref = get_batches(feeder, ncpu=1, persistent=False)
+            X = np.concatenate([i.ravel() for i, j in ref])
+            self.assertEqual(np.sort(X).tolist(), REF)
+            for ncpu, persistent in ((2, False), (3, False), (2, True)):
+                batches = get_batches(feeder, ncpu=ncpu, persistent=persistent)
+                self.assertEqual(len(batches), len(ref))
+                for (x1, y1), (x2, y2) in zip(batches, ref):
+                    self.assertTrue(np.array_equal(x1, x2))
+                    self.assertTrue(np.array_equal(y1, y2))
+            feeder.stop_all()
+            # ====== dynamic scheduling ====== #
+            feeder.set_multiprocessing(ncpu=2, ordered=False, dynamic=True,
+                                       longest_first=True)
+            for persistent in (False, True):
+                feeder.set_multiprocessing(persistent=persistent)
+                X = []
+                for i, j in feeder.set_batch(12, seed=1208251813, shuffle_level=2):
+                    X += i.ravel().tolist()
+                    for x, y in zip(i, j):
+                        self.assertTrue(transcription_test[str(x.tolist())] == y)
+                self.assertEqual(np.sort(X).tolist(), REF)
+                self.assertTrue(len(feeder.workers_time) in (1, 2))
+            feeder.stop_all()
+
+    def test_data_stats(self):
+        X = (np.random.rand(120, 4, 3) * 10 + 1e4).astype('float32')
+        X64 = X.astype('float64')
+        path = os.path.join(utils.get_tempdir(), 'stats')
+        data = F.MmapData(path, dtype='float32', shape=X.shape)
+        data[:] = X
+        # small blocks to force merging many partial moments
+        for axis in (0, (0, 1), None, 1):
+            s = data.stats(axis, block_size=4 * 3 * 8 * 7)
+            for name, func in [('sum', np.sum), ('mean', np.mean),
+                               ('var', np.var), ('min', np.min),
+                               ('max', np.max)]:
+                self.assertTrue(np.allclose(s[name], func(X64, axis=axis)))
+            self.assertTrue(np.allclose(s['sum2'], np.sum(X64**2, axis=axis)))
+        # cached until the data is modified
+        self.assertTrue(data.mean(0) is data.mean(0))
+        data.normalize(0)
+        self.assertTrue(np.allclose(data.mean(0), 0., atol=1e-3))
+        self.assertTrue(np.allclose(data.std(0), 1., atol=1e-3))
+        data.close()
+
+    def test_data_lazy_operators(self):
+        X = (np.random.rand(200, 4) * 10).astype('float32')
+        tmp = utils.get_tempdir()
+        data = F.MmapData(os.path.join(tmp, 'X'), dtype='float32', shape=X.shape)
+        data[:] = X
+        data.set_block_size(4 * 8 * 16) # 16 rows per block
+        # binary operators are evaluated per batch
+        expr = (data - X.mean(0)) / X.std(0)
+        self.assertTrue(isinstance(expr, F.DataMerge))
+        Z = (X - X.mean(0)) / X.std(0)
+        self.assertTrue(np.allclose(expr[12:80], Z[12:80], atol=1e-5))
+        self.assertTrue(np.allclose(
+            np.concatenate(list(expr.set_batch(32, seed=None))), Z, atol=1e-5))
+        self.assertTrue(np.allclose(expr.gather([5, 199, 0]), Z[[5, 199, 0]],
+                                    atol=1e-5))
+        # sample-level shuffling
+        batches = list(expr.set_batch(32, seed=3, shuffle_level=3))
+        self.assertEqual([len(b) for b in batches], [32] * 6 + [8])
+        self.assertTrue(np.allclose(np.sort(np.concatenate(batches)[:, 0]),
+                                    np.sort(Z[:, 0]), atol=1e-5))
+        self.assertTrue(np.allclose((data * X)[:], X * X))
+        out = expr.to_mmap(os.path.join(tmp, 'Z'))
+        self.assertTrue(np.allclose(out[:], Z, atol=1e-5))
+        # in-place operators and normalize are chunked
+        data += 1.
+        data *= 2.
+        self.assertTrue(np.allclose(data[:], (X + 1.) * 2.))
+        data.normalize(0)
+        self.assertTrue(np.allclose(data[:], Z, atol=1e-4))
+        data.close()
+        out.close()
+
+    def test_data_transform_chain(self):
+        X = np.random.rand(120, 20).astype('float32')
+        tmp = utils.get_tempdir()
+        data = F.MmapData(os.path.join(tmp, 'X'), dtype='float32', shape=X.shape)
+        data[:] = X
+        # slice -> deltas -> cast, shape and dtype are inferred symbolically
+        data.transform(lambda x: x[:, :13], shape=lambda s: s[:-1] + (13,))
+        data.transform(lambda x: np.diff(x, axis=-1))
+        data.transform(lambda x: x.astype('float64'), dtype='float64')
+        Z = np.diff(X[:, :13], axis=-1).astype('float64')
+        self.assertEqual(data.shape, Z.shape)
+        self.assertEqual(data.dtype, Z.dtype)
+        self.assertTrue(np.allclose(data[5:18], Z[5:18]))
+        self.assertTrue(np.allclose(
+            np.concatenate(list(data.set_batch(16, seed=None))), Z))
+        # sidecar cache, dropped when the data changes
+        data.cache_transform(os.path.join(tmp, 'X.cache'))
+        self.assertTrue(np.allclose(data[:], Z))
+        data[:1] = 0.
+        self.assertTrue(np.allclose(data[:1], 0.))
+        self.assertTrue(np.allclose(data[1:], Z[1:]))
+        data.transform(None)
+        self.assertEqual(data.shape, X.shape)
+        data.close()
+
+    def test_data_gather(self):
+        X = np.arange(600).reshape(200, 3).astype('float32')
+        tmp = utils.get_tempdir()
+        mmap = F.MmapData(os.path.join(tmp, 'X'), dtype='float32', shape=X.shape)
+        mmap[:] = X
+        hdf5 = F.Hdf5Data('X', hdf=os.path.join(tmp, 'X.h5'),
+                          dtype='float32', shape=X.shape)
+        hdf5[:] = X
+        for data in (mmap, hdf5):
+            for max_gap in (0, 4):
+                idx = [12, 3, 4, 5, 120, 3, -1, 0]
+                self.assertTrue(np.all(data.gather(idx, max_gap) == X[idx]))
+                idx = np.random.permutation(200)[:64]
+                self.assertTrue(np.all(data.gather(idx, max_gap) == X[idx]))
+            # sample-level shuffling
+            batches = list(data.set_batch(32, seed=12, shuffle_level=3))
+            self.assertEqual([len(b) for b in batches], [32] * 6 + [8])
+            Y = np.concatenate(batches)
+            self.assertEqual(sorted(Y[:, 0].tolist()), X[:, 0].tolist())
+            self.assertFalse(np.all(Y == X))
+        it = F.DataIterator([mmap, hdf5])
+        idx = [0, 399, 200, 5, 250]
+        self.assertTrue(np.all(it.gather(idx) == np.vstack([X, X])[idx]))
+        mmap.close()
+
+    def test_data_prefetch(self):
+        X = np.random.rand(1000, 20).astype('float32')
+        mmap = F.MmapData(os.path.join(utils.get_tempdir(), 'X'),
+                          dtype='float32', shape=X.shape)
+        mmap[:] = X
+        mmap.flush()
+        for release in (False, True):
+            mmap.set_prefetch(3, release=release)
+            Y = np.concatenate(list(mmap.set_batch(64, seed=None)))
+            self.assertTrue(np.all(Y == X))
+            Y = np.concatenate(list(mmap.set_batch(64, seed=8, shuffle_level=3)))
+            self.assertEqual(sorted(Y[:, 0].tolist()), sorted(X[:, 0].tolist()))
+        # stop the iteration early
+        for i, x in enumerate(mmap.set_batch(64, seed=None)):
+            if i == 2:
+                break
+        self.assertTrue(np.all(x == X[128:192]))
+        mmap.set_prefetch(0)
+        mmap.close()
+
+    def test_mmap_append_growth(self):
+        path = os.path.join(utils.get_tempdir(), 'X')
+        if os.path.exists(path):
+            os.remove(path)
+        mmap = F.MmapData(path, dtype='float32', shape=(None, 3))
+        X = np.random.rand(2000, 3).astype('float32')
+        nb_remap = 0
+        buf = mmap._buffer
+        for i in range(0, 2000, 10):
+            mmap.append(X[i:i + 10])
+            if mmap._buffer is not buf:
+                nb_remap += 1
+                buf = mmap._buffer
+        self.assertLess(nb_remap, 20)
+        self.assertEqual(mmap.shape, X.shape)
+        self.assertGreaterEqual(mmap.capacity, X.shape[0])
+        self.assertTrue(np.all(mmap[:] == X))
+        # truncated to the actual size
+        mmap.flush()
+        self.assertEqual(mmap.capacity, X.shape[0])
+        self.assertEqual(F.MmapData.read_header(path), ('float32', X.shape))
+        mmap.append(X[:8])
+        mmap.close()
+        mmap = F.MmapData(path)
+        self.assertEqual(mmap.shape, (2008, 3))
+        self.assertTrue(np.all(mmap[:] == np.concatenate([X, X[:8]])))
+        mmap.close()
+
+    def test_data_parallel_stats(self):
+        X = np.random.rand(333, 5).astype('float32')
+        Y = np.random.rand(120, 2, 3)
+        ds = F.Dataset(os.path.join(utils.get_tempdir(), 'parallel_stats'))
+        ds['X'] = X
+        ds[('Y', 'hdf5')] = Y
+        ds.flush()
+        for name, arr in (('X', X), ('Y', Y)):
+            data = ds[name].set_ncpu(2)
+            for axis in (0, None, 1):
+                self.assertTrue(np.allclose(data.stats(axis, block_size=96)['var'],
+                                            arr.astype('float64').var(axis)))
+                self.assertTrue(np.all(data.argmin(axis) == arr.argmin(axis)))
+                self.assertTrue(np.all(data.argmax(axis) == arr.argmax(axis)))
+        stats = ds.stats(axis=0, ncpu=2, block_size=96)
+        self.assertEqual(list(stats.keys()), ['X', 'Y'])
+        self.assertTrue(np.allclose(stats['X']['mean'], X.mean(0)))
+        self.assertTrue(np.allclose(stats['Y']['max'], Y.max(0)))
+        ds.close()
+
+    def test_chunked_data(self):
+        X = np.round(np.random.rand(1003, 4, 3) * 8).astype('float32')
+        path = os.path.join(utils.get_tempdir(), 'chunked')
+        ds = F.Dataset(path, override=True)
+        ds[('X', 'chunked')] = X[:10]
+        data = ds['X']
+        self.assertTrue(isinstance(data, F.ChunkedData))
+        data.append(X[10:500], X[500:])
+        self.assertEqual(data.shape, X.shape)
+        self.assertGreater(data.compression_ratio, 1.)
+        self.assertTrue(np.all(data[:] == X))
+        self.assertTrue(np.all(data[123:789] == X[123:789]))
+        self.assertTrue(np.all(data[-1] == X[-1]))
+        self.assertTrue(np.all(data[::-7] == X[::-7]))
+        self.assertTrue(np.all(data.gather([8, 1000, 3, 8]) == X[[8, 1000, 3, 8]]))
+        self.assertTrue(np.all(np.concatenate(list(data.set_batch(64, seed=None))) == X))
+        self.assertTrue(np.allclose(data.stats(axis=0)['var'],
+                                    X.astype('float64').var(0)))
+        self.assertTrue(np.all(data.argmax(None) == X.argmax()))
+        self.assertTrue(np.all((data * 2. - 1.)[:] == X * 2. - 1.))
+        ds.close()
+        # reload from the disk
+        ds = F.Dataset(path, read_only=True)
+        self.assertEqual(ds['X'].shape, X.shape)
+        self.assertTrue(np.all(ds['X'][:] == X))
+        self.assertTrue(np.allclose(ds.stats(ncpu=2)['X']['mean'], X.mean(0)))
+        ds.close()
+
+    def test_chunked_data_fork(self):
+        from multiprocessing import Process, Queue
+        X = np.arange(20000 * 3, dtype='float32').reshape(-1, 3)
+        path = os.path.join(utils.get_tempdir(), 'chunked_fork')
+        if os.path.exists(path):
+            os.remove(path)
+        data = F.ChunkedData(path, dtype=X.dtype, shape=(None, 3), chunk_rows=64,
+                             cache_size=1)
+        data.append(X)
+        data.flush()
+        # forked readers must not share the file position
+        q = Queue()
+
+        def reader(seed):
+            rand = np.random.RandomState(seed)
+            bad = 0
+            for i in rand.randint(0, X.shape[0] - 50, size=2000):
+                bad += not np.all(data[i:i + 50] == X[i:i + 50])
+            q.put(bad)
+        processes = [Process(target=reader, args=(i,)) for i in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        self.assertEqual([q.get() for i in range(4)], [0] * 4)
+        data.close()
+
+    def test_quantized_data(self):
+        X = (np.random.randn(500, 4, 3) * 5 + 20).astype('float32')
+        # scale and offset are fitted on the first array, the int8 range
+        # is extended (not clipped) by the values appended later
+        X[-1] = X[:300].max(0) + 3.
+        X[-2] = X[:300].min(0) - 3.
+        path = os.path.join(utils.get_tempdir(), 'quantized')
+        ds = F.Dataset(path, override=True)
+        for dtype, atol in (('float16', 0.05), ('int8', 0.25)):
+            ds[('X_' + dtype, dtype)] = X[:300]
+            data = ds['X_' + dtype]
+            self.assertTrue(isinstance(data, F.QuantizedData))
+            data.append(X[300:])
+            self.assertEqual(data.data.dtype, np.dtype(dtype))
+            self.assertEqual(data.dtype, np.dtype('float32'))
+            self.assertEqual(data.shape, X.shape)
+            self.assertTrue(np.allclose(data[:], X, atol=atol))
+            self.assertTrue(np.allclose(data[-2:], X[-2:], atol=atol))
+            self.assertTrue(np.allclose(np.concatenate(list(data.set_batch(64, seed=None))),
+                                        X, atol=atol))
+            self.assertTrue(np.allclose(data.mean(0), X.mean(0), atol=atol))
+            # column-wise affine updates only change scale and offset
+            data.normalize(0)
+            self.assertTrue(np.allclose(data[:].mean(0), 0., atol=1e-3))
+            self.assertTrue(np.allclose(data[:].std(0), 1., atol=1e-3))
+        ds.close()
+        ds = F.Dataset(path, read_only=True)
+        self.assertTrue(isinstance(ds['X_int8'], F.QuantizedData))
+        self.assertTrue(np.allclose(ds['X_float16'][:].std(0), 1., atol=1e-3))
+        ds.close()
+
+    def test_mmapdict(self):
+        path = os.path.join(utils.get_tempdir(), 'dict')
+        d = F.MmapDict(path)
+        ref = OrderedDict()
+        for i in range(6000): # more than 1 flush and rehash
+            ref['utt%d' % i] = [i, 'utt%d' % i, i / 3.]
+            d['utt%d' % i] = ref['utt%d' % i]
+        self.assertEqual(len(d), 6000)
+        self.assertEqual(d['utt5999'], ref['utt5999'])
+        d.close()
+        # reopen, lookup, delete
+        d = F.MmapDict(path)
+        self.assertEqual(d.items(), ref.items())
+        self.assertTrue('utt12' in d)
+        self.assertFalse('utt6000' in d)
+        del d['utt12']; del ref['utt12']
+        d['new'] = ref['new'] = 'value'
+        d.close()
+        d = F.MmapDict(path, read_only=True)
+        self.assertEqual(d.keys(), list(ref.keys()))
+        self.assertEqual(sorted(d.keys(shuffle=True)), sorted(ref.keys()))
+        self.assertEqual(d['new'], 'value')
+        d.close()
+        # equal keys are the same key
+        d = F.MmapDict(os.path.join(utils.get_tempdir(), 'dict_keys'))
+        d['x'] = 1
+        d[1] = 'one'
+        self.assertTrue(u'x' in d)
+        self.assertEqual(d[1.], 'one')
+        self.assertEqual(d[True], 'one')
+        self.assertRaises(Exception, d.__setitem__, np.int64(1), 'int64')
+        d.flush()
+        self.assertTrue(u'x' in d)
+        self.assertEqual(d[True], 'one')
+        self.assertEqual(sorted(d.keys(), key=str), [1, 'x'])
+        d.close()
+
+    def test_mmapdict_batch_and_fork(self):
+        from multiprocessing import Process, Queue
+        d = F.MmapDict(os.path.join(utils.get_tempdir(), 'dict'))
+        d.put_many([('k%d' % i, [i, str(i)]) for i in range(3000)])
+        d.put_many({'a': 1.})
+        self.assertEqual(len(d), 3001)
+        self.assertEqual(d.get_many(['k8', 'none', 'a', 'k2999'], default=-1),
+                         [[8, '8'], -1, 1., [2999, '2999']])
+        self.assertEqual(d.get('none', 'default'), 'default')
+        d.flush()
+        # forked readers share the dictionary
+        q = Queue()
+
+        def reader():
+            q.put((d.get_many(['k1', 'a']), d.read_only))
+        processes = [Process(target=reader) for i in range(2)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        for i in range(2):
+            self.assertEqual(q.get(), ([[1, '1'], 1.], True))
+        self.assertFalse(d.read_only)
+        # a reader sees the items flushed later by the writer
+        r = F.MmapDict(d.path, read_only=True)
+        d.put_many([('n%d' % i, i) for i in range(5000)])
+        d.flush()
+        self.assertEqual(r.get('n4999'), 4999)
+        self.assertEqual(len(r), 8001)
+        r.close()
+        d.close()
+
+    def test_mmapdict_ndarray(self):
+        path = os.path.join(utils.get_tempdir(), 'dict')
+        d = F.MmapDict(path)
+        x = np.random.rand(12, 8).astype('float32')
+        d['x'] = x
+        d['seg'] = np.array([[0, 10], [25, 40]], dtype='int32')
+        d['empty'] = np.empty((0, 2), dtype='int16')
+        d['list'] = [1, 2]
+        d.flush()
+        y = d['x']
+        self.assertTrue(np.all(x == y))
+        self.assertEqual(y.dtype, np.float32)
+        self.assertFalse(y.flags.owndata or y.flags.writeable)
+        self.assertEqual(d['empty'].shape, (0, 2))
+        self.assertEqual(d['list'], [1, 2])
+        # the view is still valid after the file is remapped and closed
+        d.put_many([(str(i), np.arange(i)) for i in range(3000)])
+        d.close()
+        self.assertTrue(np.all(x == y))
+        d = F.MmapDict(path, read_only=True)
+        self.assertEqual(d.get_many(['seg', '7'])[0].tolist(), [[0, 10], [25, 40]])
+        self.assertEqual(dict(d.items())['2999'].sum(), np.arange(2999).sum())
+        loader = F.recipes.TransLoader(d, dtype='int32')
+        self.assertEqual(loader.process('5', None)[-1].tolist(), [0, 1, 2, 3, 4])
+        d.close()
+
+    def test_dataset_manifest(self):
+        path = os.path.join(utils.get_tempdir(), 'manifest')
+        X = np.random.rand(120, 8).astype('float32')
+        ds = F.Dataset(path, override=True)
+        ds['X'] = X
+        ds[('C', 'chunked')] = X
+        ds[('H', 'hdf5')] = X
+        ds['dict'] = {'a': 1}
+        ds['obj'] = ['a', 'b', 'c']
+        ds['X'].append(X[:20])
+        ds.flush()
+        ds.close()
+        # reopen: nothing is parsed or loaded
+        ds = F.Dataset(path)
+        self.assertEqual(sorted(ds.keys()), ['C', 'H', 'X', 'dict', 'obj'])
+        self.assertTrue(all(d is None for _, _, d, _ in ds.values()))
+        self.assertEqual(ds._data_map['X'][:2], (np.dtype('float32'), (140, 8)))
+        self.assertEqual(ds._data_map['obj'][:2], ('list', 3))
+        # loaded when accessed
+        self.assertTrue(np.all(ds['X'][:] == np.concatenate([X, X[:20]])))
+        self.assertTrue(np.all(ds['C'][:] == X))
+        self.assertTrue(np.all(ds['H'][:] == X))
+        self.assertEqual(ds['dict']['a'], 1)
+        self.assertEqual(ds['obj'], ['a', 'b', 'c'])
+        ds.close()
+        # modified file is parsed again
+        with open(os.path.join(path, 'obj'), 'wb') as f:
+            cPickle.dump(['a'], f)
+        ds = F.Dataset(path)
+        self.assertEqual(ds._data_map['obj'][1:3], (1, ['a']))
+        self.assertTrue(ds._data_map['X'][2] is None)
+        ds.close()
+
+    def test_mmap_pool(self):
+        from odin.fuel import data as D
+        max_open = D.MAX_OPEN_MMAP
+        D.MAX_OPEN_MMAP = 3
+        try:
+            root = utils.get_tempdir()
+            X = [np.random.rand(12, 4).astype('float32') for i in range(12)]
+            data = []
+            for i, x in enumerate(X):
+                d = F.MmapData(os.path.join(root, 'x%d' % i), dtype='float32',
+                               shape=(None, 4))
+                d.append(x[:6])
+                data.append(d)
+            self.assertEqual(F.MmapData.COUNT, 3)
+            # unmapped data are mapped again when accessed
+            for d, x in zip(data, X):
+                d.append(x[6:])
+                self.assertTrue(np.all(d[:] == x))
+                self.assertEqual(d.shape, (12, 4))
+            self.assertEqual(F.MmapData.COUNT, 3)
+            for d in data:
+                d.close()
+            self.assertEqual(F.MmapData.COUNT, 0)
+            data = [F.MmapData(os.path.join(root, 'x%d' % i), read_only=True)
+                    for i in range(12)]
+            self.assertTrue(all(np.all(d[:] == x) for d, x in zip(data, X)))
+            for d in data:
+                d.close()
+        finally:
+            D.MAX_OPEN_MMAP = max_open
 
     def test_dataset(self):
         pass
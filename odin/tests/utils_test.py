@@ -7,7 +7,8 @@ import unittest
 
 import numpy as np
 
-from odin.utils.mpi import MPI
+from odin.utils.mpi import MPI, WorkerPool
+from odin.utils.decorators import cache
 from odin.utils import batching
 
 
@@ -30,5 +31,152 @@ class UtilsTest(unittest.TestCase):
             sorted(Y, key=lambda x: x[0])
         )))
 
+    def test_mpi_shared_memory(self):
+        X = [np.random.rand(i, 12).astype('float32') for i in range(1, 80)]
+
+        def map_func(batch):
+            for b in batch:
+                yield (b, b.sum(axis=-1).astype('float64'))
+        mpi = MPI(X, map_func=map_func, ncpu=4, buffer_size=3,
+                  maximum_queue_size=12, shm_slot_size=80 * 12 * 4 + 80 * 8 + 128,
+                  shm_nb_slots=3)
+        Y = sorted([i for i in mpi], key=lambda x: x[0].shape[0])
+        self.assertEqual(len(X), len(Y))
+        for x, (y1, y2) in zip(X, Y):
+            self.assertTrue(np.all(x == y1))
+            self.assertTrue(np.allclose(x.sum(axis=-1), y2))
+
+    def test_mpi_queue_bytes(self):
+        import time
+        # each batch is 8000 bytes, at most 2 batches in the Queue
+        X = list(range(48))
+
+        def map_func(batch):
+            for b in batch:
+                yield np.full((1000,), b, dtype='float64')
+        mpi = MPI(X, map_func=map_func, ncpu=3, buffer_size=4,
+                  maximum_queue_size=None, maximum_queue_bytes=16000)
+        Y = []
+        for i in mpi:
+            # slow consumer, the producers must block on the budget
+            time.sleep(0.01)
+            Y.append(int(i[0]))
+        self.assertEqual(X, sorted(Y))
+        self.assertEqual(mpi.queue_budget.peak_nbytes, 16000)
+        self.assertEqual(mpi.queue_budget.nbytes, 0)
+
+    def test_worker_pool(self):
+        def map_func(batch):
+            for b in batch:
+                yield b * state['scale']
+
+        def prepare_func(scale):
+            state['scale'] = scale
+        state = {'scale': 1}
+        pool = WorkerPool(map_func, prepare_func, ncpu=3, buffer_size=2,
+                          maximum_queue_size=4)
+        X = list(range(25))
+        for scale in (1, 2, 3):
+            Y = sorted(pool.run(X, context=scale))
+            self.assertEqual(Y, [i * scale for i in X])
+        # unfinished run is cancelled by the new run
+        it = pool.run(X, context=1)
+        next(it)
+        self.assertEqual(sorted(pool.run(X, context=5)), [i * 5 for i in X])
+        self.assertEqual(list(it), [])
+        # exception inside the processes is raised in the main process
+        self.assertRaises(Exception, list, pool.run(X, context=None))
+        self.assertEqual(sorted(pool.run(X, context=2)), [i * 2 for i in X])
+        pool.close()
+
+    def test_mpi_ordered(self):
+        import time
+
+        def map_func(batch):
+            # the later chunks finish first
+            time.sleep(0.002 * (30 - batch[0]) / 3)
+            for b in batch:
+                yield b
+        X = list(range(30))
+        mpi = MPI(X, map_func=map_func, ncpu=4, buffer_size=3,
+                  maximum_queue_size=4, shm_slot_size=None, ordered=True,
+                  reorder_window=2)
+        self.assertEqual(list(mpi), X)
+        mpi = MPI(X, map_func=map_func, ncpu=1, buffer_size=3, ordered=True)
+        self.assertEqual(list(mpi), X)
+        pool = WorkerPool(map_func, ncpu=3, buffer_size=2, ordered=True)
+        for i in range(2):
+            self.assertEqual(list(pool.run(X)), X)
+        pool.close()
+
+    def test_mpi_dynamic(self):
+        import time
+
+        def map_func(batch):
+            time.sleep(0.001 * sum(batch))
+            yield batch
+        # a few long jobs at the end of the list
+        X = [1] * 40 + [20] * 4
+        mpi = MPI(X, map_func=map_func, ncpu=3, buffer_size=2,
+                  dynamic=True, job_cost=lambda x: x)
+        Y = list(mpi)
+        self.assertEqual(sorted(sum(Y, [])), sorted(X))
+        workers_time = mpi.workers_time
+        self.assertEqual(len(workers_time), mpi.ncpu)
+        self.assertTrue(all(busy > 0 for busy, idle in workers_time))
+        # dynamic and ordered
+        mpi = MPI(X, map_func=map_func, ncpu=3, buffer_size=2,
+                  dynamic=True, ordered=True)
+        self.assertEqual(sum(list(mpi), []), X)
+        self.assertRaises(ValueError, MPI, X, map_func, ordered=True,
+                          dynamic=True, job_cost=lambda x: x)
+        pool = WorkerPool(map_func, ncpu=3, buffer_size=2, dynamic=True,
+                          job_cost=lambda x: x)
+        for i in range(2):
+            self.assertEqual(sorted(sum(list(pool.run(X)), [])), sorted(X))
+        self.assertEqual(len(pool.workers_time), pool.ncpu)
+        pool.close()
+
+    def test_cache(self):
+        class Container(object):
+
+            def __init__(self):
+                self.status = 0
+
+            @cache('status')
+            def zeros(self, n, dtype='float32'):
+                return np.zeros(n, dtype=dtype)
+
+        c1 = Container()
+        x = c1.zeros(12)
+        self.assertTrue(c1.zeros(12) is x)
+        self.assertTrue(c1.zeros(n=12, dtype='float32') is x)
+        self.assertTrue(c1.zeros(12, 'float64') is not x)
+        # changing tracked attribute drops the cached values
+        c1.status += 1
+        self.assertTrue(c1.zeros(12) is not x)
+        # per-instance scope released with the instance
+        c2 = Container()
+        c2.zeros(8)
+        self.assertEqual(Container.zeros.cache_info()['size'], 2)
+        del c2
+        self.assertEqual(Container.zeros.cache_info()['size'], 1)
+
+        # bounded by number of entries and bytes
+        @cache(maxsize=2, maxbytes=1024)
+        def ones(n):
+            return np.ones(n, dtype='float64')
+        for i in (8, 16, 32, 8, 256):
+            ones(i)
+        info = ones.cache_info()
+        self.assertEqual((info['hits'], info['misses']), (0, 5))
+        self.assertEqual(info['size'], 2)
+        self.assertTrue(info['nbytes'] <= 1024)
+        ones(8)
+        self.assertEqual(ones.cache_info()['hits'], 1)
+        ones.cache_clear()
+        self.assertEqual(ones.cache_info()['size'], 0)
+
+
 if __name__ == '__main__':
     print(' odin.tests.run() to run these tests ')
@@ -197,7 +197,7 @@ class Task(object):
                 self._rng.randint = lambda x: None
                 self._rng.rand = RNG_GENERATOR.rand
         if shuffle_level is not None:
-            self._shuffle_level = min(max(int(shuffle_level), 0), 2)
+            self._shuffle_level = min(max(int(shuffle_level), 0), 3)
         return self
 
     def stop_all(self):
@@ -318,7 +318,9 @@ class MainLoop(object):
     shuffle_level: int
         0: only shuffle the order of each batch
         1: shuffle the order of batches and inside each batch as well.
-        2: includes level 0 and 1, and custom shuffling (strongest form)
+        2: includes level 0 and 1, and custom shuffling
+        3: sample-level shuffling, each batch contains random rows of
+        the whole data (see `Data.set_batch`), strongest form.
 
     """
 
@@ -410,7 +412,9 @@ class MainLoop(object):
         shuffle_level: int
             0: only shuffle the order of each batch
             1: shuffle the order of batches and inside each batch as well.
-            2: includes level 0 and 1, and custom shuffling (strongest form)
+            2: includes level 0 and 1, and custom shuffling
+        3: sample-level shuffling, each batch contains random rows of
+        the whole data (see `Data.set_batch`), strongest form.
         """
         if batch_size is not None:
             self._batch_size = batch_size
@@ -421,7 +425,7 @@ class MainLoop(object):
                 self._rng = struct()
                 self._rng.randint = lambda *args, **kwargs: None
         if shuffle_level is not None:
-            shuffle_level = min(max(int(shuffle_level), 0), 2)
+            shuffle_level = min(max(int(shuffle_level), 0), 3)
             self._shuffle_level = shuffle_level
         # ====== set_batch for Tasks ====== #
         if self._task is not None:
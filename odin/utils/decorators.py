@@ -6,11 +6,13 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import sys
+import hashlib
 from six.moves import builtins
 
 from collections import OrderedDict, defaultdict
 from collections import MutableMapping
 from functools import wraps, partial
+from weakref import WeakKeyDictionary
 import inspect
 from six.moves import zip, zip_longest, cPickle
 import types
@@ -35,10 +37,85 @@ __all__ = [
 # ===========================================================================
 # Cache
 # ===========================================================================
-__CACHE = defaultdict(lambda: ([], [])) #KEY_ARGS, RET_VALUE
-
-
-def cache(func, *attrs):
+CACHE_MAXSIZE = 128 # maximum number of cached values in each scope
+CACHE_MAXBYTES = 512 * 1024 * 1024 # maximum size in bytes of each scope
+
+
+def _hash_key(x):
+    ''' Convert `x` to a hashable key: containers are converted
+    recursively, ndarray are identified by the sha1 digest of their
+    content, other unhashable objects are identified by their id. '''
+    if isinstance(x, np.ndarray):
+        # contiguous array is digested without copy
+        data = x.tobytes() if x.dtype.hasobject else \
+            np.ascontiguousarray(x).reshape(-1).view(np.uint8)
+        return ('ndarray', x.dtype.str, x.shape, hashlib.sha1(data).digest())
+    if isinstance(x, (tuple, list)):
+        return (type(x).__name__,) + tuple(_hash_key(i) for i in x)
+    if isinstance(x, (dict, OrderedDict)):
+        return ('dict',) + tuple(sorted(
+            ((_hash_key(i), _hash_key(j)) for i, j in x.iteritems()),
+            key=lambda kv: repr(kv[0])))
+    try:
+        hash(x)
+        return x
+    except TypeError:
+        return ('id', type(x).__name__, id(x))
+
+
+def _nbytes(x):
+    ''' size in bytes of the arrays contained in a cached value '''
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    if isinstance(x, (tuple, list)):
+        return builtins.sum(_nbytes(i) for i in x)
+    if isinstance(x, dict):
+        return builtins.sum(_nbytes(i) for i in x.itervalues())
+    return 0
+
+
+class _LRUCache(object):
+    ''' LRU mapping bounded by the number of entries and the total bytes of
+    the cached arrays, the entries are dropped when the tracked attributes
+    (`state`) of the owner change. '''
+
+    def __init__(self, maxsize, maxbytes):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.state = None
+        self.nbytes = 0
+        self._items = OrderedDict() # key -> (value, nbytes)
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    def get(self, key, state):
+        if state != self.state:
+            self.clear()
+            self.state = state
+            raise KeyError(key)
+        # move to the most recently used position
+        item = self._items.pop(key)
+        self._items[key] = item
+        return item[0]
+
+    def put(self, key, value):
+        nbytes = _nbytes(value)
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            return
+        self._items[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while len(self._items) > 0 and \
+        ((self.maxsize is not None and len(self._items) > self.maxsize) or
+         (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            self.nbytes -= self._items.popitem(last=False)[1][1]
+
+
+def cache(func=None, *attrs, **kwargs):
     '''Decorator. Caches a function's return value each time it is called.
     If called later with the same arguments, the cached value is returned
     (not reevaluated).
@@ -46,7 +123,23 @@ def cache(func, *attrs):
     Parameters
     ----------
     args : str or list(str)
-        list of object attributes in comparation for selecting cache value
+        list of object attributes in comparation for selecting cache value,
+        all cached values of an object are dropped if any of these
+        attributes changes.
+    maxsize : int, None
+        maximum number of cached values (of each object for a method),
+        the least recently used values are evicted first, None for no limit.
+    maxbytes : int, None
+        maximum total size in bytes of the cached ndarray (of each object for
+        a method), None for no limit.
+
+    Note
+    ----
+    The arguments are hashed (ndarray by their content, other unhashable
+    objects by their id). For methods, the cache is stored per instance
+    using a weak reference, hence, it is released together with the
+    instance. The wrapped function has `cache_info()` which returns the
+    hits, misses, current size and bytes, and `cache_clear()`.
 
     Example
     -------
@@ -64,7 +157,12 @@ def cache(func, *attrs):
     >>> c.arg = 'test'
     >>> x = c.abcd((10000, 10000)) # return new value
     '''
-    if not inspect.ismethod(func) and not inspect.isfunction(func):
+    maxsize = kwargs.pop('maxsize', CACHE_MAXSIZE)
+    maxbytes = kwargs.pop('maxbytes', CACHE_MAXBYTES)
+    if len(kwargs) > 0:
+        raise ValueError('Unknown arguments for cache: %s' % str(kwargs.keys()))
+    if func is not None and \
+    not inspect.ismethod(func) and not inspect.isfunction(func):
         attrs = (func,) + attrs
         func = None
 
@@ -74,45 +172,59 @@ def cache(func, *attrs):
                          ''.format(tuple(map(type, attrs))))
 
     def wrap_function(func):
-        # ====== fetch arguments order ====== #
-        _ = inspect.getargspec(func)
-        args_name = _.args
-        # reversed 2 time so everything in the right order
-        if _.defaults is not None:
-            args_defaults = OrderedDict(reversed([(i, j)
-                for i, j in zip(reversed(_.args), reversed(_.defaults))]))
-        else:
-            args_defaults = OrderedDict()
+        args_name = inspect.getargspec(func).args
+        is_method = len(args_name) > 0 and args_name[0] == 'self'
+        # per-instance caches for methods, one cache for functions
+        scopes = WeakKeyDictionary()
+        shared = _LRUCache(maxsize, maxbytes)
+        counter = {'hits': 0, 'misses': 0}
+
+        def get_scope(args):
+            if not is_method or len(args) == 0:
+                return shared, ()
+            try:
+                if args[0] not in scopes:
+                    scopes[args[0]] = _LRUCache(maxsize, maxbytes)
+                return scopes[args[0]], ()
+            except TypeError: # cannot create weakref to the instance
+                return shared, (id(args[0]),)
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            input_args = list(args)
-            excluded = {i: j for i, j in zip(args_name, input_args)}
-            # check default kwargs
-            for i, j in args_defaults.iteritems():
-                if i in excluded: # already input as positional argument
-                    continue
-                if i in kwargs: # specified value
-                    input_args.append(kwargs[i])
-                else: # default value
-                    input_args.append(j)
-            # ====== create cache_key ====== #
-            object_vars = {k: getattr(args[0], k) for k in attrs
-                           if hasattr(args[0], k)}
-            cache_key = (input_args, object_vars)
+            call_args = inspect.getcallargs(func, *args, **kwargs)
+            if is_method:
+                call_args.pop(args_name[0], None)
+            scope, prefix = get_scope(args)
+            state = tuple(getattr(args[0], k, None) for k in attrs) \
+                if len(args) > 0 and len(attrs) > 0 else ()
+            key = prefix + _hash_key(call_args)
             # ====== check cache ====== #
-            key_list = __CACHE[id(func)][0]
-            value_list = __CACHE[id(func)][1]
-            # get old cached value
-            if cache_key in key_list:
-                idx = key_list.index(cache_key)
-                return value_list[idx]
-            # call the function to get new value
-            else:
-                value = func(*args, **kwargs)
-                key_list.append(cache_key)
-                value_list.append(value)
+            try:
+                value = scope.get(key, state)
+                counter['hits'] += 1
                 return value
+            except KeyError:
+                pass
+            # ====== call the function to get new value ====== #
+            counter['misses'] += 1
+            value = func(*args, **kwargs)
+            scope.put(key, value)
+            return value
+
+        def cache_info():
+            caches = [shared] + list(scopes.values())
+            return {'hits': counter['hits'], 'misses': counter['misses'],
+                    'size': builtins.sum(len(c) for c in caches),
+                    'nbytes': builtins.sum(c.nbytes for c in caches),
+                    'maxsize': maxsize, 'maxbytes': maxbytes}
+
+        def cache_clear():
+            shared.clear()
+            scopes.clear()
+            counter['hits'] = 0
+            counter['misses'] = 0
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
         return wrapper
 
     # return wrapped function
@@ -1,12 +1,17 @@
 from __future__ import print_function, division, absolute_import
 
 import os
-import time
+import sys
 import types
 import inspect
+import timeit
+import traceback
+from collections import defaultdict, deque
 from abc import ABCMeta, abstractmethod
 from six import add_metaclass
-from multiprocessing import cpu_count, Process, Queue, Value, Lock, current_process
+from multiprocessing import (cpu_count, Process, Queue, Value, Lock,
+                             Condition, current_process)
+from multiprocessing.sharedctypes import RawArray, RawValue
 
 import numpy as np
 
@@ -63,7 +68,7 @@ class SharedCounter(object):
 
     def __init__(self, initial_value=0):
         self.val = Value('i', initial_value)
-        self.lock = Lock()
+        self.lock = self.val.get_lock()
 
     def add(self, value=1):
         with self.lock:
@@ -71,8 +76,447 @@ class SharedCounter(object):
 
     @property
     def value(self):
-        with self.lock:
-            return self.val.value
+        return self.val.value
+
+
+def _nbytes(x):
+    """ Estimated size in bytes of an object returned by `map_func` """
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    if isinstance(x, (tuple, list)):
+        return sum(_nbytes(i) for i in x)
+    return sys.getsizeof(x)
+
+
+def _copy_result(x):
+    """ Copy the ndarray (or tuple, list of ndarray) returned by `map_func` """
+    if isinstance(x, np.ndarray):
+        return np.array(x)
+    if isinstance(x, (tuple, list)):
+        return type(x)(_copy_result(i) for i in x)
+    return x
+
+
+class QueueBudget(object):
+    """ Bounded, blocking backpressure for the results Queue shared
+    between multiple producers and 1 consumer.
+
+    A producer calls `acquire(nbytes)` before putting a result into the
+    Queue and blocks (on a Condition, no polling) until the result fits
+    into the budget, the consumer calls `release(nbytes)` right after
+    getting the result, which wakes up the waiting producers.
+
+    Parameters
+    ----------
+    maximum_items: int, None
+        maximum number of results waiting in the Queue
+    maximum_bytes: int, None
+        maximum total size in bytes of the results waiting in the Queue
+
+    Note
+    ----
+    A result is always accepted if the Queue is empty, even if it is
+    bigger than `maximum_bytes`, otherwise, it will wait forever.
+    """
+
+    def __init__(self, maximum_items=None, maximum_bytes=None):
+        super(QueueBudget, self).__init__()
+        self.maximum_items = maximum_items
+        self.maximum_bytes = maximum_bytes
+        self._items = RawValue('l', 0)
+        self._bytes = RawValue('l', 0)
+        self._peak_bytes = RawValue('l', 0)
+        self._cond = Condition(Lock())
+
+    @property
+    def items(self):
+        return self._items.value
+
+    @property
+    def nbytes(self):
+        return self._bytes.value
+
+    @property
+    def peak_nbytes(self):
+        """ maximum total size in bytes of the results which were
+        waiting in the Queue at the same time """
+        return self._peak_bytes.value
+
+    def _is_available(self, nbytes):
+        if self._items.value == 0:
+            return True
+        if self.maximum_items is not None and \
+        self._items.value >= self.maximum_items:
+            return False
+        if self.maximum_bytes is not None and \
+        self._bytes.value + nbytes > self.maximum_bytes:
+            return False
+        return True
+
+    def acquire(self, nbytes):
+        with self._cond:
+            while not self._is_available(nbytes):
+                self._cond.wait()
+            self._items.value += 1
+            self._bytes.value += nbytes
+            self._peak_bytes.value = max(self._peak_bytes.value,
+                                         self._bytes.value)
+
+    def release(self, nbytes):
+        with self._cond:
+            self._items.value -= 1
+            self._bytes.value -= nbytes
+            self._cond.notify_all()
+
+
+class _SlotDescriptor(object):
+    """ Light-weight message sent through the Queue instead of the
+    actual arrays, the consumer re-creates the arrays from the slot
+    of `SharedArrayPool`.
+    """
+
+    def __init__(self, slot, container, arrays):
+        super(_SlotDescriptor, self).__init__()
+        self.slot = slot
+        self.container = container # 'array', 'tuple' or 'list'
+        self.arrays = arrays # list of (offset, dtype, shape)
+
+
+class _WorkerError(object):
+    """ Message sent through the Queue when `map_func` raised an
+    exception inside a process, carrying the formatted traceback """
+
+    def __init__(self, worker_id, trace):
+        super(_WorkerError, self).__init__()
+        self.worker_id = worker_id
+        self.trace = trace
+
+
+class SharedArrayPool(object):
+    """ A ring of pre-allocated shared-memory slots for transferring
+    numpy arrays between processes without pickling them.
+
+    The producer writes its arrays into a free slot and only sends
+    the slot descriptor (offset, dtype, shape) through the Queue, the
+    consumer creates views on the same memory and gives the slot
+    back to the pool after it finished with the data.
+
+    Parameters
+    ----------
+    nb_slots: int
+        number of slots in the ring, producers block when all slots
+        are in use (i.e. waiting for the consumer).
+    slot_size: int
+        size in bytes of each slot, results bigger than this are
+        transferred through the Queue as normal.
+
+    Note
+    ----
+    The pool must be created before forking the processes, so every
+    process shares the same memory.
+    """
+
+    ALIGNMENT = 64
+
+    def __init__(self, nb_slots, slot_size):
+        super(SharedArrayPool, self).__init__()
+        self.nb_slots = max(int(nb_slots), 1)
+        self.slot_size = int(np.ceil(int(slot_size) / SharedArrayPool.ALIGNMENT)
+                             * SharedArrayPool.ALIGNMENT)
+        self._buffer = RawArray('b', self.nb_slots * self.slot_size)
+        self._array = np.frombuffer(self._buffer, dtype=np.uint8)
+        self._free_slots = Queue(maxsize=0)
+        for i in range(self.nb_slots):
+            self._free_slots.put(i)
+
+    def _aligned(self, nbytes):
+        alignment = SharedArrayPool.ALIGNMENT
+        return (nbytes + alignment - 1) // alignment * alignment
+
+    def is_transferable(self, x):
+        """ Return True if `x` is an ndarray (or a tuple, list of ndarray)
+        which fit into one slot """
+        arrays = x if isinstance(x, (tuple, list)) else (x,)
+        if len(arrays) == 0:
+            return False
+        size = 0
+        for a in arrays:
+            if not isinstance(a, np.ndarray) or a.dtype.hasobject:
+                return False
+            size += self._aligned(a.nbytes)
+        return size <= self.slot_size
+
+    def write(self, x):
+        """ Copy `x` into a free slot (block until a slot available),
+        return the `_SlotDescriptor` for sending to the consumer. """
+        if isinstance(x, np.ndarray):
+            container, arrays = 'array', (x,)
+        else:
+            container, arrays = type(x).__name__, x
+        slot = self._free_slots.get()
+        offset = slot * self.slot_size
+        descriptor = []
+        for a in arrays:
+            self._array[offset:offset + a.nbytes].view(a.dtype)[:] = \
+                np.ascontiguousarray(a).ravel()
+            descriptor.append((offset, a.dtype.str, a.shape))
+            offset += self._aligned(a.nbytes)
+        return _SlotDescriptor(slot, container, descriptor)
+
+    def read(self, descriptor):
+        """ Return the arrays stored in given slot as views (no copy),
+        the data is only valid until the slot is released. """
+        arrays = []
+        for offset, dtype, shape in descriptor.arrays:
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            arrays.append(
+                self._array[offset:offset + nbytes].view(dtype).reshape(shape))
+        if descriptor.container == 'array':
+            return arrays[0]
+        elif descriptor.container == 'tuple':
+            return tuple(arrays)
+        return arrays
+
+    def shares_memory(self, x):
+        """ Check if `x` (or any element of `x`) is a view on this pool """
+        arrays = x if isinstance(x, (tuple, list)) else (x,)
+        return any(isinstance(a, np.ndarray) and
+                   np.may_share_memory(a, self._array)
+                   for a in arrays)
+
+    def release(self, descriptor):
+        self._free_slots.put(descriptor.slot)
+
+    def close(self):
+        self._free_slots.close()
+
+
+def _sequenced_chunks(jobs, buffer_size):
+    """ Split `jobs` into [(seq, jobs[i:i + buffer_size]), ...] """
+    return [(seq, jobs[i:i + buffer_size])
+            for seq, i in enumerate(range(0, len(jobs), buffer_size))]
+
+
+class ChunkWindow(object):
+    """ Bounded re-order window for the ordered mode, a producer must
+    wait before processing chunk `seq` until
+    `seq < next_chunk + window`, where `next_chunk` is the chunk the
+    consumer is waiting for.
+    """
+
+    def __init__(self, window):
+        super(ChunkWindow, self).__init__()
+        self.window = max(int(window), 1)
+        self._next = RawValue('l', 0)
+        self._cond = Condition(Lock())
+
+    @property
+    def next_chunk(self):
+        return self._next.value
+
+    def wait(self, seq, is_valid=None):
+        """ `is_valid`: callable, stop waiting if it returns False """
+        with self._cond:
+            while seq >= self._next.value + self.window and \
+            (is_valid is None or is_valid()):
+                self._cond.wait()
+
+    def advance(self):
+        with self._cond:
+            self._next.value += 1
+            self._cond.notify_all()
+
+    def reset(self):
+        with self._cond:
+            self._next.value = 0
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+
+def _detach_slot(descriptor, shm_pool):
+    """ Copy the arrays out of the shared-memory slot and release it """
+    r = shm_pool.read(descriptor)
+    r = (np.array(r) if isinstance(r, np.ndarray) else
+         type(r)([np.array(i) for i in r]))
+    shm_pool.release(descriptor)
+    return r
+
+
+class _OrderedResults(object):
+    """ Main process side of the ordered mode, store the results which
+    arrived too early, and return them by their chunk sequence number.
+    """
+
+    def __init__(self, nb_chunks, window):
+        super(_OrderedResults, self).__init__()
+        self.nb_chunks = nb_chunks
+        self.window = window
+        self.next_chunk = 0
+        self._results = defaultdict(deque)
+        self._ended = set()
+
+    @property
+    def finished(self):
+        return self.next_chunk >= self.nb_chunks
+
+    def add(self, seq, r, shm_pool=None):
+        """ `r` is None indicates the end of the chunk `seq` """
+        if r is None:
+            self._ended.add(seq)
+            return
+        # never hold the shared-memory slots of early results, otherwise,
+        # the process of the waited chunk cannot get a free slot
+        if seq != self.next_chunk and isinstance(r, _SlotDescriptor):
+            r = _detach_slot(r, shm_pool)
+        self._results[seq].append(r)
+
+    def pop(self):
+        """ Return (True, result) if the next result in order is
+        available, otherwise, (False, None) """
+        while not self.finished:
+            seq = self.next_chunk
+            results = self._results.get(seq, None)
+            if results:
+                return True, results.popleft()
+            if seq not in self._ended:
+                break
+            # the chunk finished, move to the next one
+            self._ended.remove(seq)
+            self._results.pop(seq, None)
+            self.next_chunk += 1
+            self.window.advance()
+        return False, None
+
+
+def _reduce_result(r, reduce_func, shm_pool):
+    """ Apply `reduce_func` on a result fetched from the Queue, and give
+    back the shared-memory slot if the result was transferred by it. """
+    if not isinstance(r, _SlotDescriptor):
+        return reduce_func(r)
+    descriptor = r
+    r = reduce_func(shm_pool.read(descriptor))
+    # the slot will be reused, never return a view on it
+    if shm_pool.shares_memory(r):
+        r = (np.array(r) if isinstance(r, np.ndarray) else
+             type(r)([np.array(i) for i in r]))
+    shm_pool.release(descriptor)
+    return r
+
+
+class SharedJobQueue(object):
+    """ Dynamic job distribution (i.e. work-stealing), all processes know
+    the same list of chunks, each call of `get` hands out the index of the
+    next unprocessed chunk, so a process that finishes early keeps pulling
+    work instead of waiting idle for the straggler.
+
+    Note
+    ----
+    `run_id` protects the queue against processes of a cancelled run
+    stealing the chunks of the new one.
+    """
+
+    def __init__(self):
+        super(SharedJobQueue, self).__init__()
+        self._lock = Lock()
+        self._next = RawValue('l', 0)
+        self._size = RawValue('l', 0)
+        self._run_id = RawValue('l', 0)
+
+    def reset(self, size, run_id=0):
+        with self._lock:
+            self._next.value = 0
+            self._size.value = size
+            self._run_id.value = run_id
+
+    def get(self, run_id=0):
+        """ Return index of the next chunk, or None if no chunk left """
+        with self._lock:
+            if self._run_id.value != run_id or \
+            self._next.value >= self._size.value:
+                return None
+            i = self._next.value
+            self._next.value += 1
+        return i
+
+    def pull(self, chunks, run_id=0):
+        """ Iterate over the chunks handed out to this process """
+        while True:
+            i = self.get(run_id)
+            if i is None:
+                break
+            yield chunks[i]
+
+
+def _longest_first(chunks, job_cost):
+    """ Sort the chunks by descending total cost (stable), the longest
+    chunks are processed first, so the tail of the epoch is filled with
+    short chunks (i.e. longest processing time first scheduling) """
+    costs = [sum(job_cost(j) for j in c) for _, c in chunks]
+    return [chunks[i] for i in sorted(range(len(chunks)),
+                                      key=lambda i: -costs[i])]
+
+
+class WorkersTime(object):
+    """ Per-process busy/idle time, each process only writes its own
+    fields, so no lock is required.
+
+    busy: time spent in `map_func` (i.e. producing the results)
+    idle: the rest of the wall time from the first process started until
+    the last process finished (i.e. waiting for jobs, for space in the
+    Queue, for the re-order window, and the tail at the end of an epoch)
+    """
+
+    def __init__(self, nb_workers):
+        super(WorkersTime, self).__init__()
+        self.nb_workers = int(nb_workers)
+        # [start, busy, end] of each process
+        self._time = RawArray('d', 3 * self.nb_workers)
+
+    def reset(self):
+        for i in range(3 * self.nb_workers):
+            self._time[i] = 0.
+
+    def start(self, worker_id):
+        self._time[3 * worker_id] = timeit.default_timer()
+        self._time[3 * worker_id + 1] = 0.
+        self._time[3 * worker_id + 2] = 0.
+
+    def add_busy(self, worker_id, duration):
+        self._time[3 * worker_id + 1] += duration
+
+    def stop(self, worker_id):
+        self._time[3 * worker_id + 2] = timeit.default_timer()
+
+    def summary(self):
+        """ Return list of (busy, idle) in seconds for each process """
+        time = [self._time[3 * i:3 * i + 3] for i in range(self.nb_workers)]
+        started = [t for t in time if t[0] > 0]
+        if len(started) == 0:
+            return [(0., 0.)] * self.nb_workers
+        now = timeit.default_timer()
+        wall = max(end if end > 0 else now for _, _, end in started) - \
+            min(start for start, _, _ in started)
+        return [(busy, max(wall - busy, 0.)) for _, busy, _ in time]
+
+
+def _timed_map(map_func, jobs, workers_time, worker_id):
+    """ Call `map_func` and iterate over its results, only the time
+    spent inside `map_func` is counted as busy time """
+    start = timeit.default_timer()
+    ret = map_func(jobs)
+    # if a generator is return, traverse through the
+    # iterator and return each result
+    if not isinstance(ret, types.GeneratorType):
+        ret = (ret,)
+    for r in ret:
+        workers_time.add_busy(worker_id, timeit.default_timer() - start)
+        yield r
+        start = timeit.default_timer()
+    workers_time.add_busy(worker_id, timeit.default_timer() - start)
 
 
 @add_metaclass(ABCMeta)
@@ -223,6 +667,39 @@ class MPI(SelfIterator):
         maximum number of batch will be cached in Queue before main process
         get it and feed to the GPU (if there are too many results in Queue, a
         deadlock will happen)
+    maximum_queue_bytes: int, None
+        maximum total size in bytes of the batches cached in Queue, the
+        producers block (without polling) until the main process consumes
+        enough data, None for no limit in bytes.
+    shm_slot_size: int, None
+        if not None, enable shared-memory transport, the size in bytes of
+        each slot in the `SharedArrayPool`. Returned ndarray (or tuple, list
+        of ndarray) are written directly into shared memory, and only the
+        slot descriptors are sent through the Queue.
+    shm_nb_slots: int, None
+        number of slots in the `SharedArrayPool`, by default, `2 * ncpu + 2`
+    ordered: bool
+        if True, the jobs are split into chunks of `buffer_size` which are
+        tagged with their sequence number and distributed round-robin to
+        the processes, the main process re-orders the results, so they are
+        returned in the same order as a single process.
+    reorder_window: int, None
+        (ordered mode) maximum number of chunks a process can run ahead of
+        the chunk the main process is waiting for, by default, `2 * ncpu`
+    dynamic: bool
+        if True, the processes pull chunks of `buffer_size` jobs from a shared
+        job queue (i.e. work-stealing) instead of a static split of the jobs,
+        hence, no process is left idle at the end while a straggler is
+        processing a long list of jobs.
+    job_cost: callable, None
+        (dynamic mode) estimated cost of a job (e.g. the length of an
+        utterance), if given, the chunks are processed longest-first. Not
+        supported in ordered mode.
+    copy_results: bool
+        if True, the returned ndarray which are not written into shared
+        memory are copied before being put into the Queue (the Queue pickles
+        them later in a background thread), necessary if `map_func` reuses
+        its output buffers.
 
 
     Notes
@@ -230,6 +707,11 @@ class MPI(SelfIterator):
     If map_func return None, it won't be queued to the results for reduct_func
     If map_func return a Generator, MPI will traverses through it and queues all
     returned values.
+    With shared-memory transport, `reduce_func` receives views on the shared
+    slot, and its results are only copied if they are still views on the
+    slot (i.e. the returned data are always safe to keep).
+    `workers_time` reports the busy/idle time of each process, which shows the
+    imbalance between the processes.
 
     Benchmark
     ---------
@@ -285,7 +767,10 @@ class MPI(SelfIterator):
     """
 
     def __init__(self, jobs, map_func, reduce_func=None,
-                 ncpu=1, buffer_size=1, maximum_queue_size=144):
+                 ncpu=1, buffer_size=1, maximum_queue_size=144,
+                 maximum_queue_bytes=None, shm_slot_size=None, shm_nb_slots=None,
+                 ordered=False, reorder_window=None, dynamic=False, job_cost=None,
+                 copy_results=False):
         super(MPI, self).__init__()
         self._jobs = jobs
         # ====== check map_func ====== #
@@ -304,57 +789,123 @@ class MPI(SelfIterator):
             ncpu = cpu_count() - 1
         self._ncpu = max(min(ncpu, 2 * cpu_count() - 1), 1)
         self._maximum_queue_size = maximum_queue_size
+        self._maximum_queue_bytes = maximum_queue_bytes
         self._buffer_size = buffer_size
+        # shared memory transport
+        self._shm_slot_size = shm_slot_size
+        self._shm_nb_slots = shm_nb_slots
+        self.__shm_pool = None
+        # ordered mode
+        self._ordered = bool(ordered)
+        self._reorder_window = reorder_window
+        self.__window = None
+        self.__ordered_results = None
+        if self._ordered:
+            self.__window = ChunkWindow(2 * self._ncpu if reorder_window is None
+                                        else reorder_window)
+        # dynamic scheduling
+        if job_cost is not None and not callable(job_cost):
+            raise ValueError('"job_cost" must be callable or None')
+        if job_cost is not None and self._ordered:
+            raise ValueError('Longest-first scheduling (i.e. "job_cost") is not '
+                             'supported in ordered mode.')
+        self._dynamic = bool(dynamic)
+        self._job_cost = job_cost
+        self._copy_results = bool(copy_results)
+        self.__job_queue = SharedJobQueue() if self._dynamic else None
+        self.__workers_time = WorkersTime(self._ncpu)
         # processes manager
         self.__processes_started = False
-        self.__shared_counter = SharedCounter()
+        self.__budget = QueueBudget(maximum_items=maximum_queue_size,
+                                    maximum_bytes=maximum_queue_bytes)
         self.__results = Queue(maxsize=0)
         self.__nb_working_processes = self._ncpu
 
     def _copy(self):
         return MPI(self._jobs, self._map_func, self._reduce_func,
-                   self._ncpu, self._buffer_size, self._maximum_queue_size)
+                   self._ncpu, self._buffer_size, self._maximum_queue_size,
+                   self._maximum_queue_bytes, self._shm_slot_size,
+                   self._shm_nb_slots, self._ordered, self._reorder_window,
+                   self._dynamic, self._job_cost, self._copy_results)
+
+    @property
+    def ncpu(self):
+        return self._ncpu
+
+    @property
+    def workers_time(self):
+        """ list of (busy, idle) time in seconds of each process """
+        return self.__workers_time.summary()
+
+    @property
+    def queue_budget(self):
+        """ `QueueBudget` of the results Queue """
+        return self.__budget
 
     def _init(self):
-        jobs = segment_list(self._jobs, n_seg=self._ncpu)
+        # ====== split the jobs into chunks of `buffer_size` ====== #
+        job_queue = self.__job_queue
+        if self._dynamic:
+            chunks = _sequenced_chunks(self._jobs, self._buffer_size)
+            if self._job_cost is not None:
+                chunks = _longest_first(chunks, self._job_cost)
+            job_queue.reset(len(chunks))
+            jobs = [chunks] * self._ncpu
+            if self._ordered:
+                self.__ordered_results = _OrderedResults(len(chunks),
+                                                         self.__window)
+        elif self._ordered:
+            chunks = _sequenced_chunks(self._jobs, self._buffer_size)
+            jobs = [chunks[i::self._ncpu] for i in range(self._ncpu)]
+            self.__ordered_results = _OrderedResults(len(chunks), self.__window)
+        else:
+            jobs = [[(None, j[i:i + self._buffer_size])
+                     for i in range(0, len(j), self._buffer_size)]
+                    for j in segment_list(self._jobs, n_seg=self._ncpu)]
+        # ====== shared memory must be allocated before forking ====== #
+        if self._shm_slot_size is not None:
+            nb_slots = self._shm_nb_slots
+            if nb_slots is None:
+                nb_slots = 2 * self._ncpu + 2
+            self.__shm_pool = SharedArrayPool(nb_slots, self._shm_slot_size)
+        shm_pool = self.__shm_pool
+        window = self.__window
+        workers_time = self.__workers_time
+        copy_results = self._copy_results
 
-        def wrapped_map(tasks, return_queue, counter, length):
-            maximum_queue_size = self._maximum_queue_size
-            minimum_queue_size = max(maximum_queue_size // self._ncpu, 1)
-            for i in range(0, len(tasks), self._buffer_size):
-                t = tasks[i:i + self._buffer_size]
+        def wrapped_map(worker_id, chunks, return_queue, budget, length):
+            workers_time.start(worker_id)
+            if job_queue is not None:
+                chunks = job_queue.pull(chunks)
+            for seq, t in chunks:
+                # ordered mode: do not run too far ahead of the consumer
+                if window is not None:
+                    window.wait(seq)
                 length.add(-len(t)) # monitor current length
-                ret = self._map_func(t)
-                # if a generator is return, traverse through the
-                # iterator and return each result
-                if not isinstance(ret, types.GeneratorType):
-                    ret = (ret,)
-                nb_returned = 0
+                ret = _timed_map(self._map_func, t, workers_time, worker_id)
                 for r in ret:
                     if r is not None:
-                        return_queue.put(r)
-                        nb_returned += 1
-                        # sometime 1 batch get too big, and we need to stop
-                        # putting too many data into the queue.
-                        if nb_returned >= minimum_queue_size:
-                            counter.add(nb_returned)
-                            nb_returned = 0
-                            while counter.value > maximum_queue_size:
-                                time.sleep(0.1)
+                        # block until the consumer frees enough space,
+                        # the same nbytes must be released by the consumer
+                        nbytes = _nbytes(r)
+                        budget.acquire(nbytes)
+                        if shm_pool is not None and shm_pool.is_transferable(r):
+                            r = shm_pool.write(r)
+                        elif copy_results:
+                            r = _copy_result(r)
+                        return_queue.put((seq, nbytes, r))
                 del ret # delete old data (this work, checked)
-                # increase shared counter (this number must perfectly
-                # counted, only 1 mismatch and deadlock will happen)
-                if nb_returned > 0:
-                    counter.add(nb_returned)
-                # check if we need to wait for the consumer here
-                while counter.value > maximum_queue_size:
-                    time.sleep(0.1)
+                # ending signal of the chunk
+                if window is not None:
+                    return_queue.put((seq, 0, None))
             # ending signal
+            workers_time.stop(worker_id)
             return_queue.put(None)
         # ====== multiprocessing variables ====== #
         self.__processes = [Process(target=wrapped_map,
-                                    args=(j, self.__results, self.__shared_counter, self._length))
+                                    args=(i, j, self.__results, self.__budget, self._length))
                            for i, j in enumerate(jobs)]
+        self.__nb_working_processes = len(self.__processes)
 
     def _finalize(self):
         self.__nb_working_processes = 0
@@ -366,27 +917,47 @@ class MPI(SelfIterator):
         else:
             [p.join() for p in self.__processes]
         self.__results.close()
+        if self.__shm_pool is not None:
+            self.__shm_pool.close()
+
+    def __fetch(self):
+        """ Return (seq, result) from the processes, or None if all the
+        processes finished """
+        while self.__nb_working_processes > 0:
+            r = self.__results.get()
+            if r is None:
+                self.__nb_working_processes -= 1
+                continue
+            seq, nbytes, r = r
+            # something returned, wake up the producers
+            if r is not None:
+                self.__budget.release(nbytes)
+            return seq, r
+        return None
 
     def _next(self):
         # if the processes haven't started, start them only once
         if not self.__processes_started:
             [p.start() for p in self.__processes]
             self.__processes_started = True
-        # ====== end of iteration ====== #
-        if self.__nb_working_processes <= 0:
-            raise StopIteration
+        # ====== ordered mode ====== #
+        if self._ordered:
+            ordered = self.__ordered_results
+            while True:
+                found, r = ordered.pop()
+                if found:
+                    return _reduce_result(r, self._reduce_func, self.__shm_pool)
+                if ordered.finished:
+                    raise StopIteration
+                r = self.__fetch()
+                if r is None: # no more tasks to do
+                    raise StopIteration
+                ordered.add(r[0], r[1], self.__shm_pool)
         # ====== fetch the results ====== #
-        r = self.__results.get()
-        while r is None:
-            self.__nb_working_processes -= 1
-            if self.__nb_working_processes <= 0:
-                break
-            r = self.__results.get()
-        # still None, no more tasks to do
+        r = self.__fetch()
+        # no more tasks to do
         if r is None: raise StopIteration
-        # otherwise, something to return and reduce the counter
-        self.__shared_counter.add(-1)
-        return self._reduce_func(r)
+        return _reduce_result(r[1], self._reduce_func, self.__shm_pool)
 
     def __len__(self):
         return max(self._length.value, 0)
@@ -397,3 +968,344 @@ class MPI(SelfIterator):
             raise Exception('The MPI already finished, call copy() to '
                             'replicate this MPI, and re-run it if you want.')
         return iter(self)
+
+
+class _PoolIterator(SelfIterator):
+    """ Iterator over the results of 1 run of the `WorkerPool` """
+
+    def __init__(self, pool, run_id, reduce_func):
+        super(_PoolIterator, self).__init__()
+        self._pool = pool
+        self._run_id = run_id
+        self._reduce_func = reduce_func
+
+    def _next(self):
+        try:
+            return self._pool._next_result(self._run_id, self._reduce_func)
+        except StopIteration:
+            raise
+        except Exception:
+            # a process failed, cancel the remaining jobs of this run
+            self._is_finished = True
+            self._finalize()
+            raise
+
+    @property
+    def workers_time(self):
+        return self._pool.workers_time
+
+    def _finalize(self):
+        self._pool._cancel(self._run_id)
+
+    def __len__(self):
+        if self._pool.running_id != self._run_id:
+            return 0
+        return max(self._pool._length.value, 0)
+
+
+class WorkerPool(object):
+    """ Long-lived multiprocessing pool, the processes are forked only
+    once, then, receive new job lists for every `run`, hence, all the
+    state (opened memmap, recipes, ...) stays warm between epochs.
+
+    Parameters
+    ----------
+    map_func: callable
+        take a list of jobs as input (i.e. map_func([job1, job2, ...])),
+        the length of this list is determined by `buffer_size`
+    prepare_func: callable, None
+        called inside each process with the `context` given to `run`
+        before processing the jobs of a new run (e.g. reseed the recipes).
+    ncpu, buffer_size, maximum_queue_size, maximum_queue_bytes,
+    shm_slot_size, shm_nb_slots, ordered, reorder_window, dynamic, job_cost,
+    copy_results:
+        the same as `MPI`
+
+    Example
+    -------
+    >>> pool = WorkerPool(lambda jobs: [i + 1 for i in jobs], ncpu=2)
+    >>> for epoch in range(3):
+    >>>     for i in pool.run(list(range(12))):
+    >>>         print(i)
+    >>> pool.close()
+
+    Note
+    ----
+    Only 1 run is active at a time, starting a new run cancels the
+    unfinished one (its remaining results are discarded).
+    """
+
+    def __init__(self, map_func, prepare_func=None,
+                 ncpu=1, buffer_size=1, maximum_queue_size=144,
+                 maximum_queue_bytes=None, shm_slot_size=None, shm_nb_slots=None,
+                 ordered=False, reorder_window=None, dynamic=False, job_cost=None,
+                 copy_results=False):
+        super(WorkerPool, self).__init__()
+        if not callable(map_func):
+            raise Exception('"map_func" must be callable')
+        if prepare_func is not None and not callable(prepare_func):
+            raise Exception('"prepare_func" must be callable or None')
+        self._map_func = map_func
+        self._prepare_func = prepare_func
+        if ncpu is None:
+            ncpu = cpu_count() - 1
+        self._ncpu = max(min(ncpu, 2 * cpu_count() - 1), 1)
+        self._buffer_size = buffer_size
+        # ====== shared objects (created before forking) ====== #
+        self._running_id = RawValue('l', -1)
+        self._length = SharedCounter(0)
+        self._budget = QueueBudget(maximum_items=maximum_queue_size,
+                                   maximum_bytes=maximum_queue_bytes)
+        self._shm_pool = None
+        if shm_slot_size is not None:
+            if shm_nb_slots is None:
+                shm_nb_slots = 2 * self._ncpu + 2
+            self._shm_pool = SharedArrayPool(shm_nb_slots, shm_slot_size)
+        self._ordered = bool(ordered)
+        self._window = None
+        if self._ordered:
+            self._window = ChunkWindow(2 * self._ncpu if reorder_window is None
+                                       else reorder_window)
+        if job_cost is not None and not callable(job_cost):
+            raise ValueError('"job_cost" must be callable or None')
+        if job_cost is not None and self._ordered:
+            raise ValueError('Longest-first scheduling (i.e. "job_cost") is not '
+                             'supported in ordered mode.')
+        self._job_cost = job_cost
+        self._copy_results = bool(copy_results)
+        self._job_queue = SharedJobQueue() if dynamic else None
+        self._workers_time = WorkersTime(self._ncpu)
+        self._results = Queue(maxsize=0)
+        self._tasks = [Queue(maxsize=0) for i in range(self._ncpu)]
+        # ====== main process states ====== #
+        self._ordered_results = None
+        self._processes = None
+        self._nb_runs = 0
+        self._nb_working_processes = 0
+        self._closed = False
+
+    @property
+    def ncpu(self):
+        return self._ncpu
+
+    @property
+    def ordered(self):
+        return self._ordered
+
+    @property
+    def dynamic(self):
+        return self._job_queue is not None
+
+    @property
+    def running_id(self):
+        return self._running_id.value
+
+    @property
+    def workers_time(self):
+        """ list of (busy, idle) time in seconds of each process during
+        the last run """
+        return self._workers_time.summary()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _start(self):
+        running_id = self._running_id
+        length = self._length
+        budget = self._budget
+        shm_pool = self._shm_pool
+        return_queue = self._results
+        window = self._window
+        job_queue = self._job_queue
+        workers_time = self._workers_time
+        copy_results = self._copy_results
+
+        def wrapped_worker(worker_id, task_queue):
+            while True:
+                task = task_queue.get()
+                if task is None: # closing signal
+                    break
+                run_id, context, chunks = task
+                is_valid = lambda: running_id.value == run_id
+                workers_time.start(worker_id)
+                if job_queue is not None:
+                    chunks = job_queue.pull(chunks, run_id)
+                try:
+                    # always prepare, the same as a freshly forked process
+                    if self._prepare_func is not None:
+                        self._prepare_func(context)
+                    for seq, t in chunks:
+                        if window is not None:
+                            window.wait(seq, is_valid)
+                        if not is_valid(): # cancelled
+                            break
+                        length.add(-len(t))
+                        ret = _timed_map(self._map_func, t, workers_time, worker_id)
+                        for r in ret:
+                            if r is None:
+                                continue
+                            nbytes = _nbytes(r)
+                            budget.acquire(nbytes)
+                            if not is_valid():
+                                budget.release(nbytes)
+                                break
+                            if shm_pool is not None and shm_pool.is_transferable(r):
+                                r = shm_pool.write(r)
+                            elif copy_results:
+                                r = _copy_result(r)
+                            return_queue.put((run_id, seq, nbytes, r))
+                        del ret
+                        # ending signal of the chunk
+                        if window is not None:
+                            return_queue.put((run_id, seq, 0, None))
+                except Exception:
+                    return_queue.put((run_id, None, 0,
+                        _WorkerError(worker_id, traceback.format_exc())))
+                # ending signal of this run
+                workers_time.stop(worker_id)
+                return_queue.put((run_id, None, 0, None))
+        self._processes = [Process(target=wrapped_worker, args=(i, q))
+                           for i, q in enumerate(self._tasks)]
+        for p in self._processes:
+            p.daemon = True
+            p.start()
+
+    def run(self, jobs, context=None, reduce_func=None):
+        """ Distribute new `jobs` to the processes
+
+        Parameters
+        ----------
+        jobs: list
+            list of jobs for `map_func`
+        context: object
+            picklable object given to `prepare_func` in each process
+        reduce_func: callable, None
+            applied in the main process on every returned result
+
+        Return
+        ------
+        iterator over the results of this run
+        """
+        if self._closed:
+            raise Exception('The WorkerPool is closed.')
+        if reduce_func is None: reduce_func = lambda x: x
+        if not callable(reduce_func):
+            raise Exception('"reduce_func" must be callable or None')
+        if self._processes is None:
+            self._start()
+        # ====== new run, cancel the old one ====== #
+        run_id = self._nb_runs
+        self._nb_runs += 1
+        self._running_id.value = run_id
+        with self._length.lock:
+            self._length.val.value = len(jobs)
+        # ====== send jobs to each process ====== #
+        buffer_size = self._buffer_size
+        self._workers_time.reset()
+        if self._ordered:
+            self._window.reset()
+        if self._job_queue is not None:
+            chunks = _sequenced_chunks(jobs, buffer_size)
+            if self._job_cost is not None:
+                chunks = _longest_first(chunks, self._job_cost)
+            # every process receives all the chunks, and pulls them
+            # one by one from the shared job queue
+            self._job_queue.reset(len(chunks), run_id)
+            segments = [chunks] * self._ncpu
+            if self._ordered:
+                self._ordered_results = _OrderedResults(len(chunks), self._window)
+        elif self._ordered:
+            chunks = _sequenced_chunks(jobs, buffer_size)
+            segments = [chunks[i::self._ncpu] for i in range(self._ncpu)]
+            self._ordered_results = _OrderedResults(len(chunks), self._window)
+        else:
+            segments = segment_list(jobs, n_seg=self._ncpu)
+            segments += [[]] * (self._ncpu - len(segments))
+            segments = [[(None, j[i:i + buffer_size])
+                         for i in range(0, len(j), buffer_size)]
+                        for j in segments]
+        for q, j in zip(self._tasks, segments):
+            q.put((run_id, context, j))
+        self._nb_working_processes = self._ncpu
+        return _PoolIterator(self, run_id, reduce_func)
+
+    def _cancel(self, run_id):
+        if self._running_id.value == run_id:
+            self._running_id.value = -1
+            # wake up the processes waiting for the cancelled run
+            if self._window is not None:
+                self._window.wake()
+
+    def _fetch(self, run_id):
+        """ Return (seq, result) of given run, or None if all the processes
+        finished this run """
+        while self._nb_working_processes > 0:
+            rid, seq, nbytes, r = self._results.get()
+            if isinstance(r, _WorkerError):
+                if rid != run_id:
+                    continue
+                raise Exception('Exception in process %d of WorkerPool:\n%s' %
+                                (r.worker_id, r.trace))
+            if r is None:
+                if rid != run_id:
+                    continue
+                if seq is None: # ending signal of a process
+                    self._nb_working_processes -= 1
+                    continue
+                return seq, r # ending signal of a chunk
+            self._budget.release(nbytes)
+            # discard the results of cancelled runs
+            if rid != run_id:
+                if isinstance(r, _SlotDescriptor):
+                    self._shm_pool.release(r)
+                continue
+            return seq, r
+        return None
+
+    def _next_result(self, run_id, reduce_func):
+        if self._running_id.value != run_id:
+            raise StopIteration
+        if self._ordered:
+            ordered = self._ordered_results
+            while True:
+                found, r = ordered.pop()
+                if found:
+                    return _reduce_result(r, reduce_func, self._shm_pool)
+                if ordered.finished:
+                    break
+                r = self._fetch(run_id)
+                if r is None:
+                    break
+                ordered.add(r[0], r[1], self._shm_pool)
+        else:
+            r = self._fetch(run_id)
+            if r is not None:
+                return _reduce_result(r[1], reduce_func, self._shm_pool)
+        self._cancel(run_id)
+        raise StopIteration
+
+    def close(self):
+        """ Stop all the processes, the pool cannot be used anymore """
+        if self._closed:
+            return
+        self._closed = True
+        self._running_id.value = -1
+        if self._window is not None:
+            self._window.wake()
+        if self._processes is not None:
+            for q in self._tasks:
+                q.put(None)
+            for p in self._processes:
+                # processes might be blocked waiting for the consumer
+                p.join(timeout=0.2)
+                if p.is_alive():
+                    p.terminate()
+        for q in self._tasks:
+            q.close()
+        self._results.close()
+        if self._shm_pool is not None:
+            self._shm_pool.close()
+
+    def __del__(self):
+        self.close()